@@ -3,10 +3,19 @@
 
 from __future__ import division, print_function
 import collections
+import itertools
+import os
 import utility
 from smt.ibmmodel import ibmmodel2
+from smt.ibmmodel import bidirectional as bidirectional_ibm
+from smt.ibmmodel.modelfile import save_model, load_model
+from smt.utils.vocabulary import Vocabulary
+from smt.utils.corpuscache import CorpusCache
+from smt.utils.utility import DedupedCorpus
+from smt.utils.utility import filter_corpus
 from smt.phrase import word_alignment
 from smt.phrase import phrase_extract
+from smt.phrase import alignfile
 from progressline import ProgressLine
 from tables import Tables
 # import SQLAlchemy
@@ -36,13 +45,111 @@ def create_corpus(db="sqlite:///:memory:",
                "lang2": lang2method(item.lang2)}
 
 
-def create_train_db(transfrom=2,
-                    transto=1,
-                    lang1method=lambda x: x,
-                    lang2method=lambda x: x,
-                    db="sqlite:///:memory:",
-                    limit=None,
-                    loop_count=1000):
+def build_corpus_cache(path,
+                       lang1method=lambda x: x,
+                       lang2method=lambda x: x,
+                       db="sqlite:///:memory:",
+                       limit=None):
+    """
+    tokenize the sentence table once into the CorpusCache path,
+    which the training and extraction stages read instead of
+    querying and tokenizing the table again
+    """
+    corpus = create_corpus(db=db, limit=limit,
+                           lang1method=lang1method,
+                           lang2method=lang2method)
+    return CorpusCache.build(path,
+                             ((item["lang1"], item["lang2"])
+                              for item in corpus))
+
+
+def model_path(model_dir, transfrom, transto):
+    """path of the binary IBM model file of a direction"""
+    return os.path.join(model_dir,
+                        "from{0}to{1}.ibm".format(transfrom, transto))
+
+
+# models loaded by db_viterbi_alignment, by (path, init_val), with
+# the (st_mtime_ns, st_ino) of the file they were loaded from
+_models = {}
+
+
+def _load_model(path, init_val):
+    """
+    model of path, loaded once and again whenever the file is
+    replaced, e.g. by _store_model in this or another process
+    """
+    st = os.stat(path)
+    version = (st.st_mtime_ns, st.st_ino)
+    key = (path, init_val)
+    if key not in _models or _models[key][0] != version:
+        _models[key] = (version, load_model(path, floor=init_val))
+    return _models[key][1]
+
+
+def _forget_model(path):
+    """drop the models of path loaded by _load_model"""
+    for key in [key for key in _models if key[0] == path]:
+        del _models[key]
+
+
+class SentenceTableCorpus(object):
+    """
+    corpus streamed from the sentence table
+
+    every iteration runs a new query and fetches rows chunk_size at
+    a time, yielding (lang<transto> words, lang<transfrom> words), so
+    IBM training on it keeps only the model in memory.
+    """
+
+    def __init__(self,
+                 transfrom=2,
+                 transto=1,
+                 lang1method=lambda x: x,
+                 lang2method=lambda x: x,
+                 db="sqlite:///:memory:",
+                 limit=None,
+                 chunk_size=1000):
+        self.transfrom = transfrom
+        self.transto = transto
+        self.methods = {1: lang1method, 2: lang2method}
+        self.db = db
+        self.limit = limit
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        engine = create_engine(self.db)
+        # create session
+        Session = sessionmaker(bind=engine)
+        session = Session()
+
+        Sentence = Tables().get_sentence_table()
+        query = session.query(Sentence).order_by(Sentence.id)
+        if self.limit:
+            query = query.limit(self.limit)
+
+        try:
+            for item in query.yield_per(self.chunk_size):
+                langs = {1: item.lang1, 2: item.lang2}
+                to = self.methods[self.transto](langs[self.transto])
+                fr = self.methods[self.transfrom](langs[self.transfrom])
+                yield (to.split(), fr.split())
+        finally:
+            session.close()
+
+
+def _store_model(t, a, transfrom, transto, db, model_dir=None):
+    """
+    write t and a of the direction transfrom -> transto to the
+    model file in model_dir, or insert them into the
+    wordprob/wordalign tables of db
+    """
+    if model_dir is not None:
+        path = model_path(model_dir, transfrom, transto)
+        save_model(path, t, a)
+        _forget_model(path)
+        print("saved model: {0}".format(path))
+        return
     engine = create_engine(db)
     # create session
     Session = sessionmaker(bind=engine)
@@ -65,17 +172,6 @@ def create_train_db(transfrom=2,
     WordAlignment.__table__.create(engine)
     print("created table: {0}to{1}_wordalign".format(transfrom, transto))
 
-    # IBM learning
-    with ProgressLine(0.12, title='IBM Model learning...'):
-        # check arguments for carete_corpus
-        corpus = create_corpus(db=db, limit=limit,
-                               lang1method=lang1method,
-                               lang2method=lang2method)
-        sentences = [(item["lang{0}".format(transto)],
-                      item["lang{0}".format(transfrom)])
-                     for item in corpus]
-        t, a = ibmmodel2.train(sentences=sentences,
-                               loop_count=loop_count)
     # insert
     with ProgressLine(0.12, title='Inserting items into database...'):
         for (_to, _from), prob in t.items():
@@ -91,18 +187,208 @@ def create_train_db(transfrom=2,
         session.commit()
 
 
+def _store_kept_words(vocabs, db):
+    """
+    replace the keptword table of db with the words of vocabs
+    {lang: Vocabulary}, the vocabularies kept by filter_corpus,
+    whose unk the other words of lang were replaced with
+    """
+    engine = create_engine(db)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    KeptWord = Tables().get_keptword_table()
+    KeptWord.__table__.drop(engine, checkfirst=True)
+    KeptWord.__table__.create(engine)
+    for (lang, vocab) in sorted(vocabs.items()):
+        session.add_all(KeptWord(lang=lang, word=word,
+                                 unk=int(word == vocab.unk))
+                        for word in vocab)
+    session.commit()
+
+
+def _load_kept_words(db):
+    """
+    {lang: Vocabulary} stored by _store_kept_words, empty when the
+    models were trained on all the words
+    """
+    engine = create_engine(db)
+    KeptWord = Tables().get_keptword_table()
+    if not sqlalchemy.inspect(engine).has_table(KeptWord.__tablename__):
+        return {}
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    words = collections.defaultdict(list)
+    unks = {}
+    for item in session.query(KeptWord).order_by(KeptWord.id):
+        if item.unk:
+            unks[item.lang] = item.word
+        else:
+            words[item.lang].append(item.word)
+    session.close()
+    return {lang: Vocabulary(words[lang], unk=unk)
+            for (lang, unk) in unks.items()}
+
+
+def create_train_db(transfrom=2,
+                    transto=1,
+                    lang1method=lambda x: x,
+                    lang2method=lambda x: x,
+                    db="sqlite:///:memory:",
+                    limit=None,
+                    loop_count=1000,
+                    processes=1,
+                    tol=None,
+                    max_change=None,
+                    time_budget=None,
+                    stream=False,
+                    model_dir=None,
+                    vocabs=None,
+                    cache=None,
+                    dedup=False,
+                    filters=None,
+                    bidirectional=False,
+                    callback=None):
+    """
+    tol, max_change, time_budget
+        stopping criteria of the IBM training, see ibmmodel2._train
+    stream
+        if True, read the sentence table again on every EM iteration
+        instead of holding the corpus in memory
+    model_dir
+        if given, t and a are written to the binary model file
+        model_path(model_dir, transfrom, transto) instead of being
+        inserted row by row into the wordprob/wordalign tables
+    vocabs
+        {1: Vocabulary, 2: Vocabulary} of the two languages, shared
+        by the models of both directions
+    cache
+        CorpusCache to train on, see build_corpus_cache. its
+        vocabularies are used when vocabs is None
+    dedup
+        if True, duplicate sentence pairs are trained once, weighted
+        by their number of occurrences. only a digest of each pair is
+        held, see utility.DedupedCorpus, so it keeps stream and cache
+        corpora streamed
+    filters
+        keyword arguments of utility.filter_corpus, e.g.
+        {"max_length": 80, "max_ratio": 9, "vocab_size": 50000},
+        applied to the corpus before training. the words kept with
+        vocab_size are stored in the keptword table of db, and
+        replace the others with unk in the alignment stages too
+    bidirectional
+        if True, the models of transto -> transfrom are trained in
+        the same pass over the corpus and stored as well,
+        see ibmmodel.bidirectional
+    callback
+        called after every EM iteration, e.g.
+        ibmmodel.reporting.JSONLinesReporter("train.jsonl")
+    """
+    if vocabs is None:
+        if cache is not None:
+            vocabs = cache.vocabs
+        else:
+            vocabs = {1: Vocabulary(), 2: Vocabulary()}
+
+    # IBM learning
+    with ProgressLine(0.12, title='IBM Model learning...'):
+        stats = {}
+        if cache is not None:
+            corpus = cache.corpus(transfrom=transfrom, transto=transto)
+        elif stream:
+            corpus = SentenceTableCorpus(transfrom=transfrom,
+                                         transto=transto,
+                                         lang1method=lang1method,
+                                         lang2method=lang2method,
+                                         db=db,
+                                         limit=limit)
+        else:
+            # check arguments for carete_corpus
+            corpus = create_corpus(db=db, limit=limit,
+                                   lang1method=lang1method,
+                                   lang2method=lang2method)
+            corpus = [(item["lang{0}".format(transto)].split(),
+                       item["lang{0}".format(transfrom)].split())
+                      for item in corpus]
+        kept = {}
+        if filters:
+            report = {}
+            corpus = filter_corpus(corpus, report=report, **filters)
+            print("filtered corpus: kept {kept} of {pairs} pairs, "
+                  "dropped {too_long} too long and {bad_ratio} with a bad "
+                  "length ratio, replaced {unk_tokens} of {tokens} tokens "
+                  "with unk".format(**report))
+            if corpus.e_vocab is not None:
+                kept = {transto: corpus.e_vocab, transfrom: corpus.f_vocab}
+        # the alignment stages replace the same words with unk
+        _store_kept_words(kept, db)
+        weights = None
+        if dedup:
+            corpus = DedupedCorpus(corpus)
+            weights = corpus.weights
+            print("{0} distinct sentence pairs".format(len(corpus)))
+        if bidirectional:
+            models = bidirectional_ibm._train(corpus,
+                                              loop_count=loop_count,
+                                              processes=processes,
+                                              tol=tol,
+                                              max_change=max_change,
+                                              time_budget=time_budget,
+                                              stats=stats,
+                                              e_vocab=vocabs[transto],
+                                              f_vocab=vocabs[transfrom],
+                                              weights=weights,
+                                              callback=callback)
+            directions = [(transfrom, transto, stats["f2e"]),
+                          (transto, transfrom, stats["e2f"])]
+        else:
+            models = [ibmmodel2._train(corpus,
+                                       loop_count=loop_count,
+                                       processes=processes,
+                                       tol=tol,
+                                       max_change=max_change,
+                                       time_budget=time_budget,
+                                       stats=stats,
+                                       e_vocab=vocabs[transto],
+                                       f_vocab=vocabs[transfrom],
+                                       weights=weights,
+                                       callback=callback)]
+            directions = [(transfrom, transto, stats)]
+    for ((t, a), (_from, _to, _stats)) in zip(models, directions):
+        print("{0}to{1}: IBM Model 1: {2} iterations, "
+              "IBM Model 2: {3} iterations".format(
+                  _from, _to, _stats["ibmmodel1"]["iterations"],
+                  _stats["iterations"]))
+        _store_model(t, a, _from, _to, db, model_dir)
+
+
 def db_viterbi_alignment(es, fs,
                          transfrom=2,
                          transto=1,
                          db="sqlite:///:memory:",
-                         init_val=1.0e-10):
+                         init_val=1.0e-10,
+                         model_dir=None,
+                         kept=None):
     """
     Calculating viterbi_alignment using specified database.
 
     Arguments:
         trans:
             it can take "en2ja" or "ja2en"
+        model_dir:
+            if given, read t and a from the memory-mapped model file
+            written by create_train_db instead of the database
+        kept:
+            {lang: Vocabulary} of _load_kept_words(db), whose unk
+            replaces the words the models were not trained on
     """
+    if kept:
+        es = kept[transto].unk_words(es)
+        fs = kept[transfrom].unk_words(fs)
+    if model_dir is not None:
+        t, a = _load_model(model_path(model_dir, transfrom, transto),
+                           init_val)
+        return ibmmodel2.viterbi_alignment(es, fs, t, a)
+
     engine = create_engine(db)
     # create session
     Session = sessionmaker(bind=engine)
@@ -156,7 +442,8 @@ def db_show_matrix(es, fs,
                    transfrom=2,
                    transto=1,
                    db="sqlite:///:memory:",
-                   init_val=0.00001):
+                   init_val=0.00001,
+                   model_dir=None):
     '''
     print matrix according to viterbi alignment like
           fs
@@ -182,7 +469,8 @@ def db_show_matrix(es, fs,
                                  transfrom=transfrom,
                                  transto=transto,
                                  db=db,
-                                 init_val=init_val).items()
+                                 init_val=init_val,
+                                 model_dir=model_dir).items()
     m = len(es)
     n = len(fs)
     return utility.matrix(m, n, max_a)
@@ -190,8 +478,12 @@ def db_show_matrix(es, fs,
 
 def _db_symmetrization(lang1s, lang2s,
                        init_val=1.0e-10,
-                       db="sqlite:///:memory:"):
+                       db="sqlite:///:memory:",
+                       model_dir=None,
+                       kept=None):
     '''
+    kept
+        see db_viterbi_alignment
     '''
     transfrom = 2
     transto = 1
@@ -199,12 +491,16 @@ def _db_symmetrization(lang1s, lang2s,
                                  transfrom=transfrom,
                                  transto=transto,
                                  db=db,
-                                 init_val=init_val).items()
+                                 init_val=init_val,
+                                 model_dir=model_dir,
+                                 kept=kept).items()
     rev_trans = db_viterbi_alignment(lang2s, lang1s,
                                      transfrom=transto,
                                      transto=transfrom,
                                      db=db,
-                                     init_val=init_val).items()
+                                     init_val=init_val,
+                                     model_dir=model_dir,
+                                     kept=kept).items()
     return word_alignment.alignment(lang1s, lang2s, trans, rev_trans)
 
 
@@ -212,26 +508,90 @@ def db_phrase_extract(lang1, lang2,
                       lang1method=lambda x: x,
                       lang2method=lambda x: x,
                       init_val=1.0e-10,
-                      db="sqlite:///:memory:"):
+                      db="sqlite:///:memory:",
+                      model_dir=None):
     lang1s = lang1method(lang1).split()
-    lang2s = lang1method(lang2).split()
+    lang2s = lang2method(lang2).split()
     alignment = _db_symmetrization(lang1s, lang2s,
                                    init_val=init_val,
-                                   db=db)
+                                   db=db,
+                                   model_dir=model_dir,
+                                   kept=_load_kept_words(db))
     return phrase_extract.phrase_extract(lang1s, lang2s, alignment)
 
 
+def _sentence_pairs(session, limit=None,
+                    lang1method=lambda x: x,
+                    lang2method=lambda x: x,
+                    cache=None):
+    '''tokenized (lang1s, lang2s) pairs of the sentence table or cache'''
+    if cache is not None:
+        return itertools.islice(cache.corpus(transfrom=2, transto=1),
+                                limit)
+    Sentence = Tables().get_sentence_table()
+    query = session.query(Sentence)[:limit] if limit \
+        else session.query(Sentence)
+    return ((lang1method(item.lang1).split(),
+             lang2method(item.lang2).split()) for item in query)
+
+
+def create_alignment_file(path,
+                          limit=None,
+                          lang1method=lambda x: x,
+                          lang2method=lambda x: x,
+                          init_val=1.0e-10,
+                          db="sqlite:///:memory:",
+                          model_dir=None,
+                          cache=None):
+    """
+    write the symmetrized alignment of every sentence pair to path,
+    one line per pair in the Pharaoh format, see alignfile. the file
+    only appears once complete, so create_phrase_db(alignments=path)
+    can be run, or rerun, on its own afterwards
+    return
+        number of alignments written
+    """
+    engine = create_engine(db)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    pairs = _sentence_pairs(session, limit=limit,
+                            lang1method=lang1method,
+                            lang2method=lang2method, cache=cache)
+    kept = _load_kept_words(db)
+    alignments = (_db_symmetrization(lang1s, lang2s,
+                                     init_val=init_val,
+                                     db=db,
+                                     model_dir=model_dir,
+                                     kept=kept)
+                  for (lang1s, lang2s) in pairs)
+    with ProgressLine(0.12, title='aligning sentences...'):
+        count = alignfile.write_alignments(path, alignments)
+    print("created alignment file: {0}".format(path))
+    return count
+
+
 def create_phrase_db(limit=None,
                      lang1method=lambda x: x,
                      lang2method=lambda x: x,
                      init_val=1.0e-10,
-                     db="sqlite:///:memory:"):
+                     db="sqlite:///:memory:",
+                     model_dir=None,
+                     cache=None,
+                     alignments=None):
+    """
+    cache
+        CorpusCache whose tokenized sentences are read instead of
+        the sentence table, see build_corpus_cache
+    alignments
+        alignment file written by create_alignment_file with the same
+        limit, read line by line instead of aligning the sentences
+        with the models
+    """
     engine = create_engine(db)
     # create session
     Session = sessionmaker(bind=engine)
     session = Session()
     # tables
-    Sentence = Tables().get_sentence_table()
     Phrase = Tables().get_phrase_table()
 
     # create table for word probability
@@ -239,19 +599,27 @@ def create_phrase_db(limit=None,
     Phrase.__table__.create(engine)
     print("created table: phrase")
 
-    query = session.query(Sentence)[:limit] if limit \
-        else session.query(Sentence)
+    pairs = _sentence_pairs(session, limit=limit,
+                            lang1method=lang1method,
+                            lang2method=lang2method, cache=cache)
+    if alignments is None:
+        kept = _load_kept_words(db)
+        aligned = ((lang1s, lang2s,
+                    _db_symmetrization(lang1s, lang2s,
+                                       init_val=init_val,
+                                       db=db,
+                                       model_dir=model_dir,
+                                       kept=kept))
+                   for (lang1s, lang2s) in pairs)
+    else:
+        aligned = phrase_extract.zip_alignments(
+            pairs, alignfile.read_alignments(alignments))
 
     with ProgressLine(0.12, title='extracting phrases...'):
-        for item in query:
-            lang1 = item.lang1
-            lang2 = item.lang2
-            print("  ", lang1, lang2)
-            phrases = db_phrase_extract(lang1, lang2,
-                                        lang1method=lang1method,
-                                        lang2method=lang2method,
-                                        init_val=init_val,
-                                        db=db)
+        for (lang1s, lang2s, alignment) in aligned:
+            print("  ", u" ".join(lang1s), u" ".join(lang2s))
+            phrases = phrase_extract.phrase_extract(lang1s, lang2s,
+                                                    alignment)
             for lang1ps, lang2ps in phrases:
                 lang1p = u" ".join(lang1ps)
                 lang2p = u" ".join(lang2ps)
@@ -368,27 +736,105 @@ def createdb(db=":memory:",
              init_val=1.0e-10,
              limit=None,
              loop_count=1000,
+             processes=1,
+             tol=None,
+             max_change=None,
+             time_budget=None,
+             stream=False,
+             model_dir=None,
+             cache_dir=None,
+             dedup=False,
+             filters=None,
+             bidirectional=True,
+             callback=None,
+             alignment_file=None,
              ):
+    """
+    tol, max_change, time_budget
+        stopping criteria of the IBM training, see ibmmodel2._train.
+        time_budget applies to each create_train_db call
+    cache_dir
+        if given, the sentence table is tokenized once into a
+        CorpusCache there, which every stage then reads
+    dedup, filters
+        corpus preprocessing before IBM training, see create_train_db
+    bidirectional
+        if True, both directions are trained in a single pass over
+        the corpus instead of one create_train_db call each
+    callback
+        called after every EM iteration, see create_train_db
+    alignment_file
+        if given, the symmetrized alignments are written there by
+        create_alignment_file, and the phrases extracted from it
+    """
     alchemydb = "sqlite:///{0}".format(db)
+    cache = None
+    vocabs = {1: Vocabulary(), 2: Vocabulary()}
+    if cache_dir is not None:
+        cache = build_corpus_cache(cache_dir,
+                                   lang1method=lang1method,
+                                   lang2method=lang2method,
+                                   db=alchemydb,
+                                   limit=limit)
+        vocabs = cache.vocabs
     create_train_db(transfrom=2,
                     transto=1,
                     lang1method=lang1method,
                     lang2method=lang2method,
                     db=alchemydb,
                     limit=limit,
-                    loop_count=loop_count)
-    create_train_db(transfrom=1,
-                    transto=2,
-                    lang1method=lang1method,
-                    lang2method=lang2method,
-                    db=alchemydb,
-                    limit=limit,
-                    loop_count=loop_count)
+                    loop_count=loop_count,
+                    processes=processes,
+                    tol=tol,
+                    max_change=max_change,
+                    time_budget=time_budget,
+                    stream=stream,
+                    model_dir=model_dir,
+                    vocabs=vocabs,
+                    cache=cache,
+                    dedup=dedup,
+                    filters=filters,
+                    bidirectional=bidirectional,
+                    callback=callback)
+    if not bidirectional:
+        create_train_db(transfrom=1,
+                        transto=2,
+                        lang1method=lang1method,
+                        lang2method=lang2method,
+                        db=alchemydb,
+                        limit=limit,
+                        loop_count=loop_count,
+                        processes=processes,
+                        tol=tol,
+                        max_change=max_change,
+                        time_budget=time_budget,
+                        stream=stream,
+                        model_dir=model_dir,
+                        vocabs=vocabs,
+                        cache=cache,
+                        dedup=dedup,
+                        filters=filters,
+                        callback=callback)
+    if model_dir is not None:
+        for (lang, vocab) in vocabs.items():
+            vocab.save(os.path.join(model_dir, "lang{0}.vocab".format(lang)))
+    if alignment_file is not None:
+        create_alignment_file(alignment_file,
+                              limit=limit,
+                              lang1method=lang1method,
+                              lang2method=lang2method,
+                              init_val=init_val,
+                              db=alchemydb,
+                              model_dir=model_dir,
+                              cache=cache)
     create_phrase_db(limit=limit,
                      lang1method=lang1method,
                      lang2method=lang2method,
                      init_val=init_val,
-                     db=alchemydb)
+                     db=alchemydb,
+                     model_dir=model_dir,
+                     cache=cache,
+                     alignments=alignment_file)
     create_phrase_count_view(db=db)
     create_phrase_prob(db=db)
 
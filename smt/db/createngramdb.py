@@ -13,8 +13,16 @@ from smt.langmodel.ngram import ngram
 import math
 
 
-def _create_ngram_count_db(lang, langmethod=lambda x: x,
-                           n=3, db="sqilte:///:memory:"):
+def _sentences(lang, langmethod=lambda x: x, db="sqilte:///:memory:",
+               cache=None):
+    """
+    words of the sentences of lang, read from the CorpusCache cache
+    when given instead of the sentence table
+    """
+    if cache is not None:
+        for sentences in cache.sentences(lang):
+            yield sentences
+        return
     engine = create_engine(db)
     # create session
     Session = sessionmaker(bind=engine)
@@ -22,14 +30,27 @@ def _create_ngram_count_db(lang, langmethod=lambda x: x,
 
     Sentence = Tables().get_sentence_table()
     query = session.query(Sentence)
-
-    ngram_dic = collections.defaultdict(float)
     for item in query:
         if lang == 1:
-            sentences = langmethod(item.lang1).split()
+            yield langmethod(item.lang1).split()
         elif lang == 2:
-            sentences = langmethod(item.lang2).split()
+            yield langmethod(item.lang2).split()
+
+
+def _create_ngram_count_db(lang, langmethod=lambda x: x,
+                           n=3, db="sqilte:///:memory:", vocab=None,
+                           cache=None):
+    """
+    vocab
+        if given, the n-grams are counted as tuples of the ids of
+        this Vocabulary instead of tuples of words
+    """
+    ngram_dic = collections.defaultdict(float)
+    for sentences in _sentences(lang, langmethod=langmethod, db=db,
+                                cache=cache):
         sentences = ["</s>", "<s>"] + sentences + ["</s>"]
+        if vocab is not None:
+            sentences = vocab.encode(sentences)
         ngrams = ngram(sentences, n)
         for tpl in ngrams:
             ngram_dic[tpl] += 1
@@ -38,7 +59,8 @@ def _create_ngram_count_db(lang, langmethod=lambda x: x,
 
 
 def create_ngram_count_db(lang, langmethod=lambda x: x,
-                          n=3, db="sqilte:///:memory:"):
+                          n=3, db="sqilte:///:memory:", vocab=None,
+                          cache=None):
     engine = create_engine(db)
     # create session
     Session = sessionmaker(bind=engine)
@@ -51,10 +73,14 @@ def create_ngram_count_db(lang, langmethod=lambda x: x,
     Trigram.__table__.drop(engine, checkfirst=True)
     Trigram.__table__.create(engine)
 
-    ngram_dic = _create_ngram_count_db(lang, langmethod=langmethod, n=n, db=db)
+    ngram_dic = _create_ngram_count_db(lang, langmethod=langmethod, n=n, db=db,
+                                       vocab=vocab, cache=cache)
 
     # insert items
-    for (first, second, third), count in ngram_dic.items():
+    for tpl, count in ngram_dic.items():
+        if vocab is not None:
+            tpl = vocab.decode(tpl)
+        first, second, third = tpl
         print(u"inserting {}, {}, {}".format(first, second, third))
         item = Trigram(first=first,
                        second=second,
@@ -65,7 +91,8 @@ def create_ngram_count_db(lang, langmethod=lambda x: x,
 
 
 def create_unigram_count_db(lang, langmethod=lambda x: x,
-                            db="sqilte:///:memory:"):
+                            db="sqilte:///:memory:", vocab=None,
+                            cache=None):
     engine = create_engine(db)
     # create session
     Session = sessionmaker(bind=engine)
@@ -73,25 +100,24 @@ def create_unigram_count_db(lang, langmethod=lambda x: x,
 
     # trigram table
     tablename = 'lang{}unigram'.format(lang)
-    Sentence = Tables().get_sentence_table()
     Unigram = Tables().get_unigram_table(tablename)
     # create table
     Unigram.__table__.drop(engine, checkfirst=True)
     Unigram.__table__.create(engine)
 
-    query = session.query(Sentence)
     ngram_dic = collections.defaultdict(int)
-    for item in query:
-        if lang == 1:
-            sentences = langmethod(item.lang1).split()
-        elif lang == 2:
-            sentences = langmethod(item.lang2).split()
+    for sentences in _sentences(lang, langmethod=langmethod, db=db,
+                                cache=cache):
+        if vocab is not None:
+            sentences = vocab.encode(sentences)
         ngrams = ngram(sentences, 1)
         for tpl in ngrams:
             ngram_dic[tpl] += 1
 
     # insert items
     for (first,), count in ngram_dic.items():
+        if vocab is not None:
+            first = vocab.words[first]
         print(u"inserting {}: {}".format(first, count))
         item = Unigram(first=first,
                        count=count)
@@ -263,17 +289,32 @@ def create_unigram_prob(lang, db=":memory:"):
 
 
 def create_ngram_db(lang, langmethod=lambda x: x,
-                    n=3, db=":memory:"):
+                    n=3, db=":memory:", vocab=None, cache=None):
+    """
+    vocab
+        Vocabulary of the language, e.g. the one saved by
+        createdb.createdb, used to count the n-grams by word id
+    cache
+        CorpusCache read instead of the sentence table, e.g. the
+        one built by createdb.createdb. its vocabulary of lang is
+        used when vocab is None
+    """
+    if cache is not None and vocab is None:
+        vocab = cache.vocabs[lang]
 
     sqlalchemydb = "sqlite:///{}".format(db)
     create_ngram_count_db(lang=lang, langmethod=langmethod,
                           n=n,
-                          db=sqlalchemydb)
+                          db=sqlalchemydb,
+                          vocab=vocab,
+                          cache=cache)
     create_ngram_count_without_last_view(lang=lang, db=db)
     create_ngram_prob(lang=lang, db=db)
 
     create_unigram_count_db(lang=lang, langmethod=langmethod,
-                            db=sqlalchemydb)
+                            db=sqlalchemydb,
+                            vocab=vocab,
+                            cache=cache)
     create_unigram_prob(lang=lang, db=db)
 
 
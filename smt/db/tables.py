@@ -43,6 +43,17 @@ class Tables(object):
 
         return WordAlignment
 
+    def get_keptword_table(self, tablename="keptword"):
+
+        class KeptWord(declarative_base()):
+            __tablename__ = tablename
+            id = Column(INTEGER, primary_key=True)
+            lang = Column(INTEGER)
+            word = Column(TEXT)
+            unk = Column(INTEGER)
+
+        return KeptWord
+
     def get_phrase_table(self, tablename="phrase"):
 
         class Phrase(declarative_base()):
@@ -0,0 +1,216 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import bisect
+from decimal import Decimal as D
+import numpy as np
+
+
+class AlignmentTable(object):
+    '''
+    alignment probability table a(i|j, l_e, l_f) of IBM Model 2
+
+    the parameters of every length pair (l_e, l_f) are one dense
+    array of shape (l_e, l_f), so that
+
+        a[(i, j, l_e, l_f)] == table.bucket(l_e, l_f)[j-1, i-1]
+
+    reading a length pair which has no array returns the uniform
+    default 1 / (l_f + 1) of ibmmodel2 without creating the array
+    '''
+
+    def __init__(self, buckets=None, dtype=np.float64):
+        self.buckets = {} if buckets is None else buckets
+        self.dtype = dtype
+
+    def default(self, l_f):
+        return 1 / (l_f + 1)
+
+    def bucket(self, l_e, l_f):
+        '''array of (l_e, l_f), created with the default if missing'''
+        try:
+            return self.buckets[(l_e, l_f)]
+        except KeyError:
+            arr = np.full((l_e, l_f), self.default(l_f), dtype=self.dtype)
+            self.buckets[(l_e, l_f)] = arr
+            return arr
+
+    def _find(self, key):
+        i, j, l_e, l_f = key
+        arr = self.buckets.get((l_e, l_f))
+        if arr is None or not (1 <= j <= l_e and 1 <= i <= l_f):
+            return None
+        return arr
+
+    def __getitem__(self, key):
+        i, j, l_e, l_f = key
+        arr = self._find(key)
+        return self.default(l_f) if arr is None else arr[j-1, i-1]
+
+    def get(self, key, default=None):
+        i, j, l_e, l_f = key
+        arr = self._find(key)
+        return default if arr is None else arr[j-1, i-1]
+
+    def __setitem__(self, key, value):
+        i, j, l_e, l_f = key
+        if not (1 <= j <= l_e and 1 <= i <= l_f):
+            raise KeyError(key)
+        self.bucket(l_e, l_f)[j-1, i-1] = value
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __len__(self):
+        return sum(arr.size for arr in self.buckets.values())
+
+    def __iter__(self):
+        for (l_e, l_f) in self.buckets:
+            for j in range(1, l_e + 1):
+                for i in range(1, l_f + 1):
+                    yield (i, j, l_e, l_f)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for arr in self.buckets.values():
+            for val in arr.ravel():
+                yield val
+
+    def items(self):
+        return zip(self, self.values())
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in self.buckets.values())
+
+
+class FrozenAlignment(object):
+    '''
+    read-only alignment probability table a(i|j, l_e, l_f)
+
+    (i, j, l_e, l_f) are packed into one int64 of 16 bits each (15
+    for l_e, below the sign bit) and kept sorted, so a lookup is a
+    binary search and never inserts.
+    the keys of a length pair are contiguous, sorted by j then i.
+    reading a missing key returns floor, or the uniform 1 / (l_f + 1)
+    of ibmmodel2 when floor is None.
+    data is a tuple (e.g. of Decimal) or a read-only numpy array
+    '''
+
+    def __init__(self, packed, data, floor=None):
+        self.packed = packed
+        self.data = data
+        self.floor = floor
+        self.decimal = not isinstance(data, np.ndarray)
+        self._packed = memoryview(packed)
+
+    def __getstate__(self):
+        return (self.packed, self.data, self.floor)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @staticmethod
+    def pack(i, j, l_e, l_f):
+        return (l_e << 48) | (l_f << 32) | (j << 16) | i
+
+    @staticmethod
+    def packable(i, j, l_e, l_f):
+        '''whether (i, j, l_e, l_f) is a key pack can hold'''
+        return 1 <= j <= l_e < 1 << 15 and 1 <= i <= l_f < 1 << 16
+
+    @classmethod
+    def from_items(cls, items, floor=None):
+        '''
+        build the table from ((i, j, l_e, l_f), probability) pairs.
+        Decimal probabilities stay Decimal, floor is converted to the
+        type of the probabilities. a key out of the range of pack
+        raises ValueError
+        '''
+        items = sorted((cls._checked_pack(key), val) for (key, val) in items)
+        keys = np.array([key for (key, _) in items], dtype=np.int64)
+        values = [val for (_, val) in items]
+        if values and not isinstance(values[0], D):
+            data = np.array(values, dtype=np.float64)
+            data.setflags(write=False)
+            if floor is not None:
+                floor = float(floor)
+        else:
+            data = tuple(values)
+            if floor is not None:
+                floor = D(str(floor))
+        keys.setflags(write=False)
+        return cls(keys, data, floor)
+
+    @classmethod
+    def _checked_pack(cls, key):
+        if not cls.packable(*key):
+            raise ValueError(
+                "alignment key (i, j, l_e, l_f) = {0} out of range: "
+                "1 <= j <= l_e < {1} and 1 <= i <= l_f < {2} "
+                "are required".format(key, 1 << 15, 1 << 16))
+        return cls.pack(*key)
+
+    def default(self, l_f):
+        if self.floor is not None:
+            return self.floor
+        if self.decimal:
+            return D(1) / D(l_f + 1)
+        return 1 / (l_f + 1)
+
+    def _find(self, key):
+        if not self.packable(*key):
+            return -1
+        packed = self.pack(*key)
+        pos = bisect.bisect_left(self._packed, packed)
+        if pos < len(self._packed) and self._packed[pos] == packed:
+            return pos
+        return -1
+
+    def __getitem__(self, key):
+        pos = self._find(key)
+        return self.default(key[3]) if pos < 0 else self.data[pos]
+
+    def get(self, key, default=None):
+        pos = self._find(key)
+        return default if pos < 0 else self.data[pos]
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __len__(self):
+        return len(self.packed)
+
+    def __iter__(self):
+        for packed in self.packed.tolist():
+            yield (packed & 0xffff, (packed >> 16) & 0xffff,
+                   packed >> 48, (packed >> 32) & 0xffff)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return iter(self.data)
+
+    def items(self):
+        return zip(self, self.data)
+
+    def matrix(self, l_e, l_f):
+        '''a(i|j, l_e, l_f) as a float array of shape (l_e, l_f)'''
+        arr = np.full((l_e, l_f), float(self.default(l_f)))
+        base = self.pack(0, 0, l_e, l_f)
+        lo, hi = np.searchsorted(self.packed, [base, base + (1 << 32)])
+        keys = self.packed[lo:hi]
+        arr[((keys >> 16) & 0xffff) - 1, (keys & 0xffff) - 1] = \
+            np.asarray(self.data[lo:hi], dtype=np.float64)
+        return arr
+
+    @property
+    def nbytes(self):
+        '''approximate size of the keys and the probabilities'''
+        if isinstance(self.data, np.ndarray):
+            return self.packed.nbytes + self.data.nbytes
+        return self.packed.nbytes + 8 * len(self.data)
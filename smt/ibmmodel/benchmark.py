@@ -0,0 +1,216 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from smt.ibmmodel import ibmmodel1
+from smt.ibmmodel import ibmmodel2
+from smt.ibmmodel import diagonal
+from smt.ibmmodel import bidirectional
+from smt.ibmmodel import reporting
+from smt.utils.synthetic import synthetic_corpus
+
+# engine name -> function(corpus, loop_count, callback, processes)
+ENGINES = {
+    "ibmmodel1": lambda corpus, n, callback, processes: ibmmodel1._train(
+        corpus, n, processes=processes, callback=callback),
+    "ibmmodel1-numpy": lambda corpus, n, callback, processes:
+        ibmmodel1._train_numpy(corpus, n, callback=callback),
+    "ibmmodel2": lambda corpus, n, callback, processes: ibmmodel2._train(
+        corpus, n, processes=processes, callback=callback),
+    "ibmmodel2-numpy": lambda corpus, n, callback, processes:
+        ibmmodel2._train_numpy(corpus, n, callback=callback),
+    "diagonal": lambda corpus, n, callback, processes: diagonal._train(
+        corpus, n, callback=callback),
+    # the alignment is measured with the f2e model
+    "bidirectional": lambda corpus, n, callback, processes:
+        bidirectional._train(corpus, n, processes=processes,
+                             callback=callback)[0],
+}
+
+
+def _viterbi(pairs, t, a):
+    '''alignments per second of viterbi_alignment and of the batch one'''
+    start = time.time()
+    for (es, fs) in pairs:
+        ibmmodel2.viterbi_alignment(es, fs, t, a)
+    single = time.time() - start
+    start = time.time()
+    for _ in ibmmodel2.viterbi_alignment_batch(pairs, t, a):
+        pass
+    batch = time.time() - start
+    return {"viterbi_per_sec": len(pairs) / single if single else None,
+            "viterbi_batch_per_sec": len(pairs) / batch if batch else None}
+
+
+def benchmark(corpus, engines=("ibmmodel1-numpy", "ibmmodel2-numpy"),
+              loop_count=3, processes=1, viterbi_pairs=1000, memory=True):
+    '''
+    train every engine of engines on corpus for loop_count iterations
+    return
+        one dictionary per engine:
+            engine              name in ENGINES
+            train_seconds       wall time of the whole training
+            iterations          model, iteration, e_step, m_step and
+                                sentences_per_sec of every iteration
+                                (and direction for bidirectional)
+            sentences_per_sec   mean over the iterations
+            peak_bytes          peak resident memory of the training,
+                                run in a fresh process for each engine,
+                                None if memory is False
+            worker_peak_bytes   that of the largest worker process,
+                                None without workers
+            viterbi_per_sec,    alignments per second of the first
+            viterbi_batch_per_sec   viterbi_pairs pairs with the model,
+                                for the engines training alignments
+    '''
+    results = []
+    pairs = list(corpus[:viterbi_pairs])
+    for name in engines:
+        args = (name, corpus, loop_count, processes, pairs, memory)
+        results.append(_in_subprocess(args) if memory
+                       else _engine_result(*args))
+    return results
+
+
+def _engine_result(name, corpus, loop_count, processes, pairs, memory):
+    '''the result of benchmark for the engine name'''
+    train = ENGINES[name]
+    infos = []
+    start = time.time()
+    model = train(corpus, loop_count, infos.append, processes)
+    elapsed = time.time() - start
+    iterations = []
+    for info in infos:
+        seconds = info["e_step"] + info["m_step"]
+        record = {key: info[key] for key in
+                  ("model", "iteration", "e_step", "m_step")}
+        if "direction" in info:
+            record["direction"] = info["direction"]
+        record["sentences_per_sec"] = (len(corpus) / seconds
+                                       if seconds else None)
+        iterations.append(record)
+    speeds = [r["sentences_per_sec"] for r in iterations
+              if r["sentences_per_sec"] is not None]
+    result = {"engine": name,
+              "train_seconds": elapsed,
+              "iterations": iterations,
+              "sentences_per_sec": (sum(speeds) / len(speeds)
+                                    if speeds else None),
+              "peak_bytes": reporting.max_rss() if memory else None,
+              "worker_peak_bytes": (reporting.max_rss(children=True)
+                                    or None) if memory else None}
+    if isinstance(model, tuple) and pairs:
+        result.update(_viterbi(pairs, *model))
+    return result
+
+
+def _child(conn, args):
+    try:
+        conn.send((True, _engine_result(*args)))
+    except BaseException as e:
+        conn.send((False, e))
+    finally:
+        conn.close()
+
+
+def _in_subprocess(args):
+    '''
+    _engine_result(*args) in a fresh process, so that its peak memory
+    is that of the engine alone
+    '''
+    # not a pool, whose daemonic workers could not start the workers
+    # of the engine
+    ctx = multiprocessing.get_context("spawn")
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(send, args))
+    proc.start()
+    send.close()
+    try:
+        ok, value = recv.recv()
+    except EOFError:
+        # died without sending, e.g. killed when out of memory
+        ok, value = False, None
+    finally:
+        recv.close()
+        proc.join()
+    if value is None:
+        raise RuntimeError("benchmark of {0} exited with code {1}".format(
+            args[0], proc.exitcode))
+    if not ok:
+        raise value
+    return value
+
+
+def _commit():
+    '''git commit of the source tree, or None'''
+    try:
+        out = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode("ascii").strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="measure the training and alignment speed of the "
+                    "IBM models on synthetic corpora")
+    parser.add_argument("--pairs", type=int, nargs="+", default=[1000],
+                        help="corpus sizes in sentence pairs")
+    parser.add_argument("--vocab-size", type=int, default=1000)
+    parser.add_argument("--mean-length", type=float, default=10)
+    parser.add_argument("--max-length", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engines", nargs="+",
+                        default=["ibmmodel1-numpy", "ibmmodel2-numpy"],
+                        choices=sorted(ENGINES))
+    parser.add_argument("--loop-count", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--viterbi-pairs", type=int, default=1000)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the peak memory measurement")
+    parser.add_argument("--output", help="json file, stdout by default")
+    args = parser.parse_args(argv)
+
+    runs = []
+    for n_pairs in args.pairs:
+        params = {"pairs": n_pairs,
+                  "vocab_size": args.vocab_size,
+                  "mean_length": args.mean_length,
+                  "max_length": args.max_length,
+                  "seed": args.seed}
+        corpus = synthetic_corpus(n_pairs, args.vocab_size,
+                                  args.mean_length, args.max_length,
+                                  seed=args.seed)
+        runs.append({"corpus": params,
+                     "results": benchmark(corpus, args.engines,
+                                          args.loop_count, args.processes,
+                                          args.viterbi_pairs,
+                                          not args.no_memory)})
+    report = {"commit": _commit(),
+              "time": time.time(),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "loop_count": args.loop_count,
+              "processes": args.processes,
+              "runs": runs}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as fd:
+            json.dump(report, fd, indent=2)
+
+
+if __name__ == '__main__':
+    main()
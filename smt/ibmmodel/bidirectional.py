@@ -0,0 +1,216 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import collections
+import itertools
+import time
+from smt.ibmmodel import ibmmodel1
+from smt.ibmmodel import ibmmodel2
+from smt.ibmmodel.atable import FrozenAlignment
+from smt.ibmmodel.convergence import Convergence
+from smt.ibmmodel import reporting
+from smt.ibmmodel import sharding
+from smt.ibmmodel.ttable import TTable, encoded_pairs
+from smt.utils import utility
+
+# f2e is trained on the pairs (es, fs) of the corpus, e2f on (fs, es)
+DIRECTIONS = ("f2e", "e2f")
+
+
+def _expected_counts(corpus, models, weights=None, encoded=False):
+    '''
+    E-step of both directions in a single pass over corpus.
+    models maps a direction to (t,) for IBM Model 1 or (t, a) for
+    IBM Model 2; directions missing from models are skipped.
+    corpus holds the (e ids, f ids) pairs of the f2e direction when
+    encoded is True
+    return
+        {direction: counters}, the counters being those returned by
+        ibmmodel1._expected_counts or ibmmodel2._expected_counts
+    '''
+    counts = {}
+    for (direction, tables) in models.items():
+        n = 2 * len(tables)
+        counts[direction] = [collections.defaultdict(int)
+                             for _ in range(n)] + [0.0, 0]
+    if weights is None:
+        weights = itertools.repeat(1)
+    # the e2f table has the vocabularies of the f2e one swapped
+    if encoded:
+        pairs = corpus
+    elif "f2e" in models:
+        t = models["f2e"][0]
+        pairs = encoded_pairs(corpus, t.e_vocab, t.f_vocab)
+    else:
+        t = models["e2f"][0]
+        pairs = encoded_pairs(corpus, t.f_vocab, t.e_vocab)
+    for ((e_ids, f_ids), w) in zip(pairs, weights):
+        for (direction, tables) in models.items():
+            if direction == "e2f":
+                (_es, _fs) = (f_ids, e_ids)
+            else:
+                (_es, _fs) = (e_ids, f_ids)
+            c = counts[direction]
+            c[-1] += w * len(_es)
+            if len(tables) == 1:
+                c[-2] = ibmmodel1._accumulate(_es, _fs, w, tables[0],
+                                              c[0], c[1], c[-2])
+            else:
+                c[-2] = ibmmodel2._accumulate(_es, _fs, w,
+                                              tables[0], tables[1],
+                                              c[0], c[1], c[2], c[3],
+                                              c[-2])
+    return {direction: tuple(c) for (direction, c) in counts.items()}
+
+
+def _shard_counts(models, pairs, weights):
+    '''E-step of a shard in a worker of _sharded_counts'''
+    counts = _expected_counts(pairs, models, weights, encoded=True)
+    results = {}
+    for (direction, c) in counts.items():
+        if len(c) == 4:
+            results[direction] = (sharding.count_arrays(c[0]), c[2], c[3])
+        else:
+            count_a = {FrozenAlignment.pack(*key): v
+                       for (key, v) in c[2].items()}
+            results[direction] = (sharding.count_arrays(c[0]),
+                                  sharding.count_arrays(count_a),
+                                  c[4], c[5])
+    return results
+
+
+def _sharded_counts(pool, corpus, models, shard_size, f2e, weights=None):
+    '''
+    E-step with the corpus split in shards of shard_size sentence pairs
+    over the workers of the sharding.ShardPool pool, the pairs being
+    encoded with the vocabularies of the f2e table. every shard is
+    read once and counted for both directions; partial counts are
+    summed in shard order
+    '''
+    manifest = pool.broadcast(models)
+    counts = {d: sharding.ShardCounts(tables[0])
+              for (d, tables) in models.items()}
+    for results in pool.map(_shard_counts, manifest, corpus, f2e,
+                            shard_size, weights):
+        for (d, result) in results.items():
+            counts[d].add(result)
+    return {d: c.result() for (d, c) in counts.items()}
+
+
+def _train(corpus, loop_count=1000, processes=1, shard_size=1000,
+           tol=None, max_change=None, time_budget=None, stats=None,
+           floor=None, e_vocab=None, f_vocab=None, weights=None,
+           prune=None, callback=None):
+    '''
+    train IBM Model 2 for both directions, t(e|f) on corpus [(es, fs)]
+    and t(f|e) on the reversed pairs, reading corpus once per
+    iteration for the two models
+
+    the e2f table is the transposed co-occurrence structure of the
+    f2e one, so the corpus is not reversed nor scanned again, and each
+    direction gets exactly the parameters of ibmmodel2._train.
+    processes, shard_size, floor, vocabularies, weights, prune and
+    callback are those of ibmmodel2._train; with processes > 1 the
+    workers are started once and every shard is counted for both
+    directions by the same worker.
+    tol, max_change and time_budget are checked for each direction,
+    which stops being updated when its own criterion is met.
+    stats is filled with stats["f2e"] and stats["e2f"], each
+    like the stats of ibmmodel2._train. callback is called for each
+    direction, whose name is the "direction" of its argument; the
+    E-step time is the one of the pass over the corpus for both
+    return
+        ((t_fe, a_fe), (t_ef, a_ef)): read-only tables of the f2e
+        and the e2f directions
+    '''
+    start = time.time()
+    stats = {} if stats is None else stats
+
+    def _counts(models):
+        if pool is None:
+            return _expected_counts(corpus, models, weights)
+        return _sharded_counts(pool, corpus, models, shard_size,
+                               tables["f2e"], weights)
+
+    pool = sharding.ShardPool(processes) if processes != 1 else None
+    try:
+        # IBM Model 1 initialization of t
+        t = TTable.from_corpus(corpus, ibmmodel1._uniform,
+                               e_vocab=e_vocab, f_vocab=f_vocab)
+        tables = {"f2e": t, "e2f": t.transposed(ibmmodel1._uniform)}
+        f_of_slot = {d: tables[d].row_ids().tolist() for d in DIRECTIONS}
+        conv = {}
+        for d in DIRECTIONS:
+            stats[d] = {"ibmmodel1": {}}
+            conv[d] = Convergence(tol, max_change, time_budget,
+                                  stats[d]["ibmmodel1"], start=start)
+        active = list(DIRECTIONS)
+        for _i in range(loop_count):
+            if not active:
+                break
+            e_start = time.time()
+            counts = _counts({d: (tables[d],) for d in active})
+            e_time = time.time() - e_start
+            for (d, (count, total, loglik, n_words)) in counts.items():
+                m_start = time.time()
+                change = ibmmodel1._maximize(tables[d], count, total,
+                                             f_of_slot[d])
+                if prune:
+                    tables[d], f_of_slot[d] = ibmmodel1._prune(
+                        tables[d], prune, conv[d].stats)
+                if callback is not None:
+                    callback(reporting.iteration_info(
+                        "ibmmodel1", _i + 1, e_time, time.time() - m_start,
+                        tables[d], None, loglik, n_words, direction=d))
+                if conv[d].update(loglik, n_words, change):
+                    active.remove(d)
+
+        # IBM Model 2
+        a = {d: ibmmodel2._keydefaultdict(ibmmodel2._uniform_alignment)
+             for d in DIRECTIONS}
+        for d in DIRECTIONS:
+            conv[d] = Convergence(tol, max_change, time_budget, stats[d],
+                                  start=start)
+        active = [d for d in DIRECTIONS
+                  if stats[d]["ibmmodel1"]["stopped_by"] != "time_budget"]
+        for _i in range(loop_count):
+            if not active:
+                break
+            e_start = time.time()
+            counts = _counts({d: (tables[d], a[d]) for d in active})
+            e_time = time.time() - e_start
+            for (d, (count, total, count_a, total_a,
+                     loglik, n_words)) in counts.items():
+                m_start = time.time()
+                change = ibmmodel2._maximize(tables[d], a[d], count, total,
+                                             count_a, total_a, f_of_slot[d])
+                if prune:
+                    tables[d], f_of_slot[d] = ibmmodel1._prune(
+                        tables[d], prune, conv[d].stats)
+                if callback is not None:
+                    callback(reporting.iteration_info(
+                        "ibmmodel2", _i + 1, e_time, time.time() - m_start,
+                        tables[d], a[d], loglik, n_words, direction=d))
+                if conv[d].update(loglik, n_words, change):
+                    active.remove(d)
+
+        return tuple((tables[d].freeze(floor),
+                      FrozenAlignment.from_items(a[d].items(), floor))
+                     for d in DIRECTIONS)
+
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def train(sentences, loop_count=1000, dedup=False, **kwargs):
+    '''
+    dedup
+        train duplicate sentence pairs once, see ibmmodel2.train
+    other keyword arguments are passed to _train
+    '''
+    corpus = utility.mkcorpus(sentences)
+    if dedup:
+        corpus, kwargs["weights"] = utility.dedup(corpus)
+    return _train(corpus, loop_count, **kwargs)
@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import json
+import os
+import shutil
+from decimal import Decimal as D
+import numpy as np
+from smt.ibmmodel.ttable import TTable
+
+VERSION = 1
+
+
+def save_checkpoint(path, stage, iteration, t, a=None, stats=None):
+    '''
+    save the training state to the directory path
+
+        meta.json          version, stage, iteration, stats, defaults
+        t_indptr.npy       \\
+        t_indices.npy       > t as the CSR arrays of TTable
+        t_data.npy         /
+        a_keys.npy         (i, j, l_e, l_f) rows of a
+        a_data.npy         values of a
+
+    Decimal values are stored as float64, which round-trips the 4
+    digits of the decimal context. the new checkpoint is written next
+    to path, then swapped in by renaming path to path + ".old" and the
+    new one to path. a crash between the two renames leaves only
+    path + ".old", which load_checkpoint reads instead, so a crash
+    while saving keeps the previous checkpoint
+    '''
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    decimal_data = not isinstance(t.data, np.ndarray)
+    meta = {"version": VERSION,
+            "stage": stage,
+            "iteration": iteration,
+            "decimal": decimal_data,
+            "t_default": str(t.default),
+            "stats": stats or {},
+            "e_words": list(t.e_words),
+            "f_words": list(t.f_words)}
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as fd:
+        json.dump(meta, fd, ensure_ascii=False)
+    np.save(os.path.join(tmp, "t_indptr.npy"), t.indptr)
+    np.save(os.path.join(tmp, "t_indices.npy"), t.indices)
+    np.save(os.path.join(tmp, "t_data.npy"),
+            np.asarray(t.data, dtype=np.float64 if decimal_data else None))
+    if a is not None:
+        keys = sorted(a.keys())
+        np.save(os.path.join(tmp, "a_keys.npy"),
+                np.array(keys, dtype=np.int32).reshape(-1, 4))
+        np.save(os.path.join(tmp, "a_data.npy"),
+                np.array([float(a[k]) for k in keys], dtype=np.float64))
+
+    old = path + ".old"
+    if os.path.exists(path):
+        # left by a crash while removing it
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        os.rename(path, old)
+    os.rename(tmp, path)
+    if os.path.exists(old):
+        shutil.rmtree(old)
+
+
+def load_checkpoint(path):
+    '''
+    load a checkpoint written by save_checkpoint, or the previous one
+    when saving it crashed before path was replaced.
+    the arrays are memory-mapped; probabilities are copied into the
+    mutable list (Decimal) or copy-on-write array (float) of t
+    return
+        dictionary with "stage", "iteration", "stats", "t" and
+        "a" (list of ((i, j, l_e, l_f), value), or None)
+    '''
+    if not os.path.exists(path) and os.path.exists(path + ".old"):
+        path = path + ".old"
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as fd:
+        meta = json.load(fd)
+    if meta["version"] != VERSION:
+        raise ValueError("unsupported checkpoint version: {}".format(
+            meta["version"]))
+
+    def _load(name, mode="r"):
+        return np.load(os.path.join(path, name), mmap_mode=mode)
+
+    data = _load("t_data.npy", "c")
+    if meta["decimal"]:
+        # repr gives back the shortest decimal string of the float
+        data = [D(repr(x)) for x in data.tolist()]
+        default = D(meta["t_default"])
+    else:
+        default = float(meta["t_default"])
+    t = TTable(meta["e_words"], meta["f_words"],
+               _load("t_indptr.npy"), _load("t_indices.npy"),
+               data, default)
+
+    a = None
+    if os.path.exists(os.path.join(path, "a_keys.npy")):
+        values = _load("a_data.npy").tolist()
+        if meta["decimal"]:
+            values = [D(repr(x)) for x in values]
+        a = list(zip(map(tuple, _load("a_keys.npy").tolist()), values))
+
+    return {"stage": meta["stage"],
+            "iteration": meta["iteration"],
+            "stats": meta["stats"],
+            "t": t,
+            "a": a}
@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import math
+import time
+
+
+class Convergence(object):
+    '''
+    stopping criteria for EM training
+
+    tol
+        stop when the relative change of the corpus log-likelihood
+        between two iterations is below tol
+    max_change
+        stop when no parameter moved by more than max_change
+    time_budget
+        stop when the training ran for time_budget seconds
+    stats
+        dictionary filled with
+            "iterations": number of iterations run
+            "loglikelihood": log-likelihood of each iteration
+            "perplexity": per-word perplexity of each iteration
+            "stopped_by": criterion which ended training, or None
+    '''
+
+    def __init__(self, tol=None, max_change=None, time_budget=None,
+                 stats=None, start=None):
+        self.tol = tol
+        self.max_change = max_change
+        self.time_budget = time_budget
+        self.start = time.time() if start is None else start
+        self.stats = {} if stats is None else stats
+        self.stats.update({"iterations": 0,
+                           "loglikelihood": [],
+                           "perplexity": [],
+                           "stopped_by": None})
+
+    def resume(self, stats):
+        '''
+        continue from the stats of a previous run.
+        a run ended by its time budget can go on, so only the
+        convergence criteria are kept.
+        return True when the previous run had converged
+        '''
+        self.stats.update(stats)
+        if self.stats["stopped_by"] == "time_budget":
+            self.stats["stopped_by"] = None
+        return self.stats["stopped_by"] is not None
+
+    def remaining(self):
+        '''seconds left in the time budget, or None'''
+        if self.time_budget is None:
+            return None
+        return self.time_budget - (time.time() - self.start)
+
+    def update(self, loglik, n_words, change=None):
+        '''
+        record an iteration whose E-step gave loglik over n_words
+        words and whose M-step moved parameters by at most change.
+        return True when training should stop
+        '''
+        history = self.stats["loglikelihood"]
+        prev = history[-1] if history else None
+        self.stats["iterations"] += 1
+        history.append(loglik)
+        self.stats["perplexity"].append(
+            math.exp(-loglik / n_words) if n_words else 1.0)
+
+        if (self.tol is not None and prev is not None and
+                abs(loglik - prev) <= self.tol * abs(prev)):
+            self.stats["stopped_by"] = "tol"
+        elif (self.max_change is not None and change is not None and
+                change <= self.max_change):
+            self.stats["stopped_by"] = "max_change"
+        elif self.time_budget is not None and self.remaining() <= 0:
+            self.stats["stopped_by"] = "time_budget"
+        return self.stats["stopped_by"] is not None
@@ -0,0 +1,152 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import math
+import time
+import numpy as np
+from smt.ibmmodel import ibmmodel1
+from smt.ibmmodel.convergence import Convergence
+from smt.ibmmodel import reporting
+from smt.ibmmodel.ttable import TTable
+from smt.utils import utility
+# the alignment of the diagonal model is read like the one of Model 2
+from smt.ibmmodel.ibmmodel2 import viterbi_alignment
+from smt.ibmmodel.ibmmodel2 import viterbi_alignment_batch
+
+
+class DiagonalAlignment(object):
+    '''
+    alignment distribution favouring the diagonal (Dyer et al., 2013)
+
+        a(i|j, l_e, l_f) = exp(tension * h(i, j, l_e, l_f)) / Z
+        h(i, j, l_e, l_f) = -|i / l_f - j / l_e|
+
+    the only parameter is tension, and Z has a closed form, so the
+    object can be read with the same (i, j, l_e, l_f) keys as the
+    Model 2 table while its size does not depend on the corpus
+    '''
+
+    min_tension = 0.1
+    max_tension = 14.0
+
+    def __init__(self, tension=4.0):
+        self.tension = tension
+
+    def h(self, l_e, l_f):
+        '''feature h as an array of shape (l_e, l_f)'''
+        j = np.arange(1, l_e + 1)[:, None]
+        i = np.arange(1, l_f + 1)[None, :]
+        return -np.abs(i / l_f - j / l_e)
+
+    def normalizer(self, j, l_e, l_f):
+        '''
+        Z for target position(s) j: two geometric series, over the
+        i left of the diagonal and over the i right of it
+        '''
+        if self.tension == 0:
+            return np.full(np.shape(j), float(l_f))
+        x = np.asarray(j) * l_f / l_e
+        i_floor = np.floor(x)
+        r = math.exp(-self.tension / l_f)
+        left = np.exp(self.tension * (i_floor - x) / l_f) * \
+            (1 - r ** i_floor) / (1 - r)
+        right = np.exp(-self.tension * (i_floor + 1 - x) / l_f) * \
+            (1 - r ** (l_f - i_floor)) / (1 - r)
+        return left + right
+
+    def matrix(self, l_e, l_f):
+        '''a(i|j, l_e, l_f) as an array of shape (l_e, l_f)'''
+        z = self.normalizer(np.arange(1, l_e + 1), l_e, l_f)
+        return np.exp(self.tension * self.h(l_e, l_f)) / z[:, None]
+
+    def expected_h(self, l_e, l_f):
+        '''sum over j of the expectation of h under a(.|j, l_e, l_f)'''
+        return (self.matrix(l_e, l_f) * self.h(l_e, l_f)).sum()
+
+    def __getitem__(self, key):
+        i, j, l_e, l_f = key
+        h = -abs(i / l_f - j / l_e)
+        return math.exp(self.tension * h) / \
+            float(self.normalizer(j, l_e, l_f))
+
+    def get(self, key, default=None):
+        i, j, l_e, l_f = key
+        if not (1 <= j <= l_e and 1 <= i <= l_f):
+            return default
+        return self[key]
+
+    def optimize(self, emp_feat, sizes, n_words, steps=8, rate=20.0):
+        '''
+        gradient steps on tension towards the expectation emp_feat of
+        h under the alignment posteriors. sizes maps (l_e, l_f) to
+        the number of sentence pairs of those lengths
+        '''
+        for _ in range(steps):
+            mod_feat = sum(n * self.expected_h(l_e, l_f)
+                           for ((l_e, l_f), n) in sizes.items())
+            tension = self.tension + (emp_feat - mod_feat) / n_words * rate
+            self.tension = min(max(tension, self.min_tension),
+                               self.max_tension)
+
+
+def _train(corpus, loop_count=5, dtype=np.float64, tension=4.0,
+           tol=None, max_change=None, time_budget=None, stats=None,
+           e_vocab=None, f_vocab=None, weights=None, callback=None):
+    '''
+    train t and the diagonal alignment jointly, starting from a
+    uniform t. corpus is grouped by length like ibmmodel2._train_numpy,
+    so few iterations are needed and each is a handful of array
+    operations per length pair. the other arguments are those of
+    ibmmodel2._train_numpy
+    return
+        (t, a): TTable of floats and DiagonalAlignment
+    '''
+    conv = Convergence(tol, max_change, time_budget, stats)
+    t = TTable.from_corpus(corpus, lambda n: 1/n, dtype=dtype,
+                           e_vocab=e_vocab, f_vocab=f_vocab)
+    slots, bucket_weights, n_words = ibmmodel1._bucket_slots(corpus, t,
+                                                             weights)
+    sizes = {key: w.sum() for (key, w) in bucket_weights.items()}
+    f_of_slot = t.row_ids()
+    a = DiagonalAlignment(tension)
+
+    for _i in range(loop_count):
+        e_start = time.time()
+        count = np.zeros(len(t))
+        loglik = 0.0
+        emp_feat = 0.0
+        for ((l_e, l_f), s) in slots.items():
+            w = bucket_weights[(l_e, l_f)]
+            p = t.data[s] * a.matrix(l_e, l_f)
+            s_total = p.sum(axis=2, keepdims=True)
+            c = p / s_total * w
+            count += np.bincount(s.ravel(), weights=c.ravel(),
+                                 minlength=len(t))
+            loglik += (np.log(s_total) * w).sum()
+            emp_feat += (c * a.h(l_e, l_f)).sum()
+        m_start = time.time()
+        change = ibmmodel1._estimate_numpy(t, count, f_of_slot)
+        tension = a.tension
+        a.optimize(emp_feat, sizes, n_words)
+        change = max(change, abs(a.tension - tension))
+        if callback is not None:
+            callback(reporting.iteration_info(
+                "diagonal", _i + 1, m_start - e_start,
+                time.time() - m_start, t, a, loglik, n_words))
+        if conv.update(float(loglik), n_words, change):
+            break
+
+    return (t, a)
+
+
+def train(sentences, loop_count=5, dedup=False, **kwargs):
+    '''
+    dedup
+        train duplicate sentence pairs once, see ibmmodel2.train
+    other keyword arguments are passed to _train
+    '''
+    corpus = utility.mkcorpus(sentences)
+    if dedup:
+        corpus, kwargs["weights"] = utility.dedup(corpus)
+    return _train(corpus, loop_count, **kwargs)
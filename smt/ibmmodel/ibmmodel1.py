@@ -3,58 +3,375 @@
 
 from operator import itemgetter
 import collections
+import itertools
+import math
+import time
 from smt.utils import utility
+from smt.ibmmodel.ttable import TTable, encoded_pairs
+from smt.ibmmodel import pruning
+from smt.ibmmodel import sharding
+from smt.ibmmodel import reporting
+from smt.ibmmodel.convergence import Convergence
+from smt.ibmmodel.checkpoint import save_checkpoint, load_checkpoint
 import decimal
 from decimal import Decimal as D
+import numpy as np
 
 # set deciaml context
 decimal.getcontext().prec = 4
 decimal.getcontext().rounding = decimal.ROUND_HALF_UP
 
 
-def _constant_factory(value):
-    '''define a local function for uniform probability initialization'''
-    #return itertools.repeat(value).next
-    return lambda: value
+def _uniform(n):
+    '''uniform probability over n f words'''
+    return D(1/n)
 
 
-def _train(corpus, loop_count=1000):
-    f_keys = set()
-    for (es, fs) in corpus:
-        for f in fs:
-            f_keys.add(f)
-    # default value provided as uniform probability)
-    t = collections.defaultdict(_constant_factory(D(1/len(f_keys))))
+def _expected_counts(corpus, t, weights=None, encoded=False):
+    '''
+    E-step over corpus, t holding Decimal or float values.
+    the counts of a pair are multiplied by its weight in weights.
+    corpus holds (e ids, f ids) pairs when encoded is True
+    return
+        (count, total, loglik, n_words): expected counts keyed by slot
+        of t and by f id, the log-likelihood of corpus and its number
+        of e words
+    '''
+    count = collections.defaultdict(int)
+    total = collections.defaultdict(int)
+    loglik = 0.0
+    n_words = 0
+    if weights is None:
+        weights = itertools.repeat(1)
+    pairs = corpus if encoded else encoded_pairs(corpus, t.e_vocab,
+                                                 t.f_vocab)
+    for ((e_ids, f_ids), w) in zip(pairs, weights):
+        n_words += w * len(e_ids)
+        loglik = _accumulate(e_ids, f_ids, w, t, count, total, loglik)
+    return count, total, loglik, n_words
+
+
+def _accumulate(e_ids, f_ids, w, t, count, total, loglik):
+    '''
+    add the expected counts of the pair of word ids (e_ids, f_ids) of
+    weight w to count and total
+    return
+        loglik plus the log-likelihood of the pair
+    '''
+    data = t.slot_data()
+    kept = t.sentence_slots(e_ids, f_ids)
+    for e_id in e_ids:
+        slots = [kept.get((e_id, f_id), -1) for f_id in f_ids]
+        # compute normalization, pruned pairs reading t.default
+        s_total = 0
+        for slot in slots:
+            s_total += data[slot] if slot >= 0 else t.default
+        for (f_id, slot) in zip(f_ids, slots):
+            if slot < 0:
+                continue
+            c = data[slot] / s_total
+            if w != 1:
+                c *= w
+            count[slot] += c
+            total[f_id] += c
+        # each f is aligned with probability 1 / len(fs)
+        loglik += w * (math.log(s_total) - math.log(len(f_ids)))
+    return loglik
+
+
+def _maximize(t, count, total, f_of_slot):
+    '''
+    M-step of t from the expected counts of _expected_counts
+    return
+        largest change of a probability
+    '''
+    change = D()
+    data = t.data
+    for (slot, c) in count.items():
+        prob = c / total[f_of_slot[slot]]
+        change = max(change, abs(prob - data[slot]))
+        data[slot] = prob
+    return change
+
+
+def _prune(t, prune, stats):
+    '''
+    pruning.prune with the keyword arguments prune, recording the
+    number of removed pairs in stats["pruned"]
+    return
+        (t, f_of_slot): pruned table and the f id of its slots
+    '''
+    n = len(t)
+    t, _ = pruning.prune(t, **prune)
+    stats.setdefault("pruned", []).append(n - len(t))
+    return t, t.row_ids().tolist()
+
+
+def _shard_counts(models, pairs, weights):
+    '''E-step of a shard in a worker of _sharded_counts'''
+    count, _, loglik, n_words = _expected_counts(pairs, models["t"][0],
+                                                 weights, encoded=True)
+    return sharding.count_arrays(count), loglik, n_words
+
+
+def _sharded_counts(pool, corpus, t, shard_size, weights=None):
+    '''
+    E-step with the corpus split in shards of shard_size sentence pairs
+    over the workers of the sharding.ShardPool pool. partial counts
+    are summed in shard order
+    '''
+    manifest = pool.broadcast({"t": (t,)})
+    counts = sharding.ShardCounts(t)
+    for result in pool.map(_shard_counts, manifest, corpus, t, shard_size,
+                           weights):
+        counts.add(result)
+    return counts.result()
+
+
+def _train(corpus, loop_count=1000, processes=1, shard_size=1000,
+           tol=None, max_change=None, time_budget=None, stats=None,
+           checkpoint=None, checkpoint_every=10, resume_from=None,
+           e_vocab=None, f_vocab=None, weights=None, prune=None,
+           callback=None, pool=None):
+    '''
+    processes
+        number of worker processes for the E-step,
+        None means os.cpu_count(). they are started once, see
+        sharding.ShardPool
+    shard_size
+        number of sentence pairs sent to a worker at once
+    tol, max_change, time_budget
+        stopping criteria checked after every iteration,
+        see convergence.Convergence
+    stats
+        dictionary filled with the iterations actually run and the
+        log-likelihood/perplexity of each of them
+    checkpoint
+        directory where t is saved every checkpoint_every iterations
+        and when training ends, see checkpoint.save_checkpoint
+    resume_from
+        checkpoint directory (or the result of load_checkpoint)
+        to continue training from. loop_count counts the iterations
+        run before the checkpoint
+    e_vocab, f_vocab
+        Vocabulary objects giving the word ids of t, see
+        ttable.TTable.from_corpus
+    weights
+        number of occurrences of each pair of corpus, e.g. from
+        utility.dedup. the counts of a pair are multiplied by it,
+        so a deduplicated corpus trains like the original one
+    prune
+        keyword arguments of pruning.prune, e.g. {"threshold": 1e-3}
+        or {"top_k": 20}. the negligible pairs of t are removed after
+        every iteration, so memory and the cost of an iteration
+        shrink as training goes on; stats["pruned"] holds the number
+        of pairs removed by each iteration
+    callback
+        function called after every iteration with the dictionary of
+        reporting.iteration_info, e.g. reporting.JSONLinesReporter
+    pool
+        sharding.ShardPool to run the E-step on instead of starting
+        one, e.g. the one of ibmmodel2._train
+    '''
+    conv = Convergence(tol, max_change, time_budget, stats)
+    first = 0
+    if resume_from is not None:
+        if not isinstance(resume_from, dict):
+            resume_from = load_checkpoint(resume_from)
+        t = resume_from["t"]
+        first = resume_from["iteration"]
+        if conv.resume(resume_from["stats"]):
+            return t
+    else:
+        # default value provided as uniform probability)
+        t = TTable.from_corpus(corpus, _uniform,
+                               e_vocab=e_vocab, f_vocab=f_vocab)
+    f_of_slot = t.row_ids().tolist()
+    own_pool = pool is None and processes != 1
+    if own_pool:
+        pool = sharding.ShardPool(processes)
 
     # loop
+    try:
+        for i in range(first, loop_count):
+            e_start = time.time()
+            if pool is None:
+                count, total, loglik, n_words = _expected_counts(corpus, t,
+                                                                 weights)
+            else:
+                count, total, loglik, n_words = _sharded_counts(
+                    pool, corpus, t, shard_size, weights)
+            # estimate probability
+            m_start = time.time()
+            change = _maximize(t, count, total, f_of_slot)
+            if prune:
+                t, f_of_slot = _prune(t, prune, conv.stats)
+            if callback is not None:
+                callback(reporting.iteration_info(
+                    "ibmmodel1", i + 1, m_start - e_start,
+                    time.time() - m_start, t, None, loglik, n_words))
+            stop = conv.update(loglik, n_words, change)
+            if checkpoint is not None and (stop or i + 1 == loop_count or
+                                           (i + 1) % checkpoint_every == 0):
+                save_checkpoint(checkpoint, "ibmmodel1", i + 1, t,
+                                stats=conv.stats)
+            if stop:
+                break
+    finally:
+        if own_pool:
+            pool.close()
+
+    return t
+
+
+def _bucket_slots(corpus, t, weights=None):
+    '''
+    group corpus by (len(es), len(fs))
+    return
+        ({(l_e, l_f): slots}, {(l_e, l_f): weights}, n_words): slots
+        of t for every (e, f) cell of the bucket with shape
+        (sentences, l_e, l_f), the weights of its sentences with shape
+        (sentences, 1, 1), and the weighted number of e words of corpus
+    '''
+    buckets = collections.defaultdict(lambda: ([], [], []))
+    n_words = 0
+    if weights is None:
+        weights = itertools.repeat(1)
+    pairs = encoded_pairs(corpus, t.e_vocab, t.f_vocab)
+    for ((e_ids, f_ids), w) in zip(pairs, weights):
+        n_words += w * len(e_ids)
+        if not e_ids or not f_ids:
+            continue
+        e_bucket, f_bucket, w_bucket = buckets[(len(e_ids), len(f_ids))]
+        e_bucket.append(e_ids)
+        f_bucket.append(f_ids)
+        w_bucket.append(w)
+    slots = {key: t.slots(np.array(e_bucket)[:, :, None],
+                          np.array(f_bucket)[:, None, :])
+             for (key, (e_bucket, f_bucket, _)) in buckets.items()}
+    bucket_weights = {key: np.array(w_bucket, dtype=np.float64)[:, None, None]
+                      for (key, (_, _, w_bucket)) in buckets.items()}
+    return slots, bucket_weights, n_words
+
+
+def _estimate_numpy(t, count, f_of_slot):
+    '''
+    M-step of t from the expected counts of every slot
+    return
+        largest change of a probability
+    '''
+    total = np.bincount(f_of_slot, weights=count,
+                        minlength=len(t.indptr) - 1)
+    prob = count / total[f_of_slot]
+    change = np.abs(prob - t.data).max() if len(t) else 0.0
+    t.data[:] = prob
+    return change
+
+
+def _train_numpy(corpus, loop_count=1000, dtype=np.float64,
+                 tol=None, max_change=None, time_budget=None, stats=None,
+                 e_vocab=None, f_vocab=None, weights=None, callback=None):
+    '''
+    float engine for _train
+
+    words are mapped to integer ids and sentence pairs are grouped
+    by (len(es), len(fs)) so that each E-step is a few array operations
+    per bucket instead of a Python loop per word pair.
+    the returned table has the same keys as _train but float values.
+    the other arguments are those of _train
+    '''
+    conv = Convergence(tol, max_change, time_budget, stats)
+    t = TTable.from_corpus(corpus, lambda n: 1/n, dtype=dtype,
+                           e_vocab=e_vocab, f_vocab=f_vocab)
+    slots, bucket_weights, n_words = _bucket_slots(corpus, t, weights)
+    f_of_slot = t.row_ids()
+
     for i in range(loop_count):
-        count = collections.defaultdict(D)
-        total = collections.defaultdict(D)
-        s_total = collections.defaultdict(D)
-        for (es, fs) in corpus:
-            # compute normalization
-            for e in es:
-                s_total[e] = D()
-                for f in fs:
-                    s_total[e] += t[(e, f)]
-            for e in es:
-                for f in fs:
-                    count[(e, f)] += t[(e, f)] / s_total[e]
-                    total[f] += t[(e, f)] / s_total[e]
-                    #if e == u"に" and f == u"always":
-                    #    print(" BREAK:", i, count[(e, f)])
-        # estimate probability
-        for (e, f) in count.keys():
-            #if count[(e, f)] == 0:
-            #    print(e, f, count[(e, f)])
-            t[(e, f)] = count[(e, f)] / total[f]
+        e_start = time.time()
+        count = np.zeros(len(t))
+        loglik = 0.0
+        for (key, s) in slots.items():
+            w = bucket_weights[key]
+            tv = t.data[s]
+            s_total = tv.sum(axis=2, keepdims=True)
+            c = tv / s_total * w
+            count += np.bincount(s.ravel(), weights=c.ravel(),
+                                 minlength=len(t))
+            loglik += (np.log(s_total / s.shape[2]) * w).sum()
+        m_start = time.time()
+        change = _estimate_numpy(t, count, f_of_slot)
+        if callback is not None:
+            callback(reporting.iteration_info(
+                "ibmmodel1", i + 1, m_start - e_start,
+                time.time() - m_start, t, None, loglik, n_words))
+        if conv.update(float(loglik), n_words, change):
+            break
+    return t
+
+
+def _interpolate(t, count, total, step):
+    '''
+    move t(.|f) of every f in total towards the estimate count/total
+    by step, then renormalize the row
+    '''
+    step = type(t.default)(str(step))
+    data = t.slot_data()
+    for (f_id, tot) in total.items():
+        rows = t.row_slots(f_id)
+        probs = [(1 - step) * data[slot] + step * count[slot] / tot
+                 for slot in rows]
+        norm = sum(probs)
+        for (slot, prob) in zip(rows, probs):
+            data[slot] = prob / norm
 
+
+def update(t, corpus, step=0.5, loop_count=1):
+    '''
+    stepwise (online) EM: update a trained t with new sentence pairs
+
+    t is first extended with the new co-occurring pairs, then every
+    iteration runs the E-step on corpus only and moves t(.|f) of the
+    f words it contains towards the estimate of the batch by step.
+    the new pairs and the values of a frozen t are kept apart from its
+    arrays (see TTable.extended), so the cost depends on the batch and
+    the rows of its f words, not on the rest of t; they are merged the
+    first time the arrays of the returned table are read, e.g. by
+    save_model or freeze.
+    a step of about len(corpus) / (number of pairs seen so far) gives
+    the batch its share of the data
+    return
+        updated table (a new TTable when corpus brings new pairs
+        or t was frozen)
+    '''
+    t = t.extended(corpus)
+    if t.frozen:
+        t = t.thaw()
+    for i in range(loop_count):
+        count, total, loglik, n_words = _expected_counts(corpus, t)
+        _interpolate(t, count, total, step)
     return t
 
 
-def train(sentences, loop_count=1000):
+def train(sentences, loop_count=1000, engine="decimal", dedup=False,
+          **kwargs):
+    '''
+    engine
+        "decimal": Decimal arithmetic (default), see _train
+        "numpy": float64 arrays, see _train_numpy
+    dedup
+        if True, duplicate sentence pairs are trained once with
+        their number of occurrences as weight, see utility.dedup
+    other keyword arguments are passed to the engine
+    '''
     corpus = utility.mkcorpus(sentences)
-    return _train(corpus, loop_count)
+    if dedup:
+        corpus, kwargs["weights"] = utility.dedup(corpus)
+    if engine == "decimal":
+        return _train(corpus, loop_count, **kwargs)
+    elif engine == "numpy":
+        return _train_numpy(corpus, loop_count, **kwargs)
+    else:
+        raise ValueError("unknown engine: {}".format(engine))
 
 
 def _pprint(tbl):
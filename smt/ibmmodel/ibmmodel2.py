@@ -2,10 +2,20 @@
 # coding:utf-8
 
 import collections
+import itertools
+import math
+import time
 from smt.ibmmodel import ibmmodel1
+from smt.ibmmodel.convergence import Convergence
+from smt.ibmmodel.checkpoint import save_checkpoint, load_checkpoint
+from smt.ibmmodel.atable import AlignmentTable, FrozenAlignment
+from smt.ibmmodel.ttable import TTable, encoded_pairs
+from smt.ibmmodel import reporting
+from smt.ibmmodel import sharding
 from smt.utils import utility
 import decimal
 from decimal import Decimal as D
+import numpy as np
 
 # set deciaml context
 decimal.getcontext().prec = 4
@@ -22,79 +32,369 @@ class _keydefaultdict(collections.defaultdict):
             return ret
 
 
-def _train(corpus, loop_count=1000):
-    #print(corpus)
-    #print(loop_count)
-    f_keys = set()
-    for (es, fs) in corpus:
-        for f in fs:
-            f_keys.add(f)
-    # initialize t
-    t = ibmmodel1._train(corpus, loop_count)
-    # default value provided as uniform probability)
+def _uniform_alignment(key):
+    ''' default_factory function for keydefaultdict '''
+    i, j, l_e, l_f = key
+    return D("1") / D(l_f + 1)
+
+
+def _expected_counts(corpus, t, a, weights=None, encoded=False):
+    '''
+    E-step over corpus, t and a holding Decimal or float values.
+    the counts of a pair are multiplied by its weight in weights.
+    corpus holds (e ids, f ids) pairs when encoded is True
+    return
+        (count, total, count_a, total_a, loglik, n_words): expected
+        counts keyed by slot of t, f id, (i, j, l_e, l_f) and
+        (j, l_e, l_f), the log-likelihood of corpus and its number
+        of e words
+    '''
+    # variables for estimating t
+    count = collections.defaultdict(int)
+    total = collections.defaultdict(int)
+    # variables for estimating a
+    count_a = collections.defaultdict(int)
+    total_a = collections.defaultdict(int)
+    loglik = 0.0
+    n_words = 0
+    if weights is None:
+        weights = itertools.repeat(1)
+
+    pairs = corpus if encoded else encoded_pairs(corpus, t.e_vocab,
+                                                 t.f_vocab)
+    for ((e_ids, f_ids), w) in zip(pairs, weights):
+        n_words += w * len(e_ids)
+        loglik = _accumulate(e_ids, f_ids, w, t, a, count, total,
+                             count_a, total_a, loglik)
+    return count, total, count_a, total_a, loglik, n_words
+
+
+def _accumulate(e_ids, f_ids, w, t, a, count, total, count_a, total_a,
+                loglik):
+    '''
+    add the expected counts of the pair of word ids (e_ids, f_ids) of
+    weight w to the counters of _expected_counts
+    return
+        loglik plus the log-likelihood of the pair
+    '''
+    l_e = len(e_ids)
+    l_f = len(f_ids)
+    data = t.slot_data()
+    kept = t.sentence_slots(e_ids, f_ids)
+    for (j, e_id) in enumerate(e_ids, 1):
+        slots = [kept.get((e_id, f_id), -1) for f_id in f_ids]
+        # compute normalization, pruned pairs reading t.default
+        s_total = 0
+        for (i, slot) in enumerate(slots, 1):
+            s_total += (data[slot] if slot >= 0 else t.default) * \
+                a[(i, j, l_e, l_f)]
+        # collect counts
+        for (i, (f_id, slot)) in enumerate(zip(f_ids, slots), 1):
+            if slot < 0:
+                continue
+            c = data[slot] * a[(i, j, l_e, l_f)] / s_total
+            if w != 1:
+                c *= w
+            count[slot] += c
+            total[f_id] += c
+            count_a[(i, j, l_e, l_f)] += c
+            total_a[(j, l_e, l_f)] += c
+        loglik += w * math.log(s_total)
+    return loglik
+
+
+def _maximize(t, a, count, total, count_a, total_a, f_of_slot):
+    '''
+    M-step of t and a from the expected counts of _expected_counts
+    return
+        largest change of a probability
+    '''
+    change = D()
+    data = t.data
+    for (slot, c) in count.items():
+        f_id = f_of_slot[slot]
+        try:
+            prob = c / total[f_id]
+        except decimal.DivisionByZero:
+            e = t.e_words[t.indices[slot]]
+            f = t.f_words[f_id]
+            print(u"e: {e}, f: {f}, count[(e, f)]: {ef}, total[f]: \
+                  {totalf}".format(e=e, f=f, ef=c,
+                                   totalf=total[f_id]))
+            raise
+        change = max(change, abs(prob - data[slot]))
+        data[slot] = prob
+    for (i, j, l_e, l_f) in count_a.keys():
+        prob = count_a[(i, j, l_e, l_f)] / total_a[(j, l_e, l_f)]
+        change = max(change, abs(prob - a[(i, j, l_e, l_f)]))
+        a[(i, j, l_e, l_f)] = prob
+    return change
+
+
+def _shard_counts(models, pairs, weights):
+    '''E-step of a shard in a worker of _sharded_counts'''
+    t, a = models["t"]
+    count, _, count_a, _, loglik, n_words = _expected_counts(
+        pairs, t, a, weights, encoded=True)
+    count_a = {FrozenAlignment.pack(*key): c for (key, c) in count_a.items()}
+    return (sharding.count_arrays(count), sharding.count_arrays(count_a),
+            loglik, n_words)
+
+
+def _sharded_counts(pool, corpus, t, a, shard_size, weights=None):
+    '''
+    E-step with the corpus split in shards of shard_size sentence pairs
+    over the workers of the sharding.ShardPool pool. partial counts
+    are summed in shard order
+    '''
+    manifest = pool.broadcast({"t": (t, a)})
+    counts = sharding.ShardCounts(t)
+    for result in pool.map(_shard_counts, manifest, corpus, t, shard_size,
+                           weights):
+        counts.add(result)
+    return counts.result()
+
+
+def _train(corpus, loop_count=1000, processes=1, shard_size=1000,
+           tol=None, max_change=None, time_budget=None, stats=None,
+           checkpoint=None, checkpoint_every=10, resume_from=None,
+           floor=None, e_vocab=None, f_vocab=None, weights=None,
+           prune=None, callback=None):
+    '''
+    processes
+        number of worker processes for the E-step,
+        None means os.cpu_count(). they are started once for both
+        models, see sharding.ShardPool
+    shard_size
+        number of sentence pairs sent to a worker at once
+    tol, max_change, time_budget
+        stopping criteria checked after every iteration,
+        see convergence.Convergence. they also apply to the
+        IBM Model 1 training which initializes t, and time_budget
+        covers both
+    stats
+        dictionary filled with the iterations actually run and the
+        log-likelihood/perplexity of each of them. stats["ibmmodel1"]
+        holds the same for the initialization
+    checkpoint
+        directory where t and a are saved every checkpoint_every
+        iterations and at the end of each model, see
+        checkpoint.save_checkpoint
+    resume_from
+        checkpoint directory to continue training from, either in
+        the IBM Model 1 initialization or in Model 2
+    floor
+        probability read for the (e, f) pairs and alignments which
+        were not trained, instead of the uniform defaults
+    e_vocab, f_vocab
+        Vocabulary objects giving the word ids of t, see
+        ttable.TTable.from_corpus
+    weights
+        number of occurrences of each pair of corpus, see
+        ibmmodel1._train
+    prune
+        pruning of t after every iteration of both models, see
+        ibmmodel1._train
+    callback
+        function called after every iteration of both models with
+        the dictionary of reporting.iteration_info
+    return
+        (t, a): read-only TTable and FrozenAlignment, whose lookups
+        never insert, so aligning unseen sentences does not grow them
+    '''
+    start = time.time()
+    stats = {} if stats is None else stats
+    stats["ibmmodel1"] = {}
+    state = None
+    if resume_from is not None:
+        state = load_checkpoint(resume_from)
+    first = 0
+    pool = sharding.ShardPool(processes) if processes != 1 else None
+    try:
+        # default value provided as uniform probability)
+        a = _keydefaultdict(_uniform_alignment)
+        if state is not None and state["stage"] == "ibmmodel2":
+            t = state["t"]
+            a.update(state["a"])
+            first = state["iteration"]
+        else:
+            # initialize t
+            t = ibmmodel1._train(corpus, loop_count,
+                                 processes=processes, shard_size=shard_size,
+                                 pool=pool,
+                                 tol=tol, max_change=max_change,
+                                 time_budget=time_budget,
+                                 stats=stats["ibmmodel1"],
+                                 checkpoint=checkpoint,
+                                 checkpoint_every=checkpoint_every,
+                                 resume_from=state,
+                                 e_vocab=e_vocab, f_vocab=f_vocab,
+                                 weights=weights, prune=prune,
+                                 callback=callback)
+        conv = Convergence(tol, max_change, time_budget, stats, start=start)
+        if state is not None and state["stage"] == "ibmmodel2":
+            conv.resume(state["stats"])
+        f_of_slot = t.row_ids().tolist()
+
+        # loop
+        for _i in range(first, loop_count):
+            if conv.stats["stopped_by"] is not None:
+                break
+            if stats["ibmmodel1"]["stopped_by"] == "time_budget":
+                break
+            e_start = time.time()
+            if pool is None:
+                (count, total, count_a, total_a,
+                 loglik, n_words) = _expected_counts(corpus, t, a, weights)
+            else:
+                (count, total, count_a, total_a,
+                 loglik, n_words) = _sharded_counts(pool, corpus, t, a,
+                                                    shard_size, weights)
+
+            # estimate probability
+            m_start = time.time()
+            change = _maximize(t, a, count, total, count_a, total_a,
+                               f_of_slot)
+            if prune:
+                t, f_of_slot = ibmmodel1._prune(t, prune, conv.stats)
+            if callback is not None:
+                callback(reporting.iteration_info(
+                    "ibmmodel2", _i + 1, m_start - e_start,
+                    time.time() - m_start, t, a, loglik, n_words))
+            stop = conv.update(loglik, n_words, change)
+            if checkpoint is not None and (stop or _i + 1 == loop_count or
+                                           (_i + 1) % checkpoint_every == 0):
+                save_checkpoint(checkpoint, "ibmmodel2", _i + 1, t, a,
+                                stats=conv.stats)
+            if stop:
+                break
+
+        return (t.freeze(floor), FrozenAlignment.from_items(a.items(), floor))
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def _train_numpy(corpus, loop_count=1000, dtype=np.float64,
+                 tol=None, max_change=None, time_budget=None, stats=None,
+                 e_vocab=None, f_vocab=None, weights=None, callback=None):
+    '''
+    float engine for _train
 
-    def key_fun(key):
-        ''' default_factory function for keydefaultdict '''
-        i, j, l_e, l_f = key
-        return D("1") / D(l_f + 1)
-    a = _keydefaultdict(key_fun)
+    the corpus is grouped by (len(es), len(fs)) and a is stored as one
+    dense array per length pair (see atable.AlignmentTable), so the
+    E-step of a bucket is a single (sentences, l_e, l_f) array
+    operation. stopping criteria, stats, vocabularies, weights and
+    callback are the same as _train; as a is estimated bucket by
+    bucket, its M-step is timed with the E-step
+    '''
+    start = time.time()
+    stats = {} if stats is None else stats
+    stats["ibmmodel1"] = {}
+    # initialize t
+    t = ibmmodel1._train_numpy(corpus, loop_count, dtype=dtype,
+                               tol=tol, max_change=max_change,
+                               time_budget=time_budget,
+                               stats=stats["ibmmodel1"],
+                               e_vocab=e_vocab, f_vocab=f_vocab,
+                               weights=weights, callback=callback)
+    conv = Convergence(tol, max_change, time_budget, stats, start=start)
+    slots, bucket_weights, n_words = ibmmodel1._bucket_slots(corpus, t,
+                                                             weights)
+    f_of_slot = t.row_ids()
+    a = AlignmentTable(dtype=dtype)
+    for (l_e, l_f) in slots:
+        a.bucket(l_e, l_f)
 
-    # loop
     for _i in range(loop_count):
-        # variables for estimating t
-        count = collections.defaultdict(D)
-        total = collections.defaultdict(D)
-        # variables for estimating a
-        count_a = collections.defaultdict(D)
-        total_a = collections.defaultdict(D)
-
-        s_total = collections.defaultdict(D)
-        for (es, fs) in corpus:
-            l_e = len(es)
-            l_f = len(fs)
-            # compute normalization
-            for (j, e) in enumerate(es, 1):
-                s_total[e] = 0
-                for (i, f) in enumerate(fs, 1):
-                    s_total[e] += t[(e, f)] * a[(i, j, l_e, l_f)]
-            # collect counts
-            for (j, e) in enumerate(es, 1):
-                for (i, f) in enumerate(fs, 1):
-                    c = t[(e, f)] * a[(i, j, l_e, l_f)] / s_total[e]
-                    count[(e, f)] += c
-                    total[f] += c
-                    count_a[(i, j, l_e, l_f)] += c
-                    total_a[(j, l_e, l_f)] += c
-
-        #for k, v in total.items():
-        #    if v == 0:
-        #        print(k, v)
-        # estimate probability
-        for (e, f) in count.keys():
-            try:
-                t[(e, f)] = count[(e, f)] / total[f]
-            except decimal.DivisionByZero:
-                print(u"e: {e}, f: {f}, count[(e, f)]: {ef}, total[f]: \
-                      {totalf}".format(e=e, f=f, ef=count[(e, f)],
-                                       totalf=total[f]))
-                raise
-        for (i, j, l_e, l_f) in count_a.keys():
-            a[(i, j, l_e, l_f)] = count_a[(i, j, l_e, l_f)] / \
-                total_a[(j, l_e, l_f)]
-    # output
-    #for (e, f), val in t.items():
-    #    print("{} {}\t{}".format(e, f, float(val)))
-    #for (i, j, l_e, l_f), val in a.items():
-    #    print("{} {} {} {}\t{}".format(i, j, l_e, l_f, float(val)))
+        if stats["ibmmodel1"]["stopped_by"] == "time_budget":
+            break
+        e_start = time.time()
+        count = np.zeros(len(t))
+        loglik = 0.0
+        change = 0.0
+        for ((l_e, l_f), s) in slots.items():
+            arr = a.bucket(l_e, l_f)
+            w = bucket_weights[(l_e, l_f)]
+            p = t.data[s] * arr
+            s_total = p.sum(axis=2, keepdims=True)
+            c = p / s_total * w
+            count += np.bincount(s.ravel(), weights=c.ravel(),
+                                 minlength=len(t))
+            loglik += (np.log(s_total) * w).sum()
+            # a is normalized over i for each j
+            count_a = c.sum(axis=0)
+            prob = count_a / count_a.sum(axis=1, keepdims=True)
+            change = max(change, np.abs(prob - arr).max())
+            arr[:] = prob
+        m_start = time.time()
+        change = max(change, ibmmodel1._estimate_numpy(t, count, f_of_slot))
+        if callback is not None:
+            callback(reporting.iteration_info(
+                "ibmmodel2", _i + 1, m_start - e_start,
+                time.time() - m_start, t, a, loglik, n_words))
+        if conv.update(float(loglik), n_words, change):
+            break
+
+    return (t, a)
+
+
+def update(t, a, corpus, step=0.5, loop_count=1):
+    '''
+    stepwise (online) EM: update trained t and a with new sentence pairs
 
+    like ibmmodel1.update, t(.|f) of the f words of corpus and
+    a(.|j, l_e, l_f) of the positions and lengths of corpus are moved
+    towards the estimates of the batch by step. a is updated in place,
+    unless it is frozen: the written probabilities are then kept apart
+    from it, so like t it is not copied
+    return
+        (t, a), t being a new TTable when corpus brings new pairs
+        or was frozen
+    '''
+    t = t.extended(corpus)
+    if t.frozen:
+        t = t.thaw()
+    if isinstance(a, FrozenAlignment):
+        # writes go to the dictionary, reads fall back to a
+        a = collections.ChainMap({}, a)
+    for _i in range(loop_count):
+        (count, total, count_a, total_a,
+         loglik, n_words) = _expected_counts(corpus, t, a)
+        ibmmodel1._interpolate(t, count, total, step)
+        for ((j, l_e, l_f), tot) in total_a.items():
+            keys = [(i, j, l_e, l_f) for i in range(1, l_f + 1)]
+            _step = type(a[keys[0]])(str(step))
+            probs = [(1 - _step) * a[key] + _step * count_a[key] / tot
+                     for key in keys]
+            norm = sum(probs)
+            for (key, prob) in zip(keys, probs):
+                a[key] = prob / norm
     return (t, a)
 
 
-def train(sentences, loop_count=1000):
+def train(sentences, loop_count=1000, engine="decimal", dedup=False,
+          **kwargs):
+    '''
+    engine
+        "decimal": Decimal arithmetic (default), see _train
+        "numpy": float64 arrays, see _train_numpy
+    dedup
+        if True, duplicate sentence pairs are trained once with
+        their number of occurrences as weight, see utility.dedup
+    other keyword arguments are passed to the engine
+    '''
     #for i, j in sentences:
     #    print(i, j)
     corpus = utility.mkcorpus(sentences)
-    return _train(corpus, loop_count)
+    if dedup:
+        corpus, kwargs["weights"] = utility.dedup(corpus)
+    if engine == "decimal":
+        return _train(corpus, loop_count, **kwargs)
+    elif engine == "numpy":
+        return _train_numpy(corpus, loop_count, **kwargs)
+    else:
+        raise ValueError("unknown engine: {}".format(engine))
 
 
 def viterbi_alignment(es, fs, t, a):
@@ -117,6 +417,68 @@ def viterbi_alignment(es, fs, t, a):
     return max_a
 
 
+def _score_matrices(pairs, t, a, t_data):
+    '''
+    scores t[(e, f)] * a[(i, j, l_e, l_f)] of sentence pairs sharing
+    the same lengths, as an array of shape (sentences, l_e, l_f).
+    t_data is t.data as a float array when t is a TTable
+    '''
+    l_e = len(pairs[0][0])
+    l_f = len(pairs[0][1])
+    if isinstance(t, TTable):
+        e_ids = np.array([[t.e_index.get(e, -1) for e in es]
+                          for (es, fs) in pairs])
+        f_ids = np.array([[t.f_index.get(f, -1) for f in fs]
+                          for (es, fs) in pairs])
+        slots = t.slots(e_ids[:, :, None], f_ids[:, None, :])
+        tv = np.full(slots.shape, float(t.default))
+        found = slots >= 0
+        tv[found] = t_data[slots[found]]
+    else:
+        tv = np.array([[[float(t[(e, f)]) for f in fs] for e in es]
+                       for (es, fs) in pairs], dtype=np.float64)
+    if isinstance(a, AlignmentTable) and (l_e, l_f) in a.buckets:
+        av = a.buckets[(l_e, l_f)]
+    elif hasattr(a, "matrix"):
+        av = a.matrix(l_e, l_f)
+    else:
+        av = np.array([[float(a[(i, j, l_e, l_f)])
+                        for i in range(1, l_f + 1)]
+                       for j in range(1, l_e + 1)], dtype=np.float64)
+    return tv * av
+
+
+def viterbi_alignment_batch(corpus, t, a, chunk_size=10000):
+    '''
+    viterbi_alignment of every (es, fs) in corpus
+
+    corpus is read chunk_size pairs at a time; the pairs of a chunk
+    are grouped by length and each group is aligned with one argmax
+    over a score array. the alignments are yielded in corpus order
+    as dictionaries like viterbi_alignment (ties can differ where
+    Decimal rounding made two scores equal)
+    '''
+    t_data = None
+    if isinstance(t, TTable):
+        t_data = np.asarray(t.data, dtype=np.float64)
+    for chunk in utility.chunks(corpus, chunk_size):
+        results = [None] * len(chunk)
+        groups = collections.defaultdict(list)
+        for (n, (es, fs)) in enumerate(chunk):
+            groups[(len(es), len(fs))].append(n)
+        for ((l_e, l_f), ns) in groups.items():
+            if l_e == 0 or l_f == 0:
+                for n in ns:
+                    results[n] = {j: 0 for j in range(1, l_e + 1)}
+                continue
+            pairs = [chunk[n] for n in ns]
+            best = _score_matrices(pairs, t, a, t_data).argmax(axis=2) + 1
+            for (n, row) in zip(ns, best.tolist()):
+                results[n] = dict(enumerate(row, 1))
+        for result in results:
+            yield result
+
+
 def show_matrix(es, fs, t, a):
     '''
     print matrix according to viterbi alignment like
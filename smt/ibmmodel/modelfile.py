@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import json
+import os
+import struct
+import numpy as np
+from smt.ibmmodel.atable import FrozenAlignment
+from smt.ibmmodel.ttable import TTable
+from smt.utils.vocabulary import Vocabulary, MappedVocabulary
+
+MAGIC = b"SMTIBMMD"
+VERSION = 1
+# magic, version, reserved, length of the json header
+_HEAD = struct.Struct("<8sIIQ")
+_ALIGN = 64
+
+
+def _encode_words(words):
+    '''
+    words as (offsets, utf-8 bytes, order), order being the ids sorted
+    by the bytes of the words, see vocabulary.MappedVocabulary
+    '''
+    encoded = [w.encode("utf-8") for w in words]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    order = np.array(sorted(range(len(encoded)), key=encoded.__getitem__),
+                     dtype=np.int64)
+    return (offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            order)
+
+
+def _decode_words(offsets, blob):
+    blob = blob.tobytes()
+    offsets = offsets.tolist()
+    return [blob[s:e].decode("utf-8")
+            for (s, e) in zip(offsets[:-1], offsets[1:])]
+
+
+def save_model(path, t, a=None):
+    '''
+    save t, and a when given, to the single binary file path
+
+        magic, version          "SMTIBMMD", uint32
+        header                  json: defaults and the offset, dtype
+                                and length of every section
+        e_offsets, e_words,     \\ vocabularies as utf-8 bytes, the
+        e_order                  | offsets of each word and the ids
+        f_offsets, f_words,      | sorted by word, so words are found
+        f_order                 /  without decoding the vocabulary
+        t_indptr, t_indices,    CSR arrays of TTable
+        t_data
+        a_keys, a_data          packed keys of FrozenAlignment
+                                and the probabilities
+
+    sections are 64-byte aligned so load_model can map them in place.
+    probabilities are stored as float64. the file is written next to
+    path and renamed, so readers never see a partial model
+    '''
+    sections = []
+    for (prefix, words) in (("e", t.e_words), ("f", t.f_words)):
+        offsets, blob, order = _encode_words(words)
+        sections.append((prefix + "_offsets", offsets))
+        sections.append((prefix + "_words", blob))
+        sections.append((prefix + "_order", order))
+    sections.append(("t_indptr", np.asarray(t.indptr, dtype=np.int64)))
+    sections.append(("t_indices", np.asarray(t.indices, dtype=np.int32)))
+    sections.append(("t_data", np.asarray(t.data, dtype=np.float64)))
+    a_floor = None
+    if a is not None:
+        if not isinstance(a, FrozenAlignment):
+            a = FrozenAlignment.from_items(
+                (key, float(val)) for (key, val) in a.items())
+        a_floor = None if a.floor is None else float(a.floor)
+        sections.append(("a_keys", np.asarray(a.packed, dtype=np.int64)))
+        sections.append(("a_data", np.asarray(a.data, dtype=np.float64)))
+
+    layout = {}
+    offset = 0
+    for (name, arr) in sections:
+        layout[name] = [offset, arr.dtype.str, len(arr)]
+        offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+    header = json.dumps({"t_default": float(t.default),
+                         "a_floor": a_floor,
+                         "sections": layout}).encode("utf-8")
+    start = -(-(_HEAD.size + len(header)) // _ALIGN) * _ALIGN
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fd:
+        fd.write(_HEAD.pack(MAGIC, VERSION, 0, len(header)))
+        fd.write(header)
+        for (name, arr) in sections:
+            fd.seek(start + layout[name][0])
+            fd.write(arr.tobytes())
+        # pad the last section so every section lies inside the file
+        fd.truncate(start + offset)
+    os.replace(tmp, path)
+
+
+def load_model(path, floor=None):
+    '''
+    load a model written by save_model.
+    the file is memory-mapped and the arrays of t and a are read-only
+    views of it, so loading does not read the probabilities and the
+    pages are shared by every process mapping the same file. the
+    vocabularies are MappedVocabulary views of it too, except for
+    files written without the order sections, which are decoded.
+    floor replaces the stored defaults of unseen pairs and alignments
+    return
+        (t, a): frozen TTable and FrozenAlignment of floats,
+        a being None when the file has no alignment table
+    '''
+    with open(path, "rb") as fd:
+        magic, version, _, size = _HEAD.unpack(fd.read(_HEAD.size))
+        if magic != MAGIC:
+            raise ValueError("not a model file: {}".format(path))
+        if version != VERSION:
+            raise ValueError("unsupported model version: {}".format(version))
+        header = json.loads(fd.read(size).decode("utf-8"))
+    start = -(-(_HEAD.size + size) // _ALIGN) * _ALIGN
+    buf = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def _section(name):
+        offset, dtype, count = header["sections"][name]
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.frombuffer(buf, dtype=dtype, count=count,
+                             offset=start + offset)
+
+    def _vocabulary(prefix):
+        offsets = _section(prefix + "_offsets")
+        blob = _section(prefix + "_words")
+        if prefix + "_order" not in header["sections"]:
+            return Vocabulary(_decode_words(offsets, blob))
+        return MappedVocabulary(offsets, blob, _section(prefix + "_order"))
+
+    default = header["t_default"] if floor is None else float(floor)
+    t = TTable(_vocabulary("e"), _vocabulary("f"), _section("t_indptr"),
+               _section("t_indices"), _section("t_data"), default)
+    a = None
+    if "a_keys" in header["sections"]:
+        a_floor = header["a_floor"] if floor is None else float(floor)
+        a = FrozenAlignment(_section("a_keys"), _section("a_data"), a_floor)
+    return (t, a)
@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import numpy as np
+
+
+def prune(t, threshold=None, top_k=None, mass=None):
+    '''
+    remove the negligible pairs of t(.|f) and renormalize each row
+
+    threshold
+        remove the pairs whose probability is below threshold
+    top_k
+        keep the top_k most probable e of every f
+    mass
+        keep the most probable e of every f until their cumulative
+        probability reaches mass
+
+    the criteria can be combined; the most probable e of every f is
+    always kept. the removed pairs then read t.default like the pairs
+    which never co-occurred, and the training gives them no counts,
+    so the table only shrinks between iterations. default is lowered
+    to the smallest kept probability if needed, so that a removed pair
+    never reads more than a kept one
+    return
+        (t, keep): pruned TTable, which is t itself when nothing was
+        removed, and the boolean array of the kept slots of t
+    '''
+    prob = np.asarray(t.data, dtype=np.float64)
+    rows = t.row_ids()
+    # slots sorted by row, then by decreasing probability.
+    # rows stay where they are in the CSR layout
+    order = np.lexsort((-prob, rows))
+    start = t.indptr[:-1][rows[order]]
+    rank = np.arange(len(order)) - start
+    keep = np.ones(len(prob), dtype=bool)
+    if threshold is not None:
+        keep &= prob >= threshold
+    if top_k is not None:
+        keep[order[rank >= top_k]] = False
+    if mass is not None:
+        cum = np.cumsum(prob[order])
+        base = np.concatenate([[0.0], cum])[start]
+        # mass of the more probable e of the row
+        before = cum - prob[order] - base
+        keep[order[before >= mass]] = False
+    keep[order[rank == 0]] = True
+    if keep.all():
+        return t, keep
+
+    t = t.subset(keep)
+    if isinstance(t.data, np.ndarray):
+        f_of_slot = t.row_ids()
+        norm = np.bincount(f_of_slot, weights=t.data,
+                           minlength=len(t.indptr) - 1)
+        t.data /= norm[f_of_slot]
+        lowest = t.data.min() if len(t) else t.default
+    else:
+        indptr = t.indptr.tolist()
+        for (lo, hi) in zip(indptr[:-1], indptr[1:]):
+            norm = sum(t.data[lo:hi])
+            for slot in range(lo, hi):
+                t.data[slot] = t.data[slot] / norm
+        lowest = min(t.data, default=t.default)
+    t.default = min(t.default, lowest)
+    return t, keep
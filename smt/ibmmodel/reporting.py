@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import json
+import sys
+import time
+import numpy as np
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+def max_rss(children=False):
+    '''
+    peak resident memory of the process in bytes, or None.
+    with children, that of its largest child process waited for,
+    e.g. a worker of a terminated pool
+    '''
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    rss = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _nbytes(a):
+    '''approximate size of an alignment table'''
+    if a is None:
+        return 0
+    if hasattr(a, "nbytes"):
+        return a.nbytes
+    if not hasattr(a, "items"):
+        return sys.getsizeof(a)
+    for (key, val) in a.items():
+        return sys.getsizeof(a) + len(a) * (sys.getsizeof(key) +
+                                            sys.getsizeof(val))
+    return sys.getsizeof(a)
+
+
+def _nonzero(values):
+    if isinstance(values, np.ndarray):
+        return int(np.count_nonzero(values))
+    return sum(1 for val in values if val)
+
+
+def iteration_info(model, iteration, e_time, m_time, t, a, loglik,
+                   n_words, **fields):
+    '''
+    information passed to the callback of the trainers after every
+    EM iteration
+
+        model           "ibmmodel1", "ibmmodel2" or "diagonal"
+        iteration       number of the iteration in the model, from 1
+        e_step, m_step  wall time of the E-step and the M-step
+                        in seconds
+        parameters      number of non-zero probabilities of t and a
+        loglikelihood   log-likelihood of the corpus in the E-step
+        words           number of e words of the corpus, so that
+                        words / e_step is the throughput
+        table_bytes     approximate size of t and a
+        max_rss         peak memory of the process in bytes, or None
+
+    fields are added as is, e.g. the direction of bidirectional
+    '''
+    if a is None:
+        parameters = 0
+    elif hasattr(a, "tension"):
+        # diagonal.DiagonalAlignment
+        parameters = 1
+    elif hasattr(a, "buckets"):
+        parameters = sum(_nonzero(arr) for arr in a.buckets.values())
+    else:
+        parameters = _nonzero(a.values())
+    info = {"model": model,
+            "iteration": iteration,
+            "e_step": e_time,
+            "m_step": m_time,
+            "parameters": _nonzero(t.data) + parameters,
+            "loglikelihood": float(loglik),
+            "words": float(n_words),
+            "table_bytes": t.nbytes + _nbytes(a),
+            "max_rss": max_rss()}
+    info.update(fields)
+    return info
+
+
+class JSONLinesReporter(object):
+    '''
+    training callback writing the information of every iteration
+    (see iteration_info) as one json object per line to path, with
+    the time it was written and fields, e.g. the commit being
+    measured
+
+    >>> with JSONLinesReporter("train.jsonl", run="baseline") as report:
+    ...     ibmmodel2._train(corpus, callback=report)
+    '''
+
+    def __init__(self, path, mode="a", **fields):
+        self.fd = open(path, mode, encoding="utf-8")
+        self.fields = fields
+
+    def __call__(self, info):
+        record = dict(self.fields)
+        record["time"] = time.time()
+        record.update(info)
+        self.fd.write(json.dumps(record) + "\n")
+        # readable while the training is running
+        self.fd.flush()
+
+    def close(self):
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,225 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+from decimal import Decimal as D
+import numpy as np
+from smt.ibmmodel.atable import FrozenAlignment
+from smt.ibmmodel.ttable import TTable, encoded_pairs
+from smt.utils import utility
+
+
+class ShardPool(object):
+    '''
+    worker processes of the sharded E-step, started once per training
+
+    before every E-step, broadcast writes the probabilities of the
+    tables as float64 arrays to files of a temporary directory, which
+    the workers memory-map, so their pages are shared and nothing is
+    pickled but the names of the files. the CSR structure of t is only
+    written again when it changed, e.g. by pruning. the shards are
+    sent as word ids and their counts come back as arrays, see
+    count_arrays. the workers compute in float64, the M-step of the
+    parent in the type of the tables. with Decimal tables, the result
+    is therefore not that of the serial E-step, which rounds every
+    sum to the precision of the decimal context: it is closer to the
+    float64 one, e.g. within 1e-3 of _train_numpy on 200 synthetic
+    pairs, from which the serial result differs by up to 1e-2
+
+    >>> with ShardPool(4) as pool:
+    ...     manifest = pool.broadcast({"t": (t,)})
+    ...     counts = ShardCounts(t)
+    ...     for result in pool.map(f, manifest, corpus, t, 1000):
+    ...         counts.add(result)
+    '''
+
+    def __init__(self, processes):
+        self.path = tempfile.mkdtemp(prefix="shards-")
+        self.pool = multiprocessing.Pool(processes)
+        self.version = 0
+        # name -> (indptr, its file, the file of indices)
+        self._structure = {}
+        self._files = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def broadcast(self, models):
+        '''
+        write the tables of models {name: (t,) or (t, a)}
+        return
+            manifest of the files, to be passed to map
+        '''
+        self.version += 1
+        manifest = {}
+        files = set()
+        for (name, tables) in sorted(models.items()):
+            t = tables[0]
+            indptr = t.indptr
+            structure = self._structure.get(name)
+            if structure is None or structure[0] is not indptr:
+                structure = (indptr, self._save(name + "_indptr", indptr),
+                             self._save(name + "_indices", t.indices))
+                self._structure[name] = structure
+            spec = {"indptr": structure[1], "indices": structure[2],
+                    "data": self._save(name + "_data", t.data),
+                    "default": float(t.default)}
+            if len(tables) > 1:
+                a = FrozenAlignment.from_items(tables[1].items())
+                spec["a_keys"] = self._save(name + "_a_keys", a.packed)
+                spec["a_data"] = self._save(name + "_a_data", a.data)
+            manifest[name] = spec
+            files.update(path for path in spec.values()
+                         if isinstance(path, str))
+        # the workers are done with the files of the last E-step
+        for path in self._files - files:
+            os.remove(path)
+        self._files = files
+        return manifest
+
+    def _save(self, name, arr):
+        path = os.path.join(self.path, "{0}.{1}.npy".format(name,
+                                                            self.version))
+        if not isinstance(arr, np.ndarray) or arr.dtype.kind == "O":
+            arr = np.array(arr, dtype=np.float64)
+        np.save(path, arr)
+        return path
+
+    def map(self, counts, manifest, corpus, t, shard_size, weights=None):
+        '''
+        iterator over counts(models, pairs, weights) of the shards of
+        shard_size pairs of corpus, in order. models are the tables of
+        manifest, and pairs the word ids of t
+        '''
+        pairs = encoded_pairs(corpus, t.e_vocab, t.f_vocab)
+        if weights is None:
+            weights = itertools.repeat(None)
+        else:
+            weights = utility.chunks(weights, shard_size)
+        tasks = ((counts, manifest, shard, w) for (shard, w) in
+                 zip(utility.chunks(pairs, shard_size), weights))
+        return self.pool.imap(_run, tasks)
+
+
+# tables of the last manifest loaded by the worker process
+_loaded = {}
+
+
+def _run(task):
+    counts, manifest, pairs, weights = task
+    if _loaded.get("manifest") != manifest:
+        _loaded["models"] = {name: _load(spec)
+                             for (name, spec) in manifest.items()}
+        _loaded["manifest"] = manifest
+    return counts(_loaded["models"], pairs, weights)
+
+
+def _load(spec):
+    '''(t,) or (t, a) over the memory-mapped files of spec'''
+    def array(key):
+        return np.load(spec[key], mmap_mode="r")
+
+    t = TTable((), (), array("indptr"), array("indices"), array("data"),
+               spec["default"])
+    if "a_keys" not in spec:
+        return (t,)
+    return (t, FrozenAlignment(array("a_keys"), array("a_data")))
+
+
+def count_arrays(count):
+    '''counts {key: c} of a shard as (keys, values) arrays'''
+    keys = np.fromiter(count.keys(), dtype=np.int64, count=len(count))
+    values = np.fromiter(count.values(), dtype=np.float64, count=len(count))
+    return keys, values
+
+
+class ShardCounts(object):
+    '''
+    running sum of the results of the shards of a table t, each
+    (count, loglik, n_words) for IBM Model 1 or
+    (count, count_a, loglik, n_words) for IBM Model 2, the counts
+    being the arrays of count_arrays keyed by slot of t and by packed
+    (i, j, l_e, l_f) as in FrozenAlignment. the counts of t are added
+    to one array of its size, those of a every merge_every shards
+    '''
+
+    merge_every = 64
+
+    def __init__(self, t):
+        self.t = t
+        self.count = np.zeros(len(t))
+        self.seen = np.zeros(len(t), dtype=bool)
+        self.a_parts = []
+        self.alignment = False
+        self.loglik = 0.0
+        self.n_words = 0
+
+    def add(self, result):
+        slots, values = result[0]
+        # the slots of a shard are distinct
+        self.count[slots] += values
+        self.seen[slots] = True
+        if len(result) == 4:
+            self.alignment = True
+            self.a_parts.append(result[1])
+            if len(self.a_parts) >= self.merge_every:
+                self.a_parts = [self._merge_a()]
+        self.loglik += result[-2]
+        self.n_words += result[-1]
+
+    def _merge_a(self):
+        keys = np.concatenate([k for (k, _) in self.a_parts] +
+                              [np.empty(0, dtype=np.int64)])
+        values = np.concatenate([v for (_, v) in self.a_parts] +
+                                [np.empty(0)])
+        keys, inverse = np.unique(keys, return_inverse=True)
+        return keys, np.bincount(inverse, weights=values,
+                                 minlength=len(keys))
+
+    def result(self):
+        '''
+        the counters of ibmmodel1._expected_counts or
+        ibmmodel2._expected_counts, Decimal when t is, rounded to
+        the precision of the decimal context
+        '''
+        if isinstance(self.t.default, D):
+            # the shortest decimal of the float, rounded to the context
+            def value(x):
+                return +D(repr(x))
+        else:
+            value = float
+        rows = self.t.row_ids()
+        slots = np.flatnonzero(self.seen)
+        total = np.bincount(rows[slots], weights=self.count[slots],
+                            minlength=len(self.t.indptr) - 1)
+        f_ids = np.unique(rows[slots])
+        count = dict(zip(slots.tolist(),
+                         map(value, self.count[slots].tolist())))
+        total = dict(zip(f_ids.tolist(), map(value, total[f_ids].tolist())))
+        if not self.alignment:
+            return count, total, self.loglik, self.n_words
+
+        keys, values = self._merge_a()
+        # the keys without i, which is in the low 16 bits
+        rows, row_of_key = np.unique(keys >> 16, return_inverse=True)
+        sums = np.bincount(row_of_key, weights=values, minlength=len(rows))
+        count_a = {(k & 0xffff, (k >> 16) & 0xffff, k >> 48,
+                    (k >> 32) & 0xffff): value(c)
+                   for (k, c) in zip(keys.tolist(), values.tolist())}
+        total_a = {(r & 0xffff, r >> 32, (r >> 16) & 0xffff): value(c)
+                   for (r, c) in zip(rows.tolist(), sums.tolist())}
+        return (count, total, count_a, total_a, self.loglik,
+                self.n_words)
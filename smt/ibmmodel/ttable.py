@@ -0,0 +1,496 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import bisect
+import collections
+import heapq
+import numpy as np
+from smt.utils.vocabulary import Vocabulary
+
+
+def encoded_pairs(corpus, e_vocab, f_vocab):
+    '''
+    (e ids, f ids) of every pair (es, fs) of corpus, the words being
+    added to e_vocab and f_vocab. a corpus holding ids of these
+    vocabularies, e.g. CorpusCache.corpus, gives them through its
+    ids() method without decoding them to words
+    '''
+    if (hasattr(corpus, "ids") and
+            getattr(corpus, "e_vocab", None) is e_vocab and
+            getattr(corpus, "f_vocab", None) is f_vocab):
+        return corpus.ids()
+    return ((e_vocab.encode(es), f_vocab.encode(fs)) for (es, fs) in corpus)
+
+
+class TTable(object):
+    '''
+    translation probability table t(e|f)
+
+    only the (e, f) pairs co-occurring in the training corpus are
+    stored. words are mapped to integer ids and the pairs are kept
+    in CSR layout: one row per f word, holding the sorted ids of
+    the e words it co-occurs with
+
+        indptr[f_id]:indptr[f_id+1]  -> slice of the row in indices/data
+        indices                      -> e ids
+        data                         -> probabilities
+
+    reading a pair which does not co-occur returns `default` without
+    inserting it, so the table never grows after construction.
+    data is a list (e.g. of Decimal) or a numpy array
+
+    the ids are those of the Vocabulary objects e_vocab and f_vocab,
+    which can be shared with other tables and stages. words added to
+    them later have no row and no pair in the table
+
+    the pairs added by extended, and the values written to a table
+    built by extended or thaw, are kept apart from the arrays until
+    indptr, indices or data is read, see _Overlay
+    '''
+
+    def __init__(self, e_vocab, f_vocab, indptr, indices, data, default):
+        if not isinstance(e_vocab, Vocabulary):
+            e_vocab = Vocabulary(e_vocab)
+        if not isinstance(f_vocab, Vocabulary):
+            f_vocab = Vocabulary(f_vocab)
+        self.e_vocab = e_vocab
+        self.f_vocab = f_vocab
+        # aliases, kept up to date by the vocabularies
+        self.e_words = e_vocab.words
+        self.f_words = f_vocab.words
+        self.e_index = e_vocab.index
+        self.f_index = f_vocab.index
+        self.default = default
+        self._pending = None
+        self._set_arrays(indptr, indices, data)
+
+    def _set_arrays(self, indptr, indices, data):
+        self._arrays = (indptr, indices, data)
+        # bisect on a memoryview reads the ids without numpy scalars
+        self._indptr = memoryview(indptr)
+        self._indices = memoryview(indices)
+        self._keys = None
+
+    @property
+    def indptr(self):
+        if self._pending is not None:
+            self._merge()
+        return self._arrays[0]
+
+    @property
+    def indices(self):
+        if self._pending is not None:
+            self._merge()
+        return self._arrays[1]
+
+    @property
+    def data(self):
+        if self._pending is not None:
+            self._merge()
+        return self._arrays[2]
+
+    @data.setter
+    def data(self, data):
+        if self._pending is not None:
+            self._merge()
+        self._arrays = self._arrays[:2] + (data,)
+
+    def __getstate__(self):
+        return (self.e_vocab, self.f_vocab, self.indptr, self.indices,
+                self.data, self.default)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @classmethod
+    def from_corpus(cls, corpus, default, dtype=None, chunk_size=10000,
+                    e_vocab=None, f_vocab=None):
+        '''
+        build the co-occurrence structure of corpus [(es, fs)] in a
+        single pass, so corpus can be a stream.
+        every pair is initialized to default, which can also be a
+        function of the number of f words of corpus (e.g. for the
+        uniform distribution). data is a list when dtype is None,
+        otherwise a numpy array of dtype.
+        the words of corpus are added to e_vocab and f_vocab, or to
+        new vocabularies (those of corpus when it has some, see
+        encoded_pairs)
+        '''
+        if e_vocab is None:
+            e_vocab = getattr(corpus, "e_vocab", None)
+        if f_vocab is None:
+            f_vocab = getattr(corpus, "f_vocab", None)
+        e_vocab = Vocabulary() if e_vocab is None else e_vocab
+        f_vocab = Vocabulary() if f_vocab is None else f_vocab
+        # sorted keys of the chunks read so far, merged like the digits
+        # of a binary counter so that every key is merged O(log n)
+        # times, not once per chunk
+        runs = []
+        buf = []
+        pairs = encoded_pairs(corpus, e_vocab, f_vocab)
+        for (n, (e_ids, f_ids)) in enumerate(pairs, 1):
+            buf.extend((f_id << 32) | e_id
+                       for f_id in f_ids for e_id in e_ids)
+            if n % chunk_size == 0:
+                _push_run(runs, np.unique(np.array(buf, dtype=np.int64)))
+                buf = []
+        keys = np.unique(np.array(buf, dtype=np.int64))
+        for run in reversed(runs):
+            keys = np.union1d(run, keys)
+
+        indptr = np.searchsorted(keys >> 32, np.arange(len(f_vocab) + 1))
+        indices = (keys & 0xffffffff).astype(np.int32)
+        if callable(default):
+            default = default(np.count_nonzero(np.diff(indptr)))
+        if dtype is None:
+            data = [default] * len(keys)
+        else:
+            data = np.full(len(keys), default, dtype=dtype)
+        return cls(e_vocab, f_vocab,
+                   indptr.astype(np.int64), indices, data, default)
+
+    def extended(self, corpus):
+        '''
+        table which also holds the pairs co-occurring in corpus.
+        new words are added to the vocabularies, which keeps the ids
+        of self valid, and new pairs get the default value.
+        the new pairs are appended apart from the arrays, which are
+        shared with self and never modified, so extending costs the
+        size of corpus, not of the table; slot, slot_data and
+        row_slots read them without merging.
+        self is returned when corpus brings no new pair, and extended
+        in place when it already holds pairs not merged yet
+        '''
+        table = self if self._pending is not None else None
+        for (e_ids, f_ids) in encoded_pairs(corpus, self.e_vocab,
+                                            self.f_vocab):
+            for f_id in f_ids:
+                for e_id in e_ids:
+                    if (self if table is None else table).slot(
+                            e_id, f_id) >= 0:
+                        continue
+                    if table is None:
+                        table = self._overlay()
+                    table._pending.add(e_id, f_id, self.default)
+        return self if table is None else table
+
+    def _overlay(self):
+        '''table over the arrays of self, written through an _Overlay'''
+        indptr, indices, data = self.indptr, self.indices, self.data
+        table = TTable(self.e_vocab, self.f_vocab, indptr, indices, data,
+                       self.default)
+        table._pending = _Overlay(data)
+        return table
+
+    def _merge(self):
+        '''move the pending pairs and values into the arrays'''
+        pending = self._pending
+        self._pending = None
+        indptr, indices, base = self._arrays
+        rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64),
+                         np.diff(indptr))
+        keys = np.concatenate([
+            (rows << 32) | indices,
+            np.fromiter(pending.keys, dtype=np.int64,
+                        count=len(pending.keys))])
+        order = np.argsort(keys, kind="stable")
+        if isinstance(base, np.ndarray):
+            values = np.empty(len(keys), dtype=base.dtype)
+            values[:pending.n] = base
+            if pending.changed:
+                values[list(pending.changed)] = list(
+                    pending.changed.values())
+            values[pending.n:] = pending.extra
+            data = values[order]
+        else:
+            values = list(base)
+            for (slot, value) in pending.changed.items():
+                values[slot] = value
+            values.extend(pending.extra)
+            data = [values[pos] for pos in order.tolist()]
+        keys = keys[order]
+        indptr = np.searchsorted(keys >> 32,
+                                 np.arange(len(self.f_vocab) + 1))
+        self._set_arrays(indptr.astype(np.int64),
+                         (keys & 0xffffffff).astype(np.int32), data)
+
+    def transposed(self, default):
+        '''
+        table of the reverse direction, t(f|e), over the same
+        co-occurring pairs: e_vocab and f_vocab are swapped and every
+        pair is initialized to default, as in from_corpus.
+        it equals from_corpus over the reversed corpus without
+        reading the corpus again
+        '''
+        keys = np.sort((self.indices.astype(np.int64) << 32) |
+                       self.row_ids())
+        indptr = np.searchsorted(keys >> 32, np.arange(len(self.e_vocab) + 1))
+        if callable(default):
+            default = default(np.count_nonzero(np.diff(indptr)))
+        if isinstance(self.data, np.ndarray):
+            data = np.full(len(keys), default, dtype=self.data.dtype)
+        else:
+            data = [default] * len(keys)
+        return TTable(self.f_vocab, self.e_vocab, indptr.astype(np.int64),
+                      (keys & 0xffffffff).astype(np.int32), data, default)
+
+    def subset(self, keep):
+        '''
+        table holding only the slots where the boolean array keep is
+        True, with the same vocabularies and default
+        '''
+        keep = np.asarray(keep, dtype=bool)
+        rows = np.bincount(self.row_ids()[keep],
+                           minlength=len(self.indptr) - 1)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(rows, out=indptr[1:])
+        if isinstance(self.data, np.ndarray):
+            data = self.data[keep]
+        else:
+            data = [val for (val, k) in zip(self.data, keep.tolist()) if k]
+        return TTable(self.e_vocab, self.f_vocab, indptr,
+                      self.indices[keep], data, self.default)
+
+    @property
+    def frozen(self):
+        '''True when data can not be modified'''
+        if self._pending is not None:
+            return False
+        data = self._arrays[2]
+        if isinstance(data, np.ndarray):
+            return not data.flags.writeable
+        return isinstance(data, tuple)
+
+    def freeze(self, floor=None):
+        '''
+        read-only copy of the table, which can be shared between
+        threads, and between processes through fork, without copies.
+        floor replaces default as the value of the pairs which do not
+        co-occur; it is converted to the type of default, e.g. Decimal
+        '''
+        if isinstance(self.data, np.ndarray):
+            data = np.array(self.data)
+            data.setflags(write=False)
+        else:
+            data = tuple(self.data)
+        default = self.default
+        if floor is not None:
+            default = type(default)(str(floor))
+        return TTable(self.e_vocab, self.f_vocab, self.indptr,
+                      self.indices, data, default)
+
+    def thaw(self):
+        '''
+        mutable table over the data of a frozen one. the written values
+        are kept apart until data is read, so nothing is copied before
+        and self is never modified
+        '''
+        return self._overlay()
+
+    def slot(self, e_id, f_id):
+        '''position of (e_id, f_id) in data, or -1'''
+        if f_id < len(self._indptr) - 1:
+            lo = self._indptr[f_id]
+            hi = self._indptr[f_id + 1]
+            pos = bisect.bisect_left(self._indices, e_id, lo, hi)
+            if pos < hi and self._indices[pos] == e_id:
+                return pos
+        if self._pending is not None:
+            return self._pending.keys.get((f_id << 32) | e_id, -1)
+        return -1
+
+    def slot_data(self):
+        '''
+        data, read and written by slot. while the table holds pairs not
+        merged yet, the _Overlay which does so without merging them
+        '''
+        if self._pending is not None:
+            return self._pending
+        return self._arrays[2]
+
+    def row_slots(self, f_id):
+        '''slots of the pairs of f_id sorted by e id, without merging'''
+        if f_id < len(self._indptr) - 1:
+            slots = range(self._indptr[f_id], self._indptr[f_id + 1])
+        else:
+            slots = range(0)
+        extra = None if self._pending is None else \
+            self._pending.rows.get(f_id)
+        if not extra:
+            return slots
+        return [slot for (_, slot) in self.row_items(f_id)]
+
+    def row_items(self, f_id):
+        '''(e_id, slot) of the pairs of f_id sorted by e id'''
+        if f_id < len(self._indptr) - 1:
+            lo = self._indptr[f_id]
+            hi = self._indptr[f_id + 1]
+            row = zip(self._indices[lo:hi], range(lo, hi))
+        else:
+            row = ()
+        extra = None if self._pending is None else \
+            self._pending.rows.get(f_id)
+        if not extra:
+            return row
+        return heapq.merge(row, extra)
+
+    def sentence_slots(self, e_ids, f_ids):
+        '''
+        {(e_id, f_id): slot} of the pairs of a sentence kept in the
+        table. each row of f_ids is read once: a short row, e.g. of a
+        pruned table, is walked, a long one searched for the e ids
+        '''
+        e_ids = set(e_ids)
+        found = {}
+        n_rows = len(self._indptr) - 1
+        indices = self._indices
+        for f_id in set(f_ids):
+            if (f_id < n_rows and self._pending is None and
+                    self._indptr[f_id + 1] - self._indptr[f_id] >
+                    4 * len(e_ids)):
+                lo = self._indptr[f_id]
+                hi = self._indptr[f_id + 1]
+                for e_id in e_ids:
+                    pos = bisect.bisect_left(indices, e_id, lo, hi)
+                    if pos < hi and indices[pos] == e_id:
+                        found[(e_id, f_id)] = pos
+                continue
+            for (e_id, slot) in self.row_items(f_id):
+                if e_id in e_ids:
+                    found[(e_id, f_id)] = slot
+        return found
+
+    def slots(self, e_ids, f_ids):
+        '''
+        vectorized slot: e_ids and f_ids are broadcastable integer
+        arrays; missing pairs and negative ids give -1
+        '''
+        e_ids = np.asarray(e_ids, dtype=np.int64)
+        f_ids = np.asarray(f_ids, dtype=np.int64)
+        if self._keys is None:
+            # slots are sorted by (f_id, e_id), so one searchsorted
+            # over the packed keys finds every pair
+            self._keys = (self.row_ids() << 32) | self.indices
+        if not len(self._keys):
+            return np.full(np.broadcast(e_ids, f_ids).shape, -1)
+        target = (f_ids << 32) | e_ids
+        pos = np.minimum(np.searchsorted(self._keys, target),
+                         len(self._keys) - 1)
+        found = (self._keys[pos] == target) & (e_ids >= 0) & (f_ids >= 0)
+        return np.where(found, pos, -1)
+
+    def row_ids(self):
+        '''f id of every slot'''
+        return np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64),
+                         np.diff(self.indptr))
+
+    def _find(self, key):
+        e, f = key
+        e_id = self.e_index.get(e)
+        f_id = self.f_index.get(f)
+        if e_id is None or f_id is None:
+            return -1
+        return self.slot(e_id, f_id)
+
+    def __getitem__(self, key):
+        pos = self._find(key)
+        return self.default if pos < 0 else self.slot_data()[pos]
+
+    def get(self, key, default=None):
+        pos = self._find(key)
+        return default if pos < 0 else self.slot_data()[pos]
+
+    def __setitem__(self, key, value):
+        pos = self._find(key)
+        if pos < 0:
+            raise KeyError(key)
+        self.slot_data()[pos] = value
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __len__(self):
+        if self._pending is not None:
+            return len(self._pending)
+        return len(self._arrays[1])
+
+    def __iter__(self):
+        if self._pending is not None:
+            self._merge()
+        e_words = self.e_words
+        for f_id in range(len(self._indptr) - 1):
+            f = self.f_words[f_id]
+            for pos in range(self._indptr[f_id], self._indptr[f_id + 1]):
+                yield (e_words[self._indices[pos]], f)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return iter(self.data)
+
+    def items(self):
+        return zip(self, self.data)
+
+    @property
+    def nbytes(self):
+        '''approximate size of the index and the probabilities'''
+        size = self.indptr.nbytes + self.indices.nbytes
+        if isinstance(self.data, np.ndarray):
+            return size + self.data.nbytes
+        return size + 8 * len(self.data)
+
+
+def _push_run(runs, run):
+    '''
+    push the sorted unique keys run on runs, merging the last two runs
+    while the last is not much smaller than the one before
+    '''
+    runs.append(run)
+    while len(runs) > 1 and len(runs[-2]) <= 2 * len(runs[-1]):
+        last = runs.pop()
+        runs[-1] = np.union1d(runs[-1], last)
+
+
+class _Overlay(object):
+    '''
+    data of a table built by TTable.extended or thaw. base, the data
+    of its arrays, is never written: the values written to it and the
+    new pairs appended after it are kept in dictionaries and a list,
+    so the table is not rebuilt for every batch of new pairs
+    '''
+
+    def __init__(self, base):
+        self.base = base
+        self.n = len(base)
+        self.changed = {}
+        self.extra = []
+        # (f_id << 32) | e_id of the new pairs -> slot
+        self.keys = {}
+        # f_id -> (e_id, slot) of its new pairs, sorted
+        self.rows = collections.defaultdict(list)
+
+    def add(self, e_id, f_id, value):
+        slot = len(self)
+        self.keys[(f_id << 32) | e_id] = slot
+        bisect.insort(self.rows[f_id], (e_id, slot))
+        self.extra.append(value)
+        return slot
+
+    def __getitem__(self, slot):
+        if slot >= self.n:
+            return self.extra[slot - self.n]
+        try:
+            return self.changed[slot]
+        except KeyError:
+            return self.base[slot]
+
+    def __setitem__(self, slot, value):
+        if slot >= self.n:
+            self.extra[slot - self.n] = value
+        else:
+            self.changed[slot] = value
+
+    def __len__(self):
+        return self.n + len(self.extra)
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import os
+
+
+def format_alignment(alignment, reverse=False):
+    '''
+    alignment {(e, f)} of 1-based positions as a Pharaoh line
+    "i-j ...", i and j being the 0-based positions of the source word
+    f and of the target word e as in Moses, sorted. reverse=True
+    writes "e-f" instead, the order of files written before
+
+    >>> format_alignment({(1, 1), (3, 2), (2, 3)})
+    '0-0 1-2 2-1'
+    '''
+    points = sorted((e, f) if reverse else (f, e) for (e, f) in alignment)
+    return " ".join("{0}-{1}".format(i - 1, j - 1) for (i, j) in points)
+
+
+def parse_alignment(line, reverse=False):
+    '''
+    Pharaoh line "i-j ..." as {(e, f)} of 1-based positions,
+    see format_alignment
+
+    >>> sorted(parse_alignment("0-0 2-1"))
+    [(1, 1), (2, 3)]
+    '''
+    alignment = set()
+    for point in line.split():
+        i, sep, j = point.partition("-")
+        if not sep:
+            raise ValueError("invalid alignment point: {}".format(point))
+        i, j = int(i) + 1, int(j) + 1
+        alignment.add((i, j) if reverse else (j, i))
+    return alignment
+
+
+def write_alignments(path, alignments, reverse=False):
+    '''
+    write alignments, one sentence per line, in the Pharaoh format.
+    alignments can be a generator, e.g. word_alignment.symmetrize_corpus,
+    as they are written one at a time. path is a file object or a
+    path (str or pathlib.Path), which is written next to it and
+    renamed at the end, so a stage reading it never sees a partial
+    file. the partial file is removed if alignments raises
+    return
+        number of alignments written
+    '''
+    if not isinstance(path, (str, os.PathLike)):
+        return _write(path, alignments, reverse)
+    path = os.fspath(path)
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as fd:
+            count = _write(fd, alignments, reverse)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return count
+
+
+def _write(fd, alignments, reverse):
+    count = 0
+    for alignment in alignments:
+        fd.write(format_alignment(alignment, reverse) + "\n")
+        count += 1
+    return count
+
+
+def read_alignments(path, reverse=False):
+    '''
+    iterator over the alignments of a Pharaoh file (a path or a file
+    object), read one line at a time
+    '''
+    if not isinstance(path, (str, os.PathLike)):
+        for line in path:
+            yield parse_alignment(line, reverse)
+        return
+    with open(path, encoding="utf-8") as fd:
+        for line in fd:
+            yield parse_alignment(line, reverse)
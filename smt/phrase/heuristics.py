@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import heapq
+import numpy as np
+
+# (e, f) offsets of the neighbors used by grow-diag, in the order they
+# are tried, which decides between neighbors aligning the same word.
+# it is the iteration order of the neighbor set _alignment used to have
+DIAG_NEIGHBORS = [(0, 1), (-1, -1), (-1, 1), (1, 1),
+                  (1, -1), (-1, 0), (1, 0), (0, -1)]
+# and those used by grow
+NEIGHBORS = [(e, f) for (e, f) in DIAG_NEIGHBORS if not (e and f)]
+
+
+def to_matrix(points, m, n):
+    '''
+    alignment {(e, f)} of 1-based positions as a boolean array of
+    shape (m, n), cell [e - 1, f - 1] being True when e and f are
+    aligned. points out of the sentences are dropped
+    '''
+    matrix = np.zeros((m, n), dtype=bool)
+    points = [(e, f) for (e, f) in points if 1 <= e <= m and 1 <= f <= n]
+    if points:
+        e_pos, f_pos = zip(*points)
+        matrix[np.array(e_pos) - 1, np.array(f_pos) - 1] = True
+    return matrix
+
+
+def to_points(matrix):
+    '''boolean alignment array as {(e, f)} of 1-based positions'''
+    return {(e + 1, f + 1) for (e, f) in np.argwhere(matrix).tolist()}
+
+
+def grow_points(alignment, union, e_aligned, f_aligned, offsets, m, n):
+    '''
+    grow the set of (e, f) points alignment towards the set union:
+    the cells of the m x n matrix are swept in row-major order, round
+    after round until nothing is added, and every aligned cell adds
+    its neighbors at offsets which are in union and align a new e or
+    f. e_aligned and f_aligned, the aligned positions, are updated.
+
+    the sweeps are replayed with a heap of the points the current
+    sweep has still to reach, and a list of those added behind it,
+    which the next sweep reaches. a point is expanded once: its
+    neighbors which were not added then never will be, as aligned
+    positions are never removed. points out of the matrix can be
+    added but are not expanded
+    '''
+    def inside(point):
+        return 1 <= point[0] <= m and 1 <= point[1] <= n
+
+    current = [point for point in alignment if inside(point)]
+    while current:
+        heapq.heapify(current)
+        behind = []
+        while current:
+            point = heapq.heappop(current)
+            (e_word, f_word) = point
+            for (e_diff, f_diff) in offsets:
+                new = (e_word + e_diff, f_word + f_diff)
+                if new in alignment or new not in union:
+                    continue
+                if new[0] in e_aligned and new[1] in f_aligned:
+                    continue
+                alignment.add(new)
+                e_aligned.add(new[0])
+                f_aligned.add(new[1])
+                if not inside(new):
+                    continue
+                if new > point:
+                    heapq.heappush(current, new)
+                else:
+                    behind.append(new)
+        current = behind
+
+
+def _add_unaligned(alignment, candidates, both=False):
+    '''
+    add the candidate cells, in row-major order, whose e or f (or e
+    and f when both is True) is not aligned yet.
+    return
+        number of cells added
+    '''
+    e_aligned = alignment.any(axis=1)
+    f_aligned = alignment.any(axis=0)
+    added = 0
+    for (e, f) in np.argwhere(candidates).tolist():
+        if both:
+            ok = not e_aligned[e] and not f_aligned[f]
+        else:
+            ok = not e_aligned[e] or not f_aligned[f]
+        if ok:
+            alignment[e, f] = True
+            e_aligned[e] = True
+            f_aligned[f] = True
+            added += 1
+    return added
+
+
+def intersection(e2f, f2e):
+    return e2f & f2e
+
+
+def union(e2f, f2e):
+    return e2f | f2e
+
+
+def grow(e2f, f2e, diag=False):
+    '''
+    intersection grown towards the union point by point, see
+    grow_points. with diag, it is the grow-diag step of
+    word_alignment._alignment
+    '''
+    m, n = e2f.shape
+    alignment = to_points(e2f & f2e)
+    grow_points(alignment, to_points(e2f | f2e),
+                {e for (e, f) in alignment}, {f for (e, f) in alignment},
+                DIAG_NEIGHBORS if diag else NEIGHBORS, m, n)
+    return to_matrix(alignment, m, n)
+
+
+def grow_diag(e2f, f2e):
+    return grow(e2f, f2e, diag=True)
+
+
+def grow_diag_final(e2f, f2e, both=False):
+    '''
+    grow_diag, then the cells of the union aligning a new e or f
+    (a new e and a new f when both is True) are added in row-major
+    order
+    '''
+    alignment = grow(e2f, f2e, diag=True)
+    _add_unaligned(alignment, (e2f | f2e) & ~alignment, both=both)
+    return alignment
+
+
+def grow_diag_final_and(e2f, f2e):
+    return grow_diag_final(e2f, f2e, both=True)
+
+
+HEURISTICS = {
+    "intersection": intersection,
+    "union": union,
+    "grow": grow,
+    "grow-diag": grow_diag,
+    "grow-diag-final": grow_diag_final,
+    "grow-diag-final-and": grow_diag_final_and,
+}
+
+
+def symmetrize(e2f, f2e, heuristic="grow-diag-final"):
+    '''
+    combine the boolean (m, n) alignment arrays of both directions,
+    see to_matrix, with one of HEURISTICS. intersection and union
+    are the cheapest; the grow heuristics trade speed for recall
+    '''
+    try:
+        func = HEURISTICS[heuristic]
+    except KeyError:
+        raise ValueError("unknown heuristic: {}".format(heuristic))
+    return func(e2f, f2e)
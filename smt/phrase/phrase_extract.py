@@ -1,8 +1,14 @@
 #! /usr/bin/env python
 # coding:utf-8
+import bisect
+import itertools
 
 
 def phrase_extract(es, fs, alignment):
+    """
+    es and fs can be words or their Vocabulary ids, the phrases
+    are tuples of the same items
+    """
     ext = extract(es, fs, alignment)
     ind = {((x, y), (z, w)) for x, y, z, w in ext}
     es = tuple(es)
@@ -15,42 +21,95 @@ def extract(es, fs, alignment):
     """
     caution:
         alignment starts from 1 - not 0
+    return
+        set of (e_start, e_end, f_start, f_end) of the phrases
+        consistent with alignment, the unaligned f next to them
+        included
+
+    the f positions aligned to each e and the e positions aligned to
+    each f are collected once, so a span is checked without scanning
+    alignment again and the time is that of the output
     """
-    phrases = set()
     len_es = len(es)
+    len_fs = len(fs)
+    # min and max f aligned to each e of es
+    f_min = [None] * (len_es + 1)
+    f_max = [None] * (len_es + 1)
+    # min and max e aligned to each f, of any e
+    e_range = {}
+    for (e, f) in alignment:
+        if 1 <= e <= len_es:
+            if f_min[e] is None or f < f_min[e]:
+                f_min[e] = f
+            if f_max[e] is None or f > f_max[e]:
+                f_max[e] = f
+        lo, hi = e_range.get(f, (e, e))
+        e_range[f] = (min(lo, e), max(hi, e))
+    aligned = sorted(e_range)
+    # e range of the aligned f of aligned[i:j + 1]
+    spans = []
+    for i in range(len(aligned)):
+        lo, hi = e_range[aligned[i]]
+        row = []
+        for f in aligned[i:]:
+            lo = min(lo, e_range[f][0])
+            hi = max(hi, e_range[f][1])
+            row.append((lo, hi))
+        spans.append(row)
+
+    phrases = set()
     for e_start in range(1, len_es+1):
+        # the minimally matching foreign phrase grows with e_end
+        f_start, f_end = (len_fs, 0)
         for e_end in range(e_start, len_es+1):
-            # find the minimally matching foreign phrase
-            f_start, f_end = (len(fs), 0)
-            for (e, f) in alignment:
-                if e_start <= e <= e_end:
-                    f_start = min(f, f_start)
-                    f_end = max(f, f_end)
-            phrases.update(_extract(es, fs, e_start,
-                                    e_end, f_start,
-                                    f_end, alignment))
+            if f_min[e_end] is not None:
+                f_start = min(f_min[e_end], f_start)
+                f_end = max(f_max[e_end], f_end)
+            if f_end == 0:
+                continue
+            i = bisect.bisect_left(aligned, f_start)
+            j = bisect.bisect_right(aligned, f_end) - 1
+            if i <= j:
+                lo, hi = spans[i][j - i]
+                if lo < e_start or hi > e_end:
+                    continue
+            # extend over the unaligned f on both sides
+            f_ends = [f_end]
+            f_e = f_end + 1
+            while f_e not in e_range and f_e <= len_fs:
+                f_ends.append(f_e)
+                f_e += 1
+            f_s = f_start
+            while True:
+                phrases.update((e_start, e_end, f_s, f_e) for f_e in f_ends)
+                f_s -= 1
+                if f_s in e_range or f_s < 1:
+                    break
     return phrases
 
 
-def _extract(es, fs, e_start, e_end, f_start, f_end, alignment):
-    if f_end == 0:
-        return {}
-    for (e, f) in alignment:
-        if (f_start <= f <= f_end) and (e < e_start or e > e_end):
-            return {}
-    ex = set()
-    f_s = f_start
-    while True:
-        f_e = f_end
-        while True:
-            ex.add((e_start, e_end, f_s, f_e))
-            f_e += 1
-            if f_e in list(zip(*alignment))[1] or f_e > len(fs):
-                break
-        f_s -= 1
-        if f_s in list(zip(*alignment))[1] or f_s < 1:
-            break
-    return ex
+def zip_alignments(pairs, alignments):
+    """
+    iterator over (es, fs, alignment), alignments being read in step
+    with pairs, e.g. from alignfile.read_alignments, so neither has to
+    fit in memory. raise ValueError if their lengths differ
+    """
+    marker = object()
+    for pair, alignment in itertools.zip_longest(pairs, alignments,
+                                                 fillvalue=marker):
+        if pair is marker or alignment is marker:
+            raise ValueError("the alignments do not match the sentences")
+        es, fs = pair
+        yield es, fs, alignment
+
+
+def phrase_extract_corpus(pairs, alignments):
+    """
+    iterator over the phrases of every (es, fs) of pairs, see
+    phrase_extract and zip_alignments
+    """
+    for es, fs, alignment in zip_alignments(pairs, alignments):
+        yield phrase_extract(es, fs, alignment)
 
 
 def available_phrases(fs, phrases):
@@ -109,38 +168,46 @@ def test_phrases():
 if __name__ == '__main__':
 
     # test2
+    #   phrase_extract.py TRAIN < PAIRS
+    #       align PAIRS with models trained on TRAIN and extract
+    #   phrase_extract.py --align TRAIN ALIGNMENTS < PAIRS
+    #       only write the alignments of PAIRS to ALIGNMENTS
+    #   phrase_extract.py --extract ALIGNMENTS < PAIRS
+    #       only extract, with the alignments read from ALIGNMENTS
     from smt.utils.utility import mkcorpus
-    from word_alignment import alignment
-    from smt.ibmmodel import ibmmodel2
+    from smt.phrase.word_alignment import symmetrize_corpus
+    from smt.phrase import alignfile
+    from smt.ibmmodel import bidirectional
     import sys
 
     delimiter = ","
-    # load file which will be trained
-    modelfd = open(sys.argv[1])
-    sentenses = [line.rstrip().split(delimiter) for line
-                 in modelfd.readlines()]
-    # make corpus
-    corpus = mkcorpus(sentenses)
-
-    # train model from corpus
-    f2e_train = ibmmodel2._train(corpus, loop_count=10)
-    e2f_corpus = list(zip(*reversed(list(zip(*corpus)))))
-    e2f_train = ibmmodel2._train(e2f_corpus, loop_count=10)
+    args = sys.argv[1:]
+    stage = args.pop(0) if args[0] in ("--align", "--extract") else None
 
     # phrase extraction
-    for line in sys.stdin:
-        _es, _fs = line.rstrip().split(delimiter)
-        es = _es.split()
-        fs = _fs.split()
-
-        f2e = ibmmodel2.viterbi_alignment(es, fs, *f2e_train).items()
-        e2f = ibmmodel2.viterbi_alignment(fs, es, *e2f_train).items()
-        align = alignment(es, fs, e2f, f2e)  # symmetrized alignment
-
-        # output matrix
-        #from smt.utils.utility import matrix
-        #print(matrix(len(es), len(fs), align, es, fs))
-
-        ext = phrase_extract(es, fs, align)
+    pairs = ([s.split() for s in line.rstrip().split(delimiter)]
+             for line in sys.stdin)
+    if stage == "--extract":
+        aligns = alignfile.read_alignments(args[0])
+    else:
+        # load file which will be trained
+        modelfd = open(args[0])
+        sentenses = [line.rstrip().split(delimiter) for line
+                     in modelfd.readlines()]
+        # make corpus
+        corpus = mkcorpus(sentenses)
+
+        # train model from corpus
+        models = bidirectional._train(corpus, loop_count=10)
+
+        if stage == "--align":
+            # the pairs are not kept for the extraction
+            alignfile.write_alignments(
+                args[1], symmetrize_corpus(pairs, models=models, batch=True))
+            sys.exit()
+        pairs, align_pairs = itertools.tee(pairs)
+        # symmetrized alignments
+        aligns = symmetrize_corpus(align_pairs, models=models, batch=True)
+    for ext in phrase_extract_corpus(pairs, aligns):
         for e, f in ext:
             print("{}{}{}".format(''.join(e), delimiter, ''.join(f)))
@@ -2,7 +2,11 @@
 # coding:utf-8
 
 from __future__ import division, print_function
+import multiprocessing
 from smt.ibmmodel import ibmmodel2
+from smt.ibmmodel import bidirectional
+from smt.utils import utility
+from smt.phrase import heuristics
 from pprint import pprint
 
 
@@ -30,48 +34,35 @@ def _alignment(elist, flist, e2f, f2e):
           -----------------
 
     '''
-    neighboring = {(-1, 0), (0, -1), (1, 0), (0, 1),
-                   (-1, -1), (-1, 1), (1, -1), (1, 1)}
     e2f = set(e2f)
     f2e = set(f2e)
     m = len(elist)
     n = len(flist)
+    union = e2f.union(f2e)
     alignment = e2f.intersection(f2e)
+    # aligned e and f positions, kept up to date with alignment
+    e_aligned = {e for (e, f) in alignment}
+    f_aligned = {f for (e, f) in alignment}
+
+    def inside(point):
+        return 1 <= point[0] <= m and 1 <= point[1] <= n
+
     # marge with neighborhood
-    while True:
-        set_len = len(alignment)
-        for e_word in range(1, m+1):
-            for f_word in range(1, n+1):
-                if (e_word, f_word) in alignment:
-                    for (e_diff, f_diff) in neighboring:
-                        e_new = e_word + e_diff
-                        f_new = f_word + f_diff
-                        if not alignment:
-                            if (e_new, f_new) in e2f.union(f2e):
-                                alignment.add((e_new, f_new))
-                        else:
-                            if ((e_new not in list(zip(*alignment))[0]
-                                    or f_new not in list(zip(*alignment))[1])
-                                    and (e_new, f_new) in e2f.union(f2e)):
-                                alignment.add((e_new, f_new))
-        if set_len == len(alignment):
-            break
+    heuristics.grow_points(alignment, union, e_aligned, f_aligned,
+                           heuristics.DIAG_NEIGHBORS, m, n)
     # finalize
-    for e_word in range(1, m+1):
-        for f_word in range(1, n+1):
-            # for alignment = set([])
-            if not alignment:
-                if (e_word, f_word) in e2f.union(f2e):
-                    alignment.add((e_word, f_word))
-            else:
-                if ((e_word not in list(zip(*alignment))[0]
-                        or f_word not in list(zip(*alignment))[1])
-                        and (e_word, f_word) in e2f.union(f2e)):
-                    alignment.add((e_word, f_word))
+    for (e_word, f_word) in sorted(point for point in union
+                                   if inside(point)):
+        # for alignment = set([])
+        if (not alignment or e_word not in e_aligned or
+                f_word not in f_aligned):
+            alignment.add((e_word, f_word))
+            e_aligned.add(e_word)
+            f_aligned.add(f_word)
     return alignment
 
 
-def alignment(es, fs, e2f, f2e):
+def alignment(es, fs, e2f, f2e, heuristic=None):
     """
     es: English words
     fs: Foreign words
@@ -79,26 +70,115 @@ def alignment(es, fs, e2f, f2e):
         [(e, f)] or {(e, f)}
     e2f: alignment for translation from es to fs
         [(f, e)] or {(f, e)}
+    heuristic: name of one of heuristics.HEURISTICS computed on
+        boolean matrices, e.g. "intersection" for speed; None is the
+        grow-diag-final of _alignment
     """
     _e2f = list(zip(*reversed(list(zip(*e2f)))))
-    return _alignment(es, fs, _e2f, f2e)
+    if heuristic is None:
+        return _alignment(es, fs, _e2f, f2e)
+    m = len(es)
+    n = len(fs)
+    return heuristics.to_points(
+        heuristics.symmetrize(heuristics.to_matrix(_e2f, m, n),
+                              heuristics.to_matrix(f2e, m, n),
+                              heuristic))
 
 
-def symmetrization(es, fs, corpus):
+def symmetrization(es, fs, corpus, heuristic=None):
     '''
     forpus
         for translation from fs to es
+    heuristic
+        symmetrization heuristic, see alignment
     return
         alignment **from fs to es**
     '''
-    f2e_train = ibmmodel2._train(corpus, loop_count=10)
-    f2e = ibmmodel2.viterbi_alignment(es, fs, *f2e_train).items()
+    models = bidirectional._train(corpus, loop_count=10)
+    return _symmetrize(es, fs, models, heuristic)
+
+
+def _symmetrize(es, fs, models, heuristic=None):
+    '''
+    symmetrized viterbi alignments of es and fs with
+    models = ((t_fe, a_fe), (t_ef, a_ef))
+    '''
+    f2e_model, e2f_model = models
+    f2e = ibmmodel2.viterbi_alignment(es, fs, *f2e_model).items()
+    e2f = ibmmodel2.viterbi_alignment(fs, es, *e2f_model).items()
+    return alignment(es, fs, e2f, f2e, heuristic)
+
+
+def _symmetrize_chunk(pairs, models, batch=False, heuristic=None):
+    '''_symmetrize of every (es, fs) in pairs'''
+    if not batch:
+        return [_symmetrize(es, fs, models, heuristic)
+                for (es, fs) in pairs]
+    f2e_model, e2f_model = models
+    f2es = ibmmodel2.viterbi_alignment_batch(pairs, *f2e_model)
+    e2fs = ibmmodel2.viterbi_alignment_batch(
+        [(fs, es) for (es, fs) in pairs], *e2f_model)
+    return [alignment(es, fs, e2f.items(), f2e.items(), heuristic)
+            for ((es, fs), f2e, e2f) in zip(pairs, f2es, e2fs)]
+
 
-    e2f_corpus = list(zip(*reversed(list(zip(*corpus)))))
-    e2f_train = ibmmodel2._train(e2f_corpus, loop_count=10)
-    e2f = ibmmodel2.viterbi_alignment(fs, es, *e2f_train).items()
+# models broadcast to the worker processes of symmetrize_corpus
+_shared = {}
 
-    return alignment(es, fs, e2f, f2e)
+
+def _init_worker(models, batch, heuristic):
+    _shared["models"] = models
+    _shared["batch"] = batch
+    _shared["heuristic"] = heuristic
+
+
+def _worker_symmetrize(pairs):
+    return _symmetrize_chunk(pairs, _shared["models"], _shared["batch"],
+                             _shared["heuristic"])
+
+
+def symmetrize_corpus(corpus, loop_count=10, models=None, processes=1,
+                      chunk_size=1000, batch=False, heuristic=None,
+                      **kwargs):
+    '''
+    symmetrization of every pair of corpus with models trained once
+
+    corpus
+        [(es, fs)] for translation from fs to es, read twice when
+        models is None: once for training, once for aligning
+    models
+        ((t_fe, a_fe), (t_ef, a_ef)) as returned by
+        ibmmodel.bidirectional._train. if None, they are trained on
+        corpus for loop_count iterations, kwargs being passed to
+        bidirectional._train
+    processes
+        number of worker processes aligning chunks of chunk_size
+        pairs, None means os.cpu_count()
+    batch
+        if True, the viterbi alignments of a chunk are computed with
+        ibmmodel2.viterbi_alignment_batch, which is faster but can
+        break ties differently from symmetrization
+    heuristic
+        symmetrization heuristic, see alignment
+    return
+        iterator over the alignments **from fs to es** of the pairs,
+        in corpus order
+    '''
+    if models is None:
+        models = bidirectional._train(corpus, loop_count=loop_count,
+                                      **kwargs)
+    chunks = utility.chunks(corpus, chunk_size)
+    if processes == 1:
+        for pairs in chunks:
+            for ali in _symmetrize_chunk(pairs, models, batch,
+                                         heuristic):
+                yield ali
+        return
+    with multiprocessing.Pool(processes, _init_worker,
+                              (models, batch, heuristic)) as pool:
+        for alignments in pool.imap(_worker_symmetrize, chunks):
+            for ali in alignments:
+                yield ali
 
 
 if __name__ == '__main__':
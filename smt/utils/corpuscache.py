@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import array
+import os
+import shutil
+import numpy as np
+from smt.utils.vocabulary import Vocabulary
+
+
+class CorpusCache(object):
+    """
+    tokenized parallel corpus encoded once and stored in the
+    directory path as flat arrays
+
+        lang<n>_ids.npy       int32 word ids of every sentence
+        lang<n>_offsets.npy   int64, sentence k is
+                              ids[offsets[k]:offsets[k+1]]
+        lang<n>.vocab         Vocabulary of the ids
+
+    for the languages 1 and 2. the arrays are memory-mapped, so every
+    stage reads the corpus without tokenizing it again and several
+    processes share its pages.
+
+    >>> cache = CorpusCache.build("corpus.cache", [("a b", "x y")])
+    >>> t, a = ibmmodel2._train(cache.corpus(transfrom=2, transto=1))
+    """
+
+    def __init__(self, path, chunk_size=10000):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.vocabs = {}
+        self.ids = {}
+        self.offsets = {}
+        for lang in (1, 2):
+            name = os.path.join(path, "lang{0}".format(lang))
+            self.vocabs[lang] = Vocabulary.load(name + ".vocab")
+            self.ids[lang] = np.load(name + "_ids.npy", mmap_mode="r")
+            self.offsets[lang] = np.load(name + "_offsets.npy",
+                                         mmap_mode="r")
+
+    @classmethod
+    def build(cls, path, pairs, vocabs=None):
+        """
+        encode pairs [(lang1 words, lang2 words)] into path in one
+        pass. words are lists or whitespace separated strings.
+        vocabs is {1: Vocabulary, 2: Vocabulary}, new ones if None
+        """
+        if vocabs is None:
+            vocabs = {1: Vocabulary(), 2: Vocabulary()}
+        ids = {1: array.array("i"), 2: array.array("i")}
+        offsets = {1: array.array("q", [0]), 2: array.array("q", [0])}
+        for pair in pairs:
+            for (lang, words) in zip((1, 2), pair):
+                if isinstance(words, str):
+                    words = words.split()
+                ids[lang].extend(vocabs[lang].encode(words))
+                offsets[lang].append(len(ids[lang]))
+
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        for lang in (1, 2):
+            name = os.path.join(tmp, "lang{0}".format(lang))
+            vocabs[lang].save(name + ".vocab")
+            np.save(name + "_ids.npy",
+                    np.frombuffer(ids[lang], dtype=np.int32))
+            np.save(name + "_offsets.npy",
+                    np.frombuffer(offsets[lang], dtype=np.int64))
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+        return cls(path)
+
+    def __len__(self):
+        return len(self.offsets[1]) - 1
+
+    def sentence_ids(self, lang):
+        """word ids of every sentence of lang, as lists"""
+        ids = self.ids[lang]
+        offsets = self.offsets[lang]
+        for start in range(0, len(self), self.chunk_size):
+            # one tolist per chunk instead of one per sentence
+            bounds = offsets[start:start + self.chunk_size + 1].tolist()
+            chunk = ids[bounds[0]:bounds[-1]].tolist()
+            base = bounds[0]
+            for (lo, hi) in zip(bounds[:-1], bounds[1:]):
+                yield chunk[lo - base:hi - base]
+
+    def sentences(self, lang):
+        """words of every sentence of lang"""
+        words = self.vocabs[lang].words
+        for ids in self.sentence_ids(lang):
+            yield [words[i] for i in ids]
+
+    def corpus(self, transfrom=2, transto=1):
+        """
+        re-iterable corpus [(lang<transto> words, lang<transfrom>
+        words)] for IBM training
+        """
+        return _CachedCorpus(self, transfrom, transto)
+
+
+class _CachedCorpus(object):
+    """
+    pairs of words of a CorpusCache. ids() gives them as the ids of
+    e_vocab and f_vocab without decoding, see ttable.encoded_pairs
+    """
+
+    def __init__(self, cache, transfrom, transto):
+        self.cache = cache
+        self.transfrom = transfrom
+        self.transto = transto
+        self.e_vocab = cache.vocabs[transto]
+        self.f_vocab = cache.vocabs[transfrom]
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __iter__(self):
+        return zip(self.cache.sentences(self.transto),
+                   self.cache.sentences(self.transfrom))
+
+    def ids(self):
+        return zip(self.cache.sentence_ids(self.transto),
+                   self.cache.sentence_ids(self.transfrom))
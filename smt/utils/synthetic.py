@@ -0,0 +1,41 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import numpy as np
+
+
+def synthetic_corpus(n_pairs, vocab_size=1000, mean_length=10,
+                     max_length=40, zipf=1.1, noise=0.1, seed=0):
+    """
+    random parallel corpus [(es, fs)] of n_pairs sentence pairs,
+    e.g. to measure the training speed on corpora of a given size
+
+    the f words are drawn from a Zipf distribution of exponent zipf
+    over vocab_size words and the sentence lengths from a Poisson
+    distribution of mean mean_length, cut to [1, max_length].
+    each f word is translated by a fixed e word, except a fraction
+    noise of the words which are replaced by random ones, and
+    neighbouring e words are swapped with the same probability, so
+    the corpus has alignments to learn. the same seed gives the same
+    corpus
+
+    >>> synthetic_corpus(1, vocab_size=5, mean_length=3)
+    [(['e4', 'e3', 'e2', 'e0'], ['f3', 'f4', 'f0', 'f2'])]
+    """
+    rng = np.random.RandomState(seed)
+    prob = np.arange(1, vocab_size + 1, dtype=np.float64) ** -zipf
+    prob /= prob.sum()
+    translation = rng.permutation(vocab_size)
+    lengths = np.clip(rng.poisson(mean_length, n_pairs), 1, max_length)
+    corpus = []
+    for length in lengths.tolist():
+        f_ids = rng.choice(vocab_size, length, p=prob)
+        e_ids = translation[f_ids]
+        replaced = rng.random_sample(length) < noise
+        e_ids[replaced] = rng.choice(vocab_size, replaced.sum(), p=prob)
+        for j in np.flatnonzero(rng.random_sample(length - 1) < noise):
+            e_ids[j], e_ids[j + 1] = e_ids[j + 1], e_ids[j]
+        corpus.append((["e{0}".format(i) for i in e_ids.tolist()],
+                       ["f{0}".format(i) for i in f_ids.tolist()]))
+    return corpus
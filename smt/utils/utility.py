@@ -2,6 +2,11 @@
 # coding:utf-8
 
 from __future__ import division, print_function
+import array
+import collections
+import hashlib
+import itertools
+from smt.utils.vocabulary import Vocabulary
 
 
 def mkcorpus(sentences):
@@ -42,6 +47,235 @@ def mkcorpus(sentences):
     return [(es.split(), fs.split()) for (es, fs) in sentences]
 
 
+def dedup(corpus):
+    """
+    collapse the duplicate sentence pairs of corpus
+    return
+        (pairs, weights): the distinct pairs in order of first
+        appearance and the number of times each of them occurs,
+        to be passed as the weights of IBM training
+
+    >>> dedup([(["a"], ["x"]), (["b"], ["y"]), (["a"], ["x"])])
+    ([(['a'], ['x']), (['b'], ['y'])], [2, 1])
+    """
+    counts = {}
+    for (es, fs) in corpus:
+        key = (tuple(es), tuple(fs))
+        counts[key] = counts.get(key, 0) + 1
+    return ([(list(es), list(fs)) for (es, fs) in counts],
+            list(counts.values()))
+
+
+class DedupedCorpus(object):
+    """
+    re-iterable view of the distinct sentence pairs of corpus, like
+    dedup without holding them: a first pass keeps a digest of every
+    distinct pair, then each iteration reads corpus again and yields
+    the first occurrences, so a streamed corpus stays streamed
+
+    weights
+        number of occurrences of each pair yielded, in order
+
+    the vocabularies of corpus are kept, e.g. those of filter_corpus,
+    and so is the ids() method of a CorpusCache corpus, see
+    ttable.encoded_pairs
+
+    >>> corpus = DedupedCorpus([(["a"], ["x"]), (["b"], ["y"]),
+    ...                         (["a"], ["x"])])
+    >>> list(corpus), corpus.weights
+    ([(['a'], ['x']), (['b'], ['y'])], [2, 1])
+    """
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.e_vocab = getattr(corpus, "e_vocab", None)
+        self.f_vocab = getattr(corpus, "f_vocab", None)
+        if hasattr(corpus, "ids"):
+            self.ids = self._ids
+        firsts = {}
+        counts = []
+        for (index, (es, fs)) in enumerate(corpus):
+            text = "\x00".join(es) + "\x01" + "\x00".join(fs)
+            key = hashlib.blake2b(text.encode("utf-8"),
+                                  digest_size=16).digest()
+            if key in firsts:
+                counts[firsts[key]][1] += 1
+            else:
+                firsts[key] = len(counts)
+                counts.append([index, 1])
+        self._firsts = array.array("q", (i for (i, _) in counts))
+        self.weights = [c for (_, c) in counts]
+
+    def __iter__(self):
+        return self._first_pairs(self.corpus)
+
+    def _ids(self):
+        return self._first_pairs(self.corpus.ids())
+
+    def _first_pairs(self, pairs):
+        firsts = iter(self._firsts)
+        first = next(firsts, None)
+        for (index, pair) in enumerate(pairs):
+            if index == first:
+                yield pair
+                first = next(firsts, None)
+                if first is None:
+                    return
+
+    def __len__(self):
+        return len(self._firsts)
+
+
+def filter_corpus(corpus, max_length=None, max_ratio=None,
+                  vocab_size=None, unk="<unk>", report=None):
+    """
+    cleaning stage between corpus creation and IBM training
+
+    max_length
+        drop the pairs with a sentence of more than max_length words
+    max_ratio
+        drop the pairs whose longer sentence has more than max_ratio
+        times the words of the shorter one
+    vocab_size
+        keep the vocab_size most frequent words of each language in
+        the remaining pairs and replace the others with unk
+    report
+        dictionary filled with the number of "pairs" read, of pairs
+        "kept", dropped as "too_long" and for a "bad_ratio", and of
+        "tokens" kept, of which "unk_tokens" were replaced
+    return
+        FilteredCorpus of the kept (es, fs)
+
+    corpus must be re-iterable (a list, a FileCorpus, a
+    SentenceTableCorpus, ...): it is read once here to count, then
+    again at each iteration of the result, so a streamed corpus is
+    never held in memory
+
+    >>> list(filter_corpus([(["a"], ["x", "y", "z"]), (["a"], ["x"])],
+    ...                    max_ratio=2))
+    [(['a'], ['x'])]
+    """
+    return FilteredCorpus(corpus, max_length, max_ratio, vocab_size, unk,
+                          report)
+
+
+class FilteredCorpus(object):
+    """
+    re-iterable view of the pairs of corpus kept by filter_corpus
+
+    e_vocab, f_vocab
+        Vocabulary of the kept words of each language with unk, or
+        None without vocab_size. the words of other sentences, e.g.
+        those aligned after training, are mapped the same way with
+        e_vocab.unk_words(es)
+    """
+
+    def __init__(self, corpus, max_length=None, max_ratio=None,
+                 vocab_size=None, unk="<unk>", report=None):
+        self.corpus = corpus
+        self.max_length = max_length
+        self.max_ratio = max_ratio
+        self.e_vocab = self.f_vocab = None
+        report = {} if report is None else report
+        report.update({"pairs": 0, "kept": 0, "too_long": 0,
+                       "bad_ratio": 0, "tokens": 0, "unk_tokens": 0})
+        e_counts = collections.Counter()
+        f_counts = collections.Counter()
+        for (es, fs) in self._kept(report):
+            report["kept"] += 1
+            report["tokens"] += len(es) + len(fs)
+            if vocab_size is not None:
+                e_counts.update(es)
+                f_counts.update(fs)
+        self._len = report["kept"]
+        if vocab_size is None:
+            return
+
+        self.e_vocab = Vocabulary(
+            (e for (e, _) in e_counts.most_common(vocab_size)), unk=unk)
+        self.f_vocab = Vocabulary(
+            (f for (f, _) in f_counts.most_common(vocab_size)), unk=unk)
+        report["unk_tokens"] = (
+            sum(c for (e, c) in e_counts.items() if e not in self.e_vocab) +
+            sum(c for (f, c) in f_counts.items() if f not in self.f_vocab))
+
+    def _kept(self, report=None):
+        for (es, fs) in self.corpus:
+            longer = max(len(es), len(fs))
+            shorter = min(len(es), len(fs))
+            if self.max_length is not None and longer > self.max_length:
+                reason = "too_long"
+            elif (self.max_ratio is not None and
+                  longer > self.max_ratio * shorter):
+                reason = "bad_ratio"
+            else:
+                reason = None
+            if report is not None:
+                report["pairs"] += 1
+                if reason is not None:
+                    report[reason] += 1
+            if reason is None:
+                yield (es, fs)
+
+    def __iter__(self):
+        for (es, fs) in self._kept():
+            if self.e_vocab is None:
+                yield (es, fs)
+            else:
+                yield (self.e_vocab.unk_words(es), self.f_vocab.unk_words(fs))
+
+    def __len__(self):
+        return self._len
+
+
+class FileCorpus(object):
+    """
+    corpus streamed from a file with one sentence pair per line
+
+        es<delimiter>fs
+
+    every iteration re-reads the file in chunks of about buffer_size
+    bytes, so training on it keeps only the model in memory.
+
+    >>> corpus = FileCorpus("corpus.txt")
+    >>> t, a = ibmmodel2._train(corpus, loop_count=10)
+    """
+
+    def __init__(self, path, delimiter="|||", buffer_size=1 << 20,
+                 encoding="utf-8"):
+        self.path = path
+        self.delimiter = delimiter
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+
+    def __iter__(self):
+        with open(self.path, encoding=self.encoding) as fd:
+            while True:
+                lines = fd.readlines(self.buffer_size)
+                if not lines:
+                    return
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    es, fs = line.strip().split(self.delimiter)
+                    yield (es.split(), fs.split())
+
+
+def chunks(iterable, size):
+    """
+    split iterable into lists of size items
+
+    >>> list(chunks(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def matrix(
         m, n, lst,
         m_text: list=None,
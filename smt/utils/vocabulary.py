@@ -0,0 +1,222 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import json
+
+
+class Vocabulary(object):
+    """
+    symbol table interning words to dense integer ids
+
+    ids are given in order of first appearance from 0, so they can
+    index arrays directly, and are never changed or reused: adding
+    words only appends. one vocabulary per language can therefore be
+    shared by the models of both directions, the phrase extraction
+    and the language model, which then all agree on the ids.
+
+    unk, when given, takes id 0 and is the id of unknown words in
+    encode(words, add=False); without unk they are encoded as -1
+
+    >>> vocab = Vocabulary("the house".split())
+    >>> vocab.encode("the book".split())
+    [0, 2]
+    >>> vocab.decode([2, 1])
+    ['book', 'house']
+    """
+
+    def __init__(self, words=(), unk=None):
+        self.words = []
+        self.index = {}
+        self.unk = unk
+        if unk is not None:
+            self.add(unk)
+        for word in words:
+            self.add(word)
+
+    @property
+    def unk_id(self):
+        return -1 if self.unk is None else self.index[self.unk]
+
+    def add(self, word):
+        """id of word, which is added if missing"""
+        try:
+            return self.index[word]
+        except KeyError:
+            self.index[word] = len(self.words)
+            self.words.append(word)
+            return self.index[word]
+
+    def encode(self, words, add=True):
+        """
+        ids of words. unknown words are added, or encoded as unk_id
+        when add is False
+        """
+        if add:
+            return [self.add(word) for word in words]
+        unk_id = self.unk_id
+        return [self.index.get(word, unk_id) for word in words]
+
+    def decode(self, ids):
+        return [self.words[i] for i in ids]
+
+    def unk_words(self, words):
+        """words with those missing from the vocabulary replaced by unk"""
+        return [word if word in self else self.unk for word in words]
+
+    def __getitem__(self, word):
+        return self.index[word]
+
+    def get(self, word, default=None):
+        return self.index.get(word, default)
+
+    def __contains__(self, word):
+        return word in self.index
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def save(self, path):
+        """save the words in id order to the json file path"""
+        with open(path, "w", encoding="utf-8") as fd:
+            json.dump({"unk": self.unk, "words": self.words}, fd,
+                      ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as fd:
+            data = json.load(fd)
+        vocab = cls(unk=data["unk"])
+        for word in data["words"]:
+            vocab.add(word)
+        return vocab
+
+
+class MappedVocabulary(Vocabulary):
+    """
+    read-only vocabulary over the words of a model file
+
+    offsets and blob are the utf-8 bytes of the words in id order and
+    order their ids sorted by those bytes, e.g. memory-mapped arrays.
+    a word is decoded when its id is read and found by binary search
+    over order, so opening the vocabulary does not depend on its size.
+    words added later, e.g. by TTable.extended, are kept in memory
+    after the mapped ones
+    """
+
+    def __init__(self, offsets, blob, order, unk=None):
+        self._offsets = memoryview(offsets)
+        self._blob = memoryview(blob)
+        self._order = memoryview(order)
+        self._size = len(order)
+        self._added = []
+        # ids of the words looked up or added so far
+        self._found = {}
+        self.unk = unk
+        self.words = _MappedWords(self)
+        self.index = _MappedIndex(self)
+
+    def _bytes(self, word_id):
+        return self._blob[self._offsets[word_id]:
+                          self._offsets[word_id + 1]].tobytes()
+
+    def _word(self, word_id):
+        if word_id < 0:
+            word_id += len(self)
+        if 0 <= word_id < self._size:
+            return self._bytes(word_id).decode("utf-8")
+        return self._added[word_id - self._size]
+
+    def _lookup(self, word):
+        """id of word, or None"""
+        try:
+            return self._found[word]
+        except KeyError:
+            pass
+        key = word.encode("utf-8")
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._bytes(self._order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._size and self._bytes(self._order[lo]) == key:
+            self._found[word] = self._order[lo]
+            return self._order[lo]
+        return None
+
+    def add(self, word):
+        """id of word, which is added in memory if missing"""
+        word_id = self._lookup(word)
+        if word_id is None:
+            word_id = self._found[word] = len(self)
+            self._added.append(word)
+        return word_id
+
+    def __len__(self):
+        return self._size + len(self._added)
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as fd:
+            json.dump({"unk": self.unk, "words": list(self.words)}, fd,
+                      ensure_ascii=False)
+
+
+class _MappedWords(object):
+    """words of a MappedVocabulary by id, like Vocabulary.words"""
+
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def __getitem__(self, word_id):
+        return self.vocab._word(word_id)
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def __iter__(self):
+        for word_id in range(len(self.vocab)):
+            yield self.vocab._word(word_id)
+
+
+class _MappedIndex(object):
+    """ids of a MappedVocabulary by word, like Vocabulary.index"""
+
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def get(self, word, default=None):
+        word_id = self.vocab._lookup(word)
+        return default if word_id is None else word_id
+
+    def __getitem__(self, word):
+        word_id = self.vocab._lookup(word)
+        if word_id is None:
+            raise KeyError(word)
+        return word_id
+
+    def __contains__(self, word):
+        return self.vocab._lookup(word) is not None
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def __iter__(self):
+        return iter(self.vocab.words)
+
+
+def encode_corpus(corpus, e_vocab, f_vocab, add=True):
+    """
+    corpus [(es, fs)] with the words replaced by their ids
+
+    >>> e_vocab, f_vocab = Vocabulary(), Vocabulary()
+    >>> list(encode_corpus([("a b".split(), "x".split())],
+    ...                    e_vocab, f_vocab))
+    [([0, 1], [0])]
+    """
+    for (es, fs) in corpus:
+        yield (e_vocab.encode(es, add), f_vocab.encode(fs, add))
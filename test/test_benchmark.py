@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import unittest
+import json
+import os
+import tempfile
+from unittest import mock
+from smt.ibmmodel import benchmark
+from smt.utils.synthetic import synthetic_corpus
+
+
+class SyntheticCorpusTest(unittest.TestCase):
+
+    def test_corpus(self):
+        corpus = synthetic_corpus(50, vocab_size=20, mean_length=5,
+                                  max_length=8, seed=1)
+        self.assertEqual(len(corpus), 50)
+        self.assertEqual(corpus, synthetic_corpus(50, vocab_size=20,
+                                                  mean_length=5,
+                                                  max_length=8, seed=1))
+        for (es, fs) in corpus:
+            self.assertEqual(len(es), len(fs))
+            self.assertTrue(1 <= len(fs) <= 8)
+        self.assertLessEqual(len({f for (_, fs) in corpus for f in fs}), 20)
+        self.assertNotEqual(corpus, synthetic_corpus(50, seed=2))
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_benchmark(self):
+        corpus = synthetic_corpus(20, vocab_size=10, mean_length=4)
+        results = benchmark.benchmark(corpus,
+                                      ["ibmmodel1", "ibmmodel2-numpy"],
+                                      loop_count=2, viterbi_pairs=5)
+        self.assertEqual([r["engine"] for r in results],
+                         ["ibmmodel1", "ibmmodel2-numpy"])
+        self.assertEqual(len(results[0]["iterations"]), 2)
+        self.assertEqual(len(results[1]["iterations"]), 4)
+        self.assertGreater(results[0]["peak_bytes"], 0)
+        self.assertIsNone(results[0]["worker_peak_bytes"])
+        self.assertNotIn("viterbi_per_sec", results[0])
+        self.assertIn("viterbi_batch_per_sec", results[1])
+
+    def test_workers(self):
+        corpus = synthetic_corpus(20, vocab_size=10, mean_length=4)
+        result, = benchmark.benchmark(corpus, ["ibmmodel2"], loop_count=1,
+                                      processes=2, viterbi_pairs=0)
+        self.assertGreater(result["peak_bytes"], 0)
+        self.assertGreater(result["worker_peak_bytes"], 0)
+        # measured in a fresh process, not in this one
+        with mock.patch.object(benchmark, "_engine_result",
+                               side_effect=AssertionError):
+            result, = benchmark.benchmark(corpus, ["diagonal"],
+                                          loop_count=1)
+        self.assertGreater(result["peak_bytes"], 0)
+
+    def test_main(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        benchmark.main(["--pairs", "10", "20", "--vocab-size", "10",
+                        "--engines", "bidirectional", "--loop-count", "1",
+                        "--no-memory", "--output", path])
+        with open(path, encoding="utf-8") as f:
+            report = json.load(f)
+        self.assertEqual([run["corpus"]["pairs"] for run in report["runs"]],
+                         [10, 20])
+        result = report["runs"][0]["results"][0]
+        self.assertIsNone(result["peak_bytes"])
+        self.assertEqual([r["direction"] for r in result["iterations"]],
+                         ["f2e", "e2f", "f2e", "e2f"])
+
+
+if __name__ == '__main__':
+    unittest.main()
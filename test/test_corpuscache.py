@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from smt.ibmmodel import ibmmodel2
+from smt.utils.corpuscache import CorpusCache
+from smt.utils.utility import mkcorpus
+from smt.utils.utility import DedupedCorpus
+
+
+class CorpusCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.sent_pairs = [("僕 は 男 です", "I am a man"),
+                           ("私 は 女 です", "I am a girl"),
+                           ("", "empty"),
+                           ("私 は 先生 です", "I am a teacher"),
+                           ]
+        self.path = os.path.join(self.tmpdir, "corpus.cache")
+
+    def test_build(self):
+        cache = CorpusCache.build(self.path, self.sent_pairs)
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(list(cache.sentences(2)),
+                         [fs.split() for (es, fs) in self.sent_pairs])
+        # loading again maps the same arrays
+        cache = CorpusCache(self.path, chunk_size=3)
+        self.assertEqual(list(cache.sentences(1)),
+                         [es.split() for (es, fs) in self.sent_pairs])
+        self.assertEqual(cache.vocabs[1]["私"], 4)
+
+    def test_corpus(self):
+        cache = CorpusCache.build(self.path, self.sent_pairs)
+        corpus = cache.corpus(transfrom=2, transto=1)
+        self.assertEqual(list(corpus), mkcorpus(self.sent_pairs))
+        # re-iterable for EM
+        self.assertEqual(list(corpus), list(corpus))
+        reverse = cache.corpus(transfrom=1, transto=2)
+        self.assertEqual(list(reverse)[0], ("I am a man".split(),
+                                            "僕 は 男 です".split()))
+        t, a = ibmmodel2._train(corpus, loop_count=3)
+        t2, a2 = ibmmodel2.train(self.sent_pairs, loop_count=3)
+        self.assertEqual(dict(t.items()), dict(t2.items()))
+        self.assertEqual(dict(a), dict(a2))
+
+    def test_ids(self):
+        cache = CorpusCache.build(self.path, self.sent_pairs)
+        corpus = cache.corpus(transfrom=2, transto=1)
+        self.assertEqual(list(corpus.ids())[0], (cache.ids[1][:4].tolist(),
+                                                 [0, 1, 2, 3]))
+        # training reads the ids without decoding them to words
+        with mock.patch.object(CorpusCache, "sentences",
+                               side_effect=AssertionError):
+            t, a = ibmmodel2._train(corpus, loop_count=3)
+            tn, an = ibmmodel2._train_numpy(corpus, loop_count=3)
+        self.assertIs(t.e_vocab, cache.vocabs[1])
+        t2, a2 = ibmmodel2.train(self.sent_pairs, loop_count=3)
+        self.assertEqual(dict(t.items()), dict(t2.items()))
+        tn2, an2 = ibmmodel2.train(self.sent_pairs, loop_count=3,
+                                   engine="numpy")
+        self.assertEqual(dict(tn.items()), dict(tn2.items()))
+
+        deduped = DedupedCorpus(cache.corpus(transfrom=2, transto=1))
+        with mock.patch.object(CorpusCache, "sentences",
+                               side_effect=AssertionError):
+            t, a = ibmmodel2._train(deduped, loop_count=3,
+                                    weights=deduped.weights)
+        self.assertEqual(dict(t.items()), dict(t2.items()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,12 +4,37 @@
 from __future__ import division, print_function
 import unittest
 import collections
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import mock
 #import keitaiso
 from smt.ibmmodel.ibmmodel1 import train
 from smt.ibmmodel.ibmmodel2 import viterbi_alignment
+from smt.ibmmodel import ibmmodel1
+from smt.ibmmodel import ibmmodel2
+from smt.ibmmodel import diagonal
+from smt.ibmmodel import bidirectional
+from smt.ibmmodel import pruning
+from smt.ibmmodel import reporting
+from smt.ibmmodel import sharding
+from smt.ibmmodel import checkpoint
+from smt.ibmmodel.ttable import TTable
+from smt.ibmmodel.atable import FrozenAlignment
+from smt.ibmmodel.checkpoint import load_checkpoint
+from smt.ibmmodel.checkpoint import save_checkpoint
+from smt.ibmmodel.modelfile import save_model, load_model
+from smt.utils.utility import mkcorpus
+from smt.utils.utility import FileCorpus
+from smt.utils.utility import dedup
+from smt.utils.vocabulary import Vocabulary, MappedVocabulary
+from smt.utils.synthetic import synthetic_corpus
 #import smt.ibmmodel.ibmmodel2 as ibmmodel2
 import decimal
 from decimal import Decimal as D
+import numpy as np
 
 # set deciaml context
 decimal.getcontext().prec = 4
@@ -69,6 +94,254 @@ class IBMModel1Test(unittest.TestCase):
         #self.assertEqual(self._format(t0.items()), self._format(loop0))
         self.assertEqual(set(t2.items()), set(loop2))
 
+    def test_train_numpy(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ("彼女 は 先生 です", "She is a teacher"),
+                      ("彼 は 先生 です", "He is a teacher"),
+                      ("the house", "das Haus"),
+                      ]
+        for loop_count in (1, 2, 5):
+            t = train(sent_pairs, loop_count=loop_count)
+            t_np = train(sent_pairs, loop_count=loop_count, engine="numpy")
+            self.assertEqual(set(t.keys()), set(t_np.keys()))
+            for key, val in t.items():
+                self.assertAlmostEqual(float(val), t_np[key], places=2)
+
+    def test_train_convergence(self):
+        sent_pairs = [("the house", "das Haus"),
+                      ("the book", "das Buch"),
+                      ("a book", "ein Buch"),
+                      ]
+        for engine in ("decimal", "numpy"):
+            stats = {}
+            train(sent_pairs, loop_count=1000, engine=engine,
+                  tol=1e-3, stats=stats)
+            self.assertLess(stats["iterations"], 1000)
+            self.assertEqual(stats["stopped_by"], "tol")
+            loglik = stats["loglikelihood"]
+            self.assertEqual(len(loglik), stats["iterations"])
+            # EM never decreases the likelihood
+            for prev, cur in zip(loglik, loglik[1:]):
+                self.assertGreaterEqual(cur, prev - 1e-3)
+
+    def test_train_max_change(self):
+        sent_pairs = [("the house", "das Haus"),
+                      ("the book", "das Buch"),
+                      ]
+        stats = {}
+        train(sent_pairs, loop_count=1000, engine="numpy",
+              max_change=1e-4, stats=stats)
+        self.assertEqual(stats["stopped_by"], "max_change")
+        stats = {}
+        train(sent_pairs, loop_count=1000, time_budget=0, stats=stats)
+        self.assertEqual(stats["iterations"], 1)
+        self.assertEqual(stats["stopped_by"], "time_budget")
+
+    def test_train_unknown_engine(self):
+        self.assertRaises(ValueError, train, [("a", "b")], 1, "fortran")
+
+    def test_update(self):
+        sent_pairs = [("the house", "das Haus"),
+                      ("the book", "das Buch"),
+                      ]
+        for engine in ("decimal", "numpy"):
+            t = train(sent_pairs, loop_count=5, engine=engine)
+            before = t[("book", "Buch")]
+            batch = mkcorpus([("a book", "ein Buch")])
+            t2 = ibmmodel1.update(t, batch, step=0.3, loop_count=2)
+            # new pairs are added, the old ones are kept
+            self.assertIn(("a", "ein"), t2)
+            self.assertIn(("book", "ein"), t2)
+            self.assertEqual(t2[("the", "Haus")], t[("the", "Haus")])
+            self.assertNotEqual(t2[("book", "Buch")], before)
+            for f in ("Buch", "ein"):
+                f_id = t2.f_index[f]
+                row = t2.data[t2.indptr[f_id]:t2.indptr[f_id + 1]]
+                self.assertAlmostEqual(float(sum(row)), 1.0, places=2)
+
+    def test_update_cost(self):
+        sent_pairs = [("the house", "das Haus"),
+                      ("the book", "das Buch"),
+                      ]
+        for engine in ("decimal", "numpy"):
+            t = train(sent_pairs, loop_count=5, engine=engine).freeze()
+            batch = mkcorpus([("a book", "ein Buch")])
+            # neither the arrays of t nor its data are rebuilt or copied
+            with mock.patch.object(TTable, "_merge",
+                                   side_effect=AssertionError):
+                t2 = ibmmodel1.update(t, batch, step=0.3)
+                t2 = ibmmodel1.update(t2, mkcorpus([("a house", "ein Haus")]),
+                                      step=0.3)
+                self.assertEqual(len(t2), 12)
+                prob = t2[("a", "ein")]
+            self.assertTrue(t.frozen)
+            self.assertNotIn(("a", "ein"), t)
+            # the values read before merging are those after it
+            merged = dict(t2.items())
+            self.assertEqual(merged[("a", "ein")], prob)
+            self.assertEqual(len(merged), 12)
+            self.assertEqual(t2.row_ids().tolist(),
+                             sorted(t2.row_ids().tolist()))
+
+
+class TTableTest(unittest.TestCase):
+
+    def setUp(self):
+        corpus = [("the house".split(), "das Haus".split()),
+                  ("the book".split(), "das Buch".split())]
+        self.t = TTable.from_corpus(corpus, D("0.25"))
+
+    def test_cooccurrence(self):
+        self.assertEqual(len(self.t), 7)
+        self.assertEqual(set(self.t.keys()),
+                         {("the", "das"), ("house", "das"), ("book", "das"),
+                          ("the", "Haus"), ("house", "Haus"),
+                          ("the", "Buch"), ("book", "Buch")})
+
+    def test_lookup_does_not_insert(self):
+        self.assertEqual(self.t[("house", "Buch")], D("0.25"))
+        self.assertEqual(self.t[("unknown", "das")], D("0.25"))
+        self.assertNotIn(("house", "Buch"), self.t)
+        self.assertEqual(len(self.t), 7)
+
+    def test_setitem(self):
+        self.t[("the", "das")] = D("0.5")
+        self.assertEqual(self.t[("the", "das")], D("0.5"))
+        self.assertRaises(KeyError, self.t.__setitem__,
+                          ("house", "Buch"), D("0.5"))
+
+    def test_extended(self):
+        e_ids = dict(self.t.e_index)
+        t = self.t.extended([("a book".split(), "ein Buch".split())])
+        self.assertEqual(len(t), 10)
+        for (e, e_id) in e_ids.items():
+            self.assertEqual(t.e_index[e], e_id)
+        self.assertEqual(t[("a", "ein")], D("0.25"))
+        self.assertIn(("a", "Buch"), t)
+        self.assertNotIn(("a", "Buch"), self.t)
+        for key in self.t.keys():
+            self.assertIn(key, t)
+        self.assertIs(self.t.extended([(["the"], ["das"])]), self.t)
+
+    def test_freeze(self):
+        t = self.t.freeze(floor=1e-4)
+        self.assertTrue(t.frozen)
+        self.assertFalse(self.t.frozen)
+        self.assertEqual(t[("house", "Buch")], D("0.0001"))
+        self.assertEqual(t[("the", "das")], D("0.25"))
+        self.assertRaises(TypeError, t.__setitem__, ("the", "das"), D(1))
+        thawed = t.thaw()
+        thawed[("the", "das")] = D("0.5")
+        self.assertEqual(t[("the", "das")], D("0.25"))
+        self.assertEqual(thawed[("the", "das")], D("0.5"))
+        self.assertIsInstance(thawed.data, list)
+        self.assertEqual(thawed[("the", "das")], D("0.5"))
+
+    def test_shared_vocabulary(self):
+        e_vocab = Vocabulary(["book", "a"])
+        f_vocab = Vocabulary()
+        corpus = [("the book".split(), "das Buch".split())]
+        t = TTable.from_corpus(corpus, D("0.5"),
+                               e_vocab=e_vocab, f_vocab=f_vocab)
+        self.assertIs(t.e_vocab, e_vocab)
+        self.assertEqual(e_vocab.words, ["book", "a", "the"])
+        self.assertEqual(t.e_index["book"], 0)
+        self.assertNotIn(("a", "das"), t)
+        # words added to the vocabulary later have no pair
+        f_vocab.add("Haus")
+        self.assertNotIn(("the", "Haus"), t)
+        self.assertEqual(len(list(t.keys())), 4)
+        self.assertEqual(t.slots([2], [2])[0], -1)
+
+    def test_slots(self):
+        e_ids = [self.t.e_index[e] for e in ("the", "book")]
+        f_id = self.t.f_index["Haus"]
+        slots = self.t.slots(e_ids, f_id)
+        self.assertEqual(slots[0], self.t.slot(e_ids[0], f_id))
+        self.assertEqual(slots[1], -1)
+
+    def test_from_corpus_chunks(self):
+        corpus = [(["e{0}".format(n)], ["f{0}".format(n % 7)])
+                  for n in range(1024)]
+        whole = TTable.from_corpus(corpus, D("0.25"))
+        merged = []
+        union1d = np.union1d
+
+        def count(a, b):
+            merged.append(len(a) + len(b))
+            return union1d(a, b)
+
+        with mock.patch.object(np, "union1d", count):
+            t = TTable.from_corpus(corpus, D("0.25"), chunk_size=1)
+        self.assertEqual(dict(t.items()), dict(whole.items()))
+        # each key is merged about log2(1024) times, not once per chunk
+        self.assertLess(sum(merged), 1024 * 12)
+
+    def test_sentence_slots(self):
+        t = TTable.from_corpus([("a b c d e f".split(), ["das"]),
+                                ("a b".split(), "das Haus".split())],
+                               D("0.25"))
+        extended = t.extended([("a g".split(), "das Buch".split())])
+        for (t, es) in [(t, ["c"]), (t, "a b c".split()),
+                        (extended, "a g x".split())]:
+            e_ids = [t.e_index.get(e, 99) for e in es]
+            f_ids = [t.f_index[f] for f in t.f_index]
+            slots = t.sentence_slots(e_ids, f_ids)
+            self.assertEqual(slots, {(e_id, f_id): t.slot(e_id, f_id)
+                                     for e_id in e_ids for f_id in f_ids
+                                     if t.slot(e_id, f_id) >= 0})
+
+    def test_transposed(self):
+        corpus = [("the house".split(), "das Haus".split()),
+                  ("the book".split(), "das Buch".split())]
+        t = self.t.transposed(lambda n: D(1) / n)
+        self.assertIs(t.e_vocab, self.t.f_vocab)
+        self.assertEqual(set(t.keys()),
+                         {(f, e) for (e, f) in self.t.keys()})
+        reverse = TTable.from_corpus([(fs, es) for (es, fs) in corpus],
+                                     lambda n: D(1) / n)
+        self.assertEqual(dict(t.items()), dict(reverse.items()))
+
+
+class FrozenAlignmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.items = [((1, 1, 2, 2), D("0.7")), ((2, 1, 2, 2), D("0.3")),
+                      ((2, 2, 2, 2), D("0.9")), ((1, 1, 1, 3), D("0.5"))]
+        self.a = FrozenAlignment.from_items(self.items)
+
+    def test_lookup_does_not_insert(self):
+        self.assertEqual(dict(self.a), dict(self.items))
+        self.assertEqual(self.a[(1, 2, 2, 2)], D(1) / D(3))
+        self.assertEqual(self.a[(5, 1, 2, 2)], D(1) / D(3))
+        self.assertNotIn((1, 2, 2, 2), self.a)
+        self.assertEqual(len(self.a), 4)
+        floored = FrozenAlignment.from_items(self.items, floor=1e-6)
+        self.assertEqual(floored[(1, 2, 2, 2)], D("0.000001"))
+
+    def test_matrix(self):
+        arr = self.a.matrix(2, 2)
+        for j in (1, 2):
+            for i in (1, 2):
+                self.assertAlmostEqual(arr[j-1, i-1],
+                                       float(self.a[(i, j, 2, 2)]))
+
+    def test_key_range(self):
+        for key in [(1, 1, 2, 70000), (1, 1, 1 << 15, 2), (0, 1, 2, 2),
+                    (3, 1, 2, 2), (1, 3, 2, 2)]:
+            with self.assertRaises(ValueError):
+                FrozenAlignment.from_items([(key, 0.5)])
+        key = (1, 1, (1 << 15) - 1, (1 << 16) - 1)
+        a = FrozenAlignment.from_items([(key, 0.5)])
+        self.assertEqual(a[key], 0.5)
+        self.assertNotIn((1, 1, 2, 70000), a)
+
+    def test_pickle(self):
+        a = pickle.loads(pickle.dumps(self.a))
+        self.assertEqual(dict(a), dict(self.a))
+
 
 class IBMModel2Test(unittest.TestCase):
 
@@ -83,6 +356,275 @@ class IBMModel2Test(unittest.TestCase):
         # in such a situation.
         self.assertEqual(x, {1: 1, 2: 1, 3: 1})
 
+    def test_viterbi_alignment_frozen(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ]
+        t, a = ibmmodel2.train(sent_pairs, loop_count=3, floor=1e-6)
+        size = (len(t), len(a))
+        viterbi_alignment("僕 は 先生 です".split(),
+                          "I am a teacher too".split(), t, a)
+        self.assertEqual((len(t), len(a)), size)
+        self.assertEqual(t[("先生", "teacher")], D("0.000001"))
+        self.assertEqual(a[(1, 1, 4, 5)], D("0.000001"))
+
+    def test_viterbi_alignment_batch(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ("彼女 は 先生 です", "She is a teacher"),
+                      ("彼 は 先生 です", "He is a teacher"),
+                      ("the house", "das Haus"),
+                      ]
+        corpus = mkcorpus(sent_pairs) + [("私 は です".split(),
+                                          "unknown words".split()),
+                                         ([], ["a"]), (["a"], [])]
+        for engine in ("decimal", "numpy"):
+            t, a = ibmmodel2.train(sent_pairs, loop_count=5, engine=engine)
+            batch = list(ibmmodel2.viterbi_alignment_batch(corpus, t, a,
+                                                           chunk_size=3))
+            self.assertEqual(batch, [dict(viterbi_alignment(es, fs, t, a))
+                                     for (es, fs) in corpus])
+        # plain mappings
+        batch = ibmmodel2.viterbi_alignment_batch([([1, 2, 1], [2, 3, 2])],
+                                                  collections.defaultdict(int),
+                                                  collections.defaultdict(int))
+        self.assertEqual(list(batch), [{1: 1, 2: 1, 3: 1}])
+
+    def test_train_processes(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ("彼女 は 先生 です", "She is a teacher"),
+                      ("彼 は 先生 です", "He is a teacher"),
+                      ]
+        corpus = mkcorpus(sent_pairs)
+        t, a = ibmmodel2._train(corpus, loop_count=3)
+        pt, pa = ibmmodel2._train(corpus, loop_count=3,
+                                  processes=2, shard_size=2)
+        self.assertEqual(set(t.keys()), set(pt.keys()))
+        self.assertEqual(set(a.keys()), set(pa.keys()))
+        for key, val in t.items():
+            self.assertAlmostEqual(val, pt[key], places=2)
+        for key, val in a.items():
+            self.assertAlmostEqual(val, pa[key], places=2)
+
+    def test_train_processes_tolerance(self):
+        # the workers count in float64, the serial E-step in Decimal
+        # rounded to the context, see sharding.ShardPool
+        corpus = synthetic_corpus(200, vocab_size=50, mean_length=6)
+        t, a = ibmmodel2._train(corpus, loop_count=5)
+        pt, pa = ibmmodel2._train(corpus, loop_count=5, processes=2,
+                                  shard_size=20)
+        nt, na = ibmmodel2._train_numpy(corpus, loop_count=5)
+        for (table, parallel, exact) in [(t, pt, nt), (a, pa, na)]:
+            for key, val in parallel.items():
+                self.assertIsInstance(val, D)
+                self.assertAlmostEqual(float(val), exact[key], delta=1e-3)
+                self.assertAlmostEqual(val, table[key], delta=D("1e-2"))
+
+    def test_train_processes_pool(self):
+        corpus = mkcorpus([("僕 は 男 です", "I am a man"),
+                           ("私 は 女 です", "I am a girl"),
+                           ("私 は 先生 です", "I am a teacher"),
+                           ])
+        paths = []
+        mkdtemp = tempfile.mkdtemp
+
+        def record(*args, **kwargs):
+            paths.append(mkdtemp(*args, **kwargs))
+            return paths[-1]
+
+        pool = mock.Mock(wraps=sharding.multiprocessing.Pool)
+        with mock.patch.object(sharding.multiprocessing, "Pool", pool), \
+                mock.patch.object(sharding.tempfile, "mkdtemp", record):
+            ibmmodel2._train(corpus, loop_count=3, processes=2,
+                             shard_size=1)
+            bidirectional._train(corpus, loop_count=3, processes=2,
+                                 shard_size=1)
+        # one pool for the IBM Model 1 and 2 iterations, one for both
+        # directions
+        self.assertEqual(pool.call_count, 2)
+        self.assertEqual(len(paths), 2)
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+
+    def test_train_dedup(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("僕 は 男 です", "I am a man"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ("僕 は 男 です", "I am a man"),
+                      ]
+        pairs, weights = dedup(mkcorpus(sent_pairs))
+        self.assertEqual(len(pairs), 3)
+        self.assertEqual(weights, [3, 1, 1])
+        for engine in ("numpy", "decimal"):
+            t, a = ibmmodel2.train(sent_pairs, loop_count=3, engine=engine)
+            dt, da = ibmmodel2.train(sent_pairs, loop_count=3,
+                                     engine=engine, dedup=True)
+            for key, val in t.items():
+                self.assertAlmostEqual(float(val), float(dt[key]), places=2)
+            for key, val in a.items():
+                self.assertAlmostEqual(float(val), float(da[key]), places=2)
+        corpus = mkcorpus(sent_pairs)
+        t, a = ibmmodel2._train(corpus, loop_count=2,
+                                processes=2, shard_size=2)
+        pt, pa = ibmmodel2._train(pairs, loop_count=2, weights=weights,
+                                  processes=2, shard_size=2)
+        for key, val in t.items():
+            self.assertAlmostEqual(val, pt[key], places=2)
+
+    def test_train_file_corpus(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ]
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for es, fs in sent_pairs:
+                f.write("{}|||{}\n".format(es, fs))
+        corpus = FileCorpus(path, buffer_size=16)
+        self.assertEqual(list(corpus), mkcorpus(sent_pairs))
+        t, a = ibmmodel2._train(corpus, loop_count=3)
+        mt, ma = ibmmodel2._train(mkcorpus(sent_pairs), loop_count=3)
+        self.assertEqual(dict(t.items()), dict(mt.items()))
+        self.assertEqual(dict(a), dict(ma))
+
+    def test_train_numpy(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ("彼女 は 先生 です", "She is a teacher"),
+                      ("the house", "das Haus"),
+                      ]
+        t, a = ibmmodel2.train(sent_pairs, loop_count=3)
+        nt, na = ibmmodel2.train(sent_pairs, loop_count=3, engine="numpy")
+        self.assertEqual(set(t.keys()), set(nt.keys()))
+        self.assertEqual(set(a.keys()), set(na.keys()))
+        for key, val in t.items():
+            self.assertAlmostEqual(float(val), nt[key], places=2)
+        for key, val in a.items():
+            self.assertAlmostEqual(float(val), na[key], places=2)
+        self.assertEqual(na.bucket(4, 4).shape, (4, 4))
+        # unseen lengths are not inserted
+        self.assertAlmostEqual(na[(1, 1, 7, 9)], 0.1)
+        self.assertNotIn((1, 1, 7, 9), na)
+
+    def test_checkpoint_resume(self):
+        corpus = mkcorpus([("僕 は 男 です", "I am a man"),
+                           ("私 は 女 です", "I am a girl"),
+                           ("私 は 先生 です", "I am a teacher"),
+                           ])
+        path = os.path.join(tempfile.mkdtemp(), "checkpoint")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        t, a = ibmmodel2._train(corpus, loop_count=4)
+
+        # stopped in the middle of IBM Model 1
+        ibmmodel2._train(corpus, loop_count=4, checkpoint=path,
+                         checkpoint_every=1, time_budget=0)
+        rt, ra = ibmmodel2._train(corpus, loop_count=4, resume_from=path)
+        self.assertEqual(dict(t.items()), dict(rt.items()))
+        self.assertEqual(dict(a), dict(ra))
+
+        # killed in the middle of IBM Model 2
+        def crash(path, stage, iteration, *args, **kwargs):
+            save_checkpoint(path, stage, iteration, *args, **kwargs)
+            if stage == "ibmmodel2" and iteration == 2:
+                raise KeyboardInterrupt
+
+        with mock.patch.object(ibmmodel2, "save_checkpoint", crash):
+            self.assertRaises(KeyboardInterrupt, ibmmodel2._train, corpus,
+                              loop_count=4, checkpoint=path,
+                              checkpoint_every=1)
+        self.assertEqual(load_checkpoint(path)["stage"], "ibmmodel2")
+        rt, ra = ibmmodel2._train(corpus, loop_count=4, resume_from=path)
+        self.assertEqual(dict(t.items()), dict(rt.items()))
+        self.assertEqual(dict(a), dict(ra))
+
+        # killed between the renames which swap the new checkpoint in
+        rename = os.rename
+
+        def crash_rename(src, dst):
+            if src.endswith(".tmp"):
+                raise KeyboardInterrupt
+            rename(src, dst)
+
+        state = load_checkpoint(path)
+        with mock.patch.object(checkpoint.os, "rename", crash_rename):
+            self.assertRaises(KeyboardInterrupt, save_checkpoint, path,
+                              "ibmmodel2", 3, state["t"])
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(load_checkpoint(path)["iteration"],
+                         state["iteration"])
+        rt, ra = ibmmodel2._train(corpus, loop_count=4, resume_from=path)
+        self.assertEqual(dict(t.items()), dict(rt.items()))
+        self.assertEqual(dict(a), dict(ra))
+        # the next checkpoint replaces both
+        save_checkpoint(path, "ibmmodel2", 3, state["t"])
+        self.assertEqual(load_checkpoint(path)["iteration"], 3)
+        self.assertFalse(os.path.exists(path + ".old"))
+
+    def test_update(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ]
+        t, a = ibmmodel2.train(sent_pairs, loop_count=5)
+        batch = mkcorpus([("私 は 先生 です", "I am a teacher")])
+        before = a[(1, 1, 4, 4)]
+        t, a = ibmmodel2.update(t, a, batch, step=0.5)
+        self.assertIn(("先生", "teacher"), t)
+        self.assertNotEqual(a[(1, 1, 4, 4)], before)
+        total = sum(a[(i, 1, 4, 4)] for i in range(1, 5))
+        self.assertAlmostEqual(float(total), 1.0, places=2)
+
+    def test_model_file(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ]
+        t, a = ibmmodel2.train(sent_pairs, loop_count=5)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "model.ibm")
+        save_model(path, t, a)
+        lt, la = load_model(path)
+        self.assertTrue(lt.frozen)
+        # the words are looked up in the file, not decoded
+        self.assertIsInstance(lt.e_vocab, MappedVocabulary)
+        self.assertEqual(lt.f_index["teacher"], t.f_index["teacher"])
+        self.assertEqual(lt[("先生", "teacher")], float(t[("先生", "teacher")]))
+        self.assertEqual(dict(lt.items()),
+                         {key: float(val) for (key, val) in t.items()})
+        self.assertEqual(dict(la.items()),
+                         {key: float(val) for (key, val) in a.items()})
+        es = "私 は 先生 です".split()
+        fs = "I am a teacher".split()
+        self.assertEqual(viterbi_alignment(es, fs, lt, la),
+                         viterbi_alignment(es, fs, t, a))
+        lt, la = load_model(path, floor=1e-6)
+        self.assertEqual(lt[("先生", "man")], 1e-6)
+        self.assertEqual(la[(1, 1, 9, 9)], 1e-6)
+        # Model 1 tables have no a
+        save_model(path, ibmmodel1._train(mkcorpus(sent_pairs), 2))
+        self.assertIsNone(load_model(path)[1])
+        with open(path, "wb") as fd:
+            fd.write(b"not a model" * 4)
+        self.assertRaises(ValueError, load_model, path)
+
+    def test_train_convergence(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ]
+        stats = {}
+        ibmmodel2.train(sent_pairs, loop_count=1000, tol=1e-2, stats=stats)
+        self.assertEqual(stats["stopped_by"], "tol")
+        self.assertEqual(stats["ibmmodel1"]["stopped_by"], "tol")
+        self.assertLess(stats["iterations"], 1000)
+        self.assertEqual(len(stats["perplexity"]), stats["iterations"])
+
     #def test_zero_division_error(self):
     #    """
     #    at the beginning, there was this bug for ZeroDivisionError,
@@ -103,5 +645,202 @@ class IBMModel2Test(unittest.TestCase):
     #                      sentences, loop_count=1000)
 
 
+class DiagonalTest(unittest.TestCase):
+
+    def test_train_dedup(self):
+        sent_pairs = [("a b", "x y"), ("a c", "x z"), ("a b", "x y")]
+        t, a = diagonal.train(sent_pairs, loop_count=3)
+        dt, da = diagonal.train(sent_pairs, loop_count=3, dedup=True)
+        self.assertAlmostEqual(a.tension, da.tension)
+        for key, val in t.items():
+            self.assertAlmostEqual(val, dt[key])
+
+    def test_normalizer(self):
+        a = diagonal.DiagonalAlignment(tension=3.0)
+        for (l_e, l_f) in [(1, 1), (3, 7), (7, 3), (5, 5)]:
+            direct = np.exp(a.tension * a.h(l_e, l_f)).sum(axis=1)
+            closed = a.normalizer(np.arange(1, l_e + 1), l_e, l_f)
+            np.testing.assert_allclose(closed, direct)
+            np.testing.assert_allclose(a.matrix(l_e, l_f).sum(axis=1), 1.0)
+            self.assertAlmostEqual(a[(2, 1, l_e, l_f)] if l_f > 1 else
+                                   a[(1, 1, l_e, l_f)],
+                                   a.matrix(l_e, l_f)[0, min(1, l_f - 1)])
+
+    def test_train(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ("彼女 は 先生 です", "She is a teacher"),
+                      ("彼 は 先生 です", "He is a teacher"),
+                      ]
+        stats = {}
+        t, a = diagonal.train(sent_pairs, loop_count=5, stats=stats)
+        self.assertEqual(stats["iterations"], 5)
+        # every pair of the corpus is monotone
+        self.assertGreater(a.tension, 4.0)
+        es = "私 は 先生 です".split()
+        fs = "I am a teacher".split()
+        self.assertEqual(dict(diagonal.viterbi_alignment(es, fs, t, a)),
+                         {1: 1, 2: 2, 3: 3, 4: 4})
+        batch = diagonal.viterbi_alignment_batch([(es, fs)], t, a)
+        self.assertEqual(next(batch),
+                         dict(diagonal.viterbi_alignment(es, fs, t, a)))
+
+
+class PruningTest(unittest.TestCase):
+
+    def setUp(self):
+        corpus = [("a b c".split(), "x".split()),
+                  ("a b".split(), "y".split())]
+        self.t = TTable.from_corpus(corpus, 0.0, dtype=np.float64)
+        for (key, val) in [(("a", "x"), 0.6), (("b", "x"), 0.3),
+                           (("c", "x"), 0.1), (("a", "y"), 0.5),
+                           (("b", "y"), 0.5)]:
+            self.t[key] = val
+
+    def test_threshold(self):
+        t, keep = pruning.prune(self.t, threshold=0.2)
+        self.assertEqual(keep.tolist(), [True, True, False, True, True])
+        self.assertNotIn(("c", "x"), t)
+        self.assertAlmostEqual(t[("a", "x")], 0.6 / 0.9)
+        self.assertAlmostEqual(t[("b", "y")], 0.5)
+        # a removed pair never reads more than a kept one
+        self.assertLessEqual(t[("c", "x")], t[("b", "x")])
+
+    def test_top_k_and_mass(self):
+        t, _ = pruning.prune(self.t, top_k=1)
+        self.assertEqual(len(t), 2)
+        self.assertAlmostEqual(t[("a", "x")], 1.0)
+        t, _ = pruning.prune(self.t, mass=0.8)
+        self.assertEqual(set(t.keys()),
+                         {("a", "x"), ("b", "x"), ("a", "y"), ("b", "y")})
+        t, _ = pruning.prune(self.t, threshold=0.9)
+        self.assertEqual(len(t), 2)
+        self.assertIs(pruning.prune(self.t, threshold=0.01)[0], self.t)
+
+    def test_train(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ("彼女 は 先生 です", "She is a teacher"),
+                      ("彼 は 先生 です", "He is a teacher"),
+                      ]
+        corpus = mkcorpus(sent_pairs)
+        stats = {}
+        t, a = ibmmodel2._train(corpus, loop_count=5, stats=stats,
+                                prune={"threshold": 0.05})
+        full, _ = ibmmodel2._train(corpus, loop_count=5)
+        pruned = sum(stats["ibmmodel1"]["pruned"]) + sum(stats["pruned"])
+        self.assertEqual(len(stats["pruned"]), 5)
+        self.assertEqual(len(t), len(full) - pruned)
+        es = "私 は 先生 です".split()
+        fs = "I am a teacher".split()
+        self.assertEqual(viterbi_alignment(es, fs, t, a)[1], 1)
+
+
+class ReportingTest(unittest.TestCase):
+
+    def setUp(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ]
+        self.corpus = mkcorpus(sent_pairs)
+
+    def test_callback(self):
+        infos = []
+        stats = {}
+        ibmmodel2._train(self.corpus, loop_count=3, stats=stats,
+                         callback=infos.append)
+        self.assertEqual([(info["model"], info["iteration"])
+                          for info in infos],
+                         [("ibmmodel1", 1), ("ibmmodel1", 2),
+                          ("ibmmodel1", 3), ("ibmmodel2", 1),
+                          ("ibmmodel2", 2), ("ibmmodel2", 3)])
+        self.assertEqual([info["loglikelihood"] for info in infos[3:]],
+                         stats["loglikelihood"])
+        for info in infos:
+            self.assertGreaterEqual(info["e_step"], 0)
+            self.assertGreaterEqual(info["m_step"], 0)
+            self.assertEqual(info["words"], 12)
+            self.assertGreater(info["table_bytes"], 0)
+        n_pairs = len(TTable.from_corpus(self.corpus, D("0.5")))
+        self.assertEqual(infos[0]["parameters"], n_pairs)
+        self.assertGreater(infos[-1]["parameters"], n_pairs)
+
+    def test_callback_engines(self):
+        for train in (ibmmodel1._train_numpy, ibmmodel2._train_numpy,
+                      diagonal._train):
+            infos = []
+            train(self.corpus, loop_count=2, callback=infos.append)
+            self.assertEqual(infos[-1]["iteration"], 2)
+        infos = []
+        bidirectional._train(self.corpus, loop_count=1,
+                             callback=infos.append)
+        self.assertEqual([(info["model"], info["direction"])
+                          for info in infos],
+                         [("ibmmodel1", "f2e"), ("ibmmodel1", "e2f"),
+                          ("ibmmodel2", "f2e"), ("ibmmodel2", "e2f")])
+
+    def test_json_lines_reporter(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with reporting.JSONLinesReporter(path, run="test") as report:
+            ibmmodel1._train(self.corpus, loop_count=2, callback=report)
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r["iteration"] for r in records], [1, 2])
+        self.assertEqual(records[0]["run"], "test")
+        self.assertIn("max_rss", records[0])
+
+
+class BidirectionalTest(unittest.TestCase):
+
+    def setUp(self):
+        sent_pairs = [("僕 は 男 です", "I am a man"),
+                      ("私 は 女 です", "I am a girl"),
+                      ("私 は 先生 です", "I am a teacher"),
+                      ("彼女 は 先生 です", "She is a teacher"),
+                      ("彼 は 先生 です", "He is a teacher"),
+                      ]
+        self.corpus = mkcorpus(sent_pairs)
+        self.reverse = [(fs, es) for (es, fs) in self.corpus]
+
+    def test_train_equals_separate_training(self):
+        stats = {}
+        (f2e, e2f) = bidirectional._train(self.corpus, loop_count=3,
+                                          stats=stats)
+        for (model, corpus) in ((f2e, self.corpus), (e2f, self.reverse)):
+            t, a = ibmmodel2._train(corpus, loop_count=3)
+            self.assertEqual(dict(model[0].items()), dict(t.items()))
+            self.assertEqual(dict(model[1].items()), dict(a.items()))
+        self.assertEqual(stats["f2e"]["iterations"], 3)
+        self.assertEqual(stats["e2f"]["ibmmodel1"]["iterations"], 3)
+
+    def test_train_stops_each_direction(self):
+        stats = {}
+        bidirectional._train(self.corpus, loop_count=50, tol=1e-3,
+                             stats=stats)
+        for direction in bidirectional.DIRECTIONS:
+            separate = {}
+            corpus = self.corpus if direction == "f2e" else self.reverse
+            ibmmodel2._train(corpus, loop_count=50, tol=1e-3,
+                             stats=separate)
+            self.assertEqual(stats[direction]["iterations"],
+                             separate["iterations"])
+            self.assertEqual(stats[direction]["stopped_by"], "tol")
+
+    def test_train_processes(self):
+        (f2e, e2f) = bidirectional._train(self.corpus, loop_count=3)
+        (pf2e, pe2f) = bidirectional._train(self.corpus, loop_count=3,
+                                            processes=2, shard_size=2)
+        for (model, pmodel) in ((f2e, pf2e), (e2f, pe2f)):
+            for (table, ptable) in zip(model, pmodel):
+                self.assertEqual(set(table.keys()), set(ptable.keys()))
+                for key, val in table.items():
+                    self.assertAlmostEqual(val, ptable[key], places=2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,12 +2,107 @@
 # coding:utf-8
 
 import unittest
+import io
+import os
+import pathlib
+import random
+import tempfile
 from smt.phrase.word_alignment import _alignment
+from smt.phrase.word_alignment import alignment
+from smt.phrase import heuristics
+from smt.phrase import alignfile
 from smt.phrase.word_alignment import symmetrization
+from smt.phrase.word_alignment import symmetrize_corpus
 from smt.phrase.phrase_extract import extract
 from smt.phrase.phrase_extract import phrase_extract
 from smt.phrase.phrase_extract import available_phrases
+from smt.phrase.phrase_extract import phrase_extract_corpus
 from smt.utils.utility import mkcorpus
+from smt.ibmmodel import bidirectional
+
+
+def _legacy_alignment(elist, flist, e2f, f2e):
+    '''
+    the original fixed-point implementation of _alignment, kept to
+    check the current one against it
+    '''
+    neighboring = {(-1, 0), (0, -1), (1, 0), (0, 1),
+                   (-1, -1), (-1, 1), (1, -1), (1, 1)}
+    e2f = set(e2f)
+    f2e = set(f2e)
+    m = len(elist)
+    n = len(flist)
+    alignment = e2f.intersection(f2e)
+    # marge with neighborhood
+    while True:
+        set_len = len(alignment)
+        for e_word in range(1, m+1):
+            for f_word in range(1, n+1):
+                if (e_word, f_word) in alignment:
+                    for (e_diff, f_diff) in neighboring:
+                        e_new = e_word + e_diff
+                        f_new = f_word + f_diff
+                        if not alignment:
+                            if (e_new, f_new) in e2f.union(f2e):
+                                alignment.add((e_new, f_new))
+                        else:
+                            if ((e_new not in list(zip(*alignment))[0]
+                                    or f_new not in list(zip(*alignment))[1])
+                                    and (e_new, f_new) in e2f.union(f2e)):
+                                alignment.add((e_new, f_new))
+        if set_len == len(alignment):
+            break
+    # finalize
+    for e_word in range(1, m+1):
+        for f_word in range(1, n+1):
+            # for alignment = set([])
+            if not alignment:
+                if (e_word, f_word) in e2f.union(f2e):
+                    alignment.add((e_word, f_word))
+            else:
+                if ((e_word not in list(zip(*alignment))[0]
+                        or f_word not in list(zip(*alignment))[1])
+                        and (e_word, f_word) in e2f.union(f2e)):
+                    alignment.add((e_word, f_word))
+    return alignment
+
+
+def _legacy_extract(es, fs, alignment):
+    '''
+    the original implementation of extract, scanning alignment for
+    every span, kept to check the current one against it
+    '''
+    def _extract(e_start, e_end, f_start, f_end):
+        if f_end == 0:
+            return {}
+        for (e, f) in alignment:
+            if (f_start <= f <= f_end) and (e < e_start or e > e_end):
+                return {}
+        ex = set()
+        f_s = f_start
+        while True:
+            f_e = f_end
+            while True:
+                ex.add((e_start, e_end, f_s, f_e))
+                f_e += 1
+                if f_e in list(zip(*alignment))[1] or f_e > len(fs):
+                    break
+            f_s -= 1
+            if f_s in list(zip(*alignment))[1] or f_s < 1:
+                break
+        return ex
+
+    phrases = set()
+    len_es = len(es)
+    for e_start in range(1, len_es+1):
+        for e_end in range(e_start, len_es+1):
+            f_start, f_end = (len(fs), 0)
+            for (e, f) in alignment:
+                if e_start <= e <= e_end:
+                    f_start = min(f, f_start)
+                    f_end = max(f, f_end)
+            phrases.update(_extract(e_start, e_end, f_start, f_end))
+    return phrases
 
 
 class WordAlignmentTest(unittest.TestCase):
@@ -32,6 +127,24 @@ class WordAlignmentTest(unittest.TestCase):
                    (9, 9)])
         self.assertEqual(_alignment(elist, flist, e2f, f2e), ans)
 
+    def test_alignment_equals_legacy(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            m = rng.randint(1, 10)
+            n = rng.randint(1, 10)
+
+            def points(k):
+                # out of range positions included
+                return [(rng.randint(0, m + 1), rng.randint(0, n + 1))
+                        for _ in range(k)]
+            e2f = points(rng.randint(0, 2 * max(m, n)))
+            f2e = points(rng.randint(0, 2 * max(m, n)))
+            f2e += e2f[:rng.randint(0, len(e2f))]
+            elist = ["e"] * m
+            flist = ["f"] * n
+            self.assertEqual(_alignment(elist, flist, e2f, f2e),
+                             _legacy_alignment(elist, flist, e2f, f2e))
+
     def test_symmetrization(self):
         sentenses = [("僕 は 男 です", "I am a man"),
                      ("私 は 女 です", "I am a girl"),
@@ -46,6 +159,154 @@ class WordAlignmentTest(unittest.TestCase):
         ans = set([(1, 1), (1, 2), (2, 3), (3, 4), (4, 3)])
         self.assertEqual(syn, ans)
 
+    def test_symmetrize_corpus(self):
+        sentenses = [("僕 は 男 です", "I am a man"),
+                     ("私 は 女 です", "I am a girl"),
+                     ("私 は 先生 です", "I am a teacher"),
+                     ("彼女 は 先生 です", "She is a teacher"),
+                     ("彼 は 先生 です", "He is a teacher"),
+                     ]
+        corpus = mkcorpus(sentenses)
+        alignments = list(symmetrize_corpus(corpus))
+        self.assertEqual(alignments,
+                         [symmetrization(es, fs, corpus)
+                          for (es, fs) in corpus])
+        self.assertEqual(alignments[2],
+                         set([(1, 1), (1, 2), (2, 3), (3, 4), (4, 3)]))
+        models = bidirectional._train(corpus, loop_count=10)
+        self.assertEqual(list(symmetrize_corpus(corpus, models=models,
+                                                processes=2,
+                                                chunk_size=2)),
+                         alignments)
+
+
+class HeuristicsTest(unittest.TestCase):
+
+    def _symmetrize(self, e2f, f2e, heuristic, m=3, n=3):
+        return heuristics.to_points(heuristics.symmetrize(
+            heuristics.to_matrix(e2f, m, n),
+            heuristics.to_matrix(f2e, m, n), heuristic))
+
+    def test_matrix(self):
+        points = {(1, 1), (2, 3), (3, 2)}
+        matrix = heuristics.to_matrix(points | {(0, 1), (4, 4)}, 3, 3)
+        self.assertEqual(matrix.shape, (3, 3))
+        self.assertEqual(heuristics.to_points(matrix), points)
+
+    def test_heuristics(self):
+        e2f = {(1, 1), (2, 2)}
+        f2e = {(1, 1)}
+        self.assertEqual(self._symmetrize(e2f, f2e, "intersection"),
+                         {(1, 1)})
+        self.assertEqual(self._symmetrize(e2f, f2e, "union"),
+                         {(1, 1), (2, 2)})
+        self.assertEqual(self._symmetrize(e2f, f2e, "grow"), {(1, 1)})
+        self.assertEqual(self._symmetrize(e2f, f2e, "grow-diag"),
+                         {(1, 1), (2, 2)})
+        e2f = {(1, 1), (3, 3)}
+        f2e = {(1, 1), (3, 2)}
+        self.assertEqual(self._symmetrize(e2f, f2e, "grow-diag"), {(1, 1)})
+        self.assertEqual(self._symmetrize(e2f, f2e, "grow-diag-final"),
+                         {(1, 1), (3, 2), (3, 3)})
+        self.assertEqual(self._symmetrize(e2f, f2e, "grow-diag-final-and"),
+                         {(1, 1), (3, 2)})
+        self.assertRaises(ValueError, self._symmetrize, e2f, f2e, "diag")
+
+    def test_alignment(self):
+        elist = "michael assumes that he will stay in the house".split()
+        flist = "michael geht davon aus , dass er im haus bleibt".split()
+        e2f = [(1, 1), (2, 2), (3, 2), (4, 2), (6, 3),
+               (7, 4), (8, 7), (9, 9), (10, 6)]
+        f2e = [(1, 1), (2, 2), (3, 6), (4, 7), (7, 8),
+               (8, 8), (9, 9), (5, 10), (6, 10)]
+        self.assertEqual(alignment(elist, flist, e2f, f2e,
+                                   heuristic="grow-diag-final"),
+                         alignment(elist, flist, e2f, f2e))
+        self.assertEqual(alignment(elist, flist, e2f, f2e,
+                                   heuristic="intersection"),
+                         {(1, 1), (2, 2), (3, 6), (4, 7), (6, 10),
+                          (7, 8), (9, 9)})
+
+    def test_alignment_equals_legacy(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            m = rng.randint(1, 12)
+            n = rng.randint(1, 12)
+            elist = ["e"] * m
+            flist = ["f"] * n
+            # viterbi alignments: one position for each word, given as
+            # (e, f) for f2e and (f, e) for e2f
+            f2e = [(e, rng.randint(1, n)) for e in range(1, m + 1)]
+            e2f = [(f, rng.randint(1, m)) for f in range(1, n + 1)]
+            self.assertEqual(alignment(elist, flist, e2f, f2e,
+                                       heuristic="grow-diag-final"),
+                             alignment(elist, flist, e2f, f2e))
+
+
+class AlignFileTest(unittest.TestCase):
+
+    def test_format(self):
+        alignment = {(1, 1), (3, 2), (2, 3)}
+        self.assertEqual(alignfile.format_alignment(alignment),
+                         "0-0 1-2 2-1")
+        self.assertEqual(alignfile.format_alignment({(1, 1), (3, 2)},
+                                                    reverse=True),
+                         "0-0 2-1")
+        self.assertEqual(alignfile.format_alignment(set()), "")
+        self.assertEqual(alignfile.parse_alignment("0-0 2-1\n"),
+                         {(1, 1), (2, 3)})
+        self.assertEqual(alignfile.parse_alignment("1-0", reverse=True),
+                         {(2, 1)})
+        self.assertEqual(alignfile.parse_alignment("\n"), set())
+        self.assertRaises(ValueError, alignfile.parse_alignment, "0:1")
+
+    def test_file(self):
+        alignments = [{(1, 1), (2, 3)}, set(), {(4, 2)}]
+        fd = io.StringIO()
+        self.assertEqual(alignfile.write_alignments(fd, iter(alignments)), 3)
+        self.assertEqual(fd.getvalue(), "0-0 2-1\n\n1-3\n")
+        fd.seek(0)
+        self.assertEqual(list(alignfile.read_alignments(fd)), alignments)
+
+        path = os.path.join(tempfile.mkdtemp(), "corpus.align")
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        self.addCleanup(os.remove, path)
+        alignfile.write_alignments(path, alignments, reverse=True)
+        self.assertFalse(os.path.exists(path + ".tmp"))
+        self.assertEqual(list(alignfile.read_alignments(path, reverse=True)),
+                         alignments)
+
+        alignfile.write_alignments(pathlib.Path(path), alignments)
+        self.assertEqual(list(alignfile.read_alignments(pathlib.Path(path))),
+                         alignments)
+
+        def failing():
+            yield {(1, 1)}
+            raise RuntimeError("alignment failed")
+
+        self.assertRaises(RuntimeError, alignfile.write_alignments,
+                          path, failing())
+        self.assertFalse(os.path.exists(path + ".tmp"))
+        self.assertEqual(list(alignfile.read_alignments(path)), alignments)
+
+    def test_phrase_extract_corpus(self):
+        sentenses = [("僕 は 男 です", "I am a man"),
+                     ("私 は 女 です", "I am a girl"),
+                     ("私 は 先生 です", "I am a teacher"),
+                     ]
+        corpus = mkcorpus(sentenses)
+        fd = io.StringIO()
+        alignfile.write_alignments(fd, symmetrize_corpus(corpus))
+        fd.seek(0)
+        self.assertEqual(list(phrase_extract_corpus(
+                             corpus, alignfile.read_alignments(fd))),
+                         [phrase_extract(es, fs,
+                                         symmetrization(es, fs, corpus))
+                          for (es, fs) in corpus])
+        fd.seek(0)
+        self.assertRaises(ValueError, list, phrase_extract_corpus(
+            corpus[:2], alignfile.read_alignments(fd)))
+
 
 class PhraseExtractTest(unittest.TestCase):
     def test_extract(self):
@@ -118,6 +379,19 @@ class PhraseExtractTest(unittest.TestCase):
 
         self.assertEqual(extract(es, fs, alignment), ans)
 
+    def test_extract_equals_legacy(self):
+        rng = random.Random(0)
+        for _ in range(1000):
+            m = rng.randint(0, 9)
+            n = rng.randint(0, 9)
+            # out of range positions included
+            alignment = [(rng.randint(0, m + 1), rng.randint(0, n + 1))
+                         for _ in range(rng.randint(0, m + n))]
+            es = ["e"] * m
+            fs = ["f"] * n
+            self.assertEqual(extract(es, fs, alignment),
+                             _legacy_extract(es, fs, alignment))
+
     def test_phrase_extract(self):
         # next alignment matrix is like
         #
@@ -0,0 +1,112 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import unittest
+from smt.ibmmodel import ibmmodel1
+from smt.utils.utility import mkcorpus
+from smt.utils.utility import dedup
+from smt.utils.utility import DedupedCorpus
+from smt.utils.utility import filter_corpus
+
+
+class FilterCorpusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.corpus = mkcorpus([("僕 は 男 です", "I am a man"),
+                                ("私 は 女 です", "I am a girl"),
+                                ("私 は 先生 です", "I am a teacher"),
+                                ("はい", "yes I am a teacher too"),
+                                ("私 は 先生 です 。 " * 3, "I am . " * 3),
+                                ])
+
+    def test_length(self):
+        report = {}
+        kept = filter_corpus(self.corpus, max_length=8, max_ratio=3,
+                             report=report)
+        self.assertEqual(list(kept), self.corpus[:3])
+        self.assertEqual(len(kept), 3)
+        self.assertEqual(report["pairs"], 5)
+        self.assertEqual(report["kept"], 3)
+        self.assertEqual(report["too_long"], 1)
+        self.assertEqual(report["bad_ratio"], 1)
+        self.assertEqual(report["tokens"], 24)
+        self.assertEqual(report["unk_tokens"], 0)
+
+    def test_vocab_size(self):
+        report = {}
+        kept = list(filter_corpus(self.corpus[:3], vocab_size=3,
+                                  report=report))
+        self.assertEqual(kept[0], ("<unk> は <unk> です".split(),
+                                   "I am a <unk>".split()))
+        self.assertEqual(kept[2], ("私 は <unk> です".split(),
+                                   "I am a <unk>".split()))
+        self.assertEqual(report["unk_tokens"], 7)
+
+    def test_stream(self):
+        corpus = self.corpus[:3]
+
+        class Stream(object):
+            reads = 0
+
+            def __iter__(self):
+                Stream.reads += 1
+                return iter(corpus)
+
+        kept = filter_corpus(Stream(), vocab_size=3)
+        self.assertEqual(Stream.reads, 1)
+        self.assertEqual(list(kept), list(kept))
+        self.assertEqual(Stream.reads, 3)
+        self.assertEqual(kept.f_vocab.unk_words("a girl".split()),
+                         "a <unk>".split())
+        self.assertEqual(list(kept)[1][1], kept.f_vocab.unk_words(
+            corpus[1][1]))
+
+    def test_no_filter(self):
+        self.assertEqual(list(filter_corpus(self.corpus)), self.corpus)
+
+
+class DedupTest(unittest.TestCase):
+
+    def test_dedup(self):
+        corpus = mkcorpus([("a b", "x"), ("a", "x"), ("a b", "x")])
+        self.assertEqual(dedup(corpus),
+                         ([(["a", "b"], ["x"]), (["a"], ["x"])], [2, 1]))
+
+    def test_deduped_corpus(self):
+        corpus = mkcorpus([("a b", "x"), ("a", "x"), ("a b", "x"),
+                           ("a", "b x"), ("a", "x"), ("c", "y")])
+
+        class Stream(object):
+            reads = 0
+
+            def __iter__(self):
+                Stream.reads += 1
+                return (pair for pair in corpus)
+
+        deduped = DedupedCorpus(Stream())
+        pairs, weights = dedup(corpus)
+        self.assertEqual(list(deduped), pairs)
+        self.assertEqual(list(deduped), pairs)
+        self.assertEqual(deduped.weights, weights)
+        self.assertEqual(len(deduped), 4)
+        self.assertEqual(Stream.reads, 3)
+
+    def test_deduped_filtered_corpus(self):
+        corpus = mkcorpus([("a b", "x"), ("a", "x"), ("a b", "x"),
+                           ("c", "y"), ("a", "x"), ("d", "z")])
+        deduped = DedupedCorpus(filter_corpus(corpus, vocab_size=2))
+        self.assertFalse(hasattr(deduped, "ids"))
+        self.assertIsNotNone(deduped.e_vocab)
+        pairs = list(deduped)
+        t = ibmmodel1._train(deduped, loop_count=2,
+                             e_vocab=deduped.e_vocab,
+                             f_vocab=deduped.f_vocab,
+                             weights=deduped.weights)
+        lt = ibmmodel1._train(pairs, loop_count=2,
+                              weights=deduped.weights)
+        self.assertEqual(dict(t.items()), dict(lt.items()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+from __future__ import division, print_function
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from smt.utils.vocabulary import Vocabulary, MappedVocabulary, encode_corpus
+
+
+class VocabularyTest(unittest.TestCase):
+
+    def test_encode(self):
+        vocab = Vocabulary("the house".split())
+        self.assertEqual(vocab.encode("the book the".split()), [0, 2, 0])
+        self.assertEqual(vocab.decode([2, 1]), ["book", "house"])
+        self.assertEqual(len(vocab), 3)
+        self.assertEqual(vocab.encode(["car"], add=False), [-1])
+        self.assertNotIn("car", vocab)
+
+    def test_unk(self):
+        vocab = Vocabulary("the house".split(), unk="<unk>")
+        self.assertEqual(vocab["the"], 1)
+        self.assertEqual(vocab.encode(["car", "house"], add=False), [0, 2])
+
+    def test_save_load(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "lang1.vocab")
+        vocab = Vocabulary("私 は 先生 です".split(), unk="<unk>")
+        vocab.save(path)
+        loaded = Vocabulary.load(path)
+        self.assertEqual(loaded.words, vocab.words)
+        self.assertEqual(loaded.unk_id, 0)
+
+    def test_mapped(self):
+        words = ["the", "house", "家", "a"]
+        encoded = [w.encode("utf-8") for w in words]
+        offsets = np.cumsum([0] + [len(b) for b in encoded])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        order = np.array(sorted(range(4), key=encoded.__getitem__))
+        vocab = MappedVocabulary(offsets, blob, order)
+        self.assertEqual(list(vocab), words)
+        self.assertEqual(vocab["家"], 2)
+        self.assertEqual(vocab.index["a"], 3)
+        self.assertIsNone(vocab.get("car"))
+        self.assertNotIn("car", vocab)
+        self.assertEqual(vocab.encode(["house", "car"], add=False), [1, -1])
+        self.assertEqual(vocab.encode(["car", "the"]), [4, 0])
+        self.assertEqual(len(vocab), 5)
+        self.assertEqual(vocab.decode([4, 2]), ["car", "家"])
+        self.assertEqual(vocab.words[-1], "car")
+        self.assertRaises(KeyError, vocab.__getitem__, "book")
+
+    def test_encode_corpus(self):
+        e_vocab, f_vocab = Vocabulary(), Vocabulary()
+        corpus = [("the house".split(), "das Haus".split()),
+                  ("the book".split(), "das Buch".split())]
+        self.assertEqual(list(encode_corpus(corpus, e_vocab, f_vocab)),
+                         [([0, 1], [0, 1]), ([0, 2], [0, 2])])
+
+
+if __name__ == '__main__':
+    unittest.main()